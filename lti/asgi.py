@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lti.settings')
+# Viva turns run as async views under ASGI. Persistent DB connections are
+# per-thread and leak under the async handler, so default them off here.
+os.environ.setdefault('VIVA_ASYNC_VIEWS', 'true')
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
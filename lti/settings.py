@@ -68,6 +68,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'lti.wsgi.application'
+ASGI_APPLICATION = 'lti.asgi.application'
+
+# Serve /viva/send/ from the async view (enabled by default by lti/asgi.py).
+VIVA_ASYNC_VIEWS = os.getenv("VIVA_ASYNC_VIEWS", "false").strip().lower() in ["1", "true", "yes", "on"]
 
 # ----------------------------------------------------
 # DATABASE
@@ -86,7 +90,7 @@ database_url = os.getenv("DATABASE_URL", "").strip()
 if database_url:
     DATABASES["default"] = dj_database_url.parse(
         database_url,
-        conn_max_age=600,
+        conn_max_age=int(os.getenv("DB_CONN_MAX_AGE", "600")),
         ssl_require=not DEBUG,
     )
 
@@ -151,6 +155,17 @@ STORAGES = {
     },
 }
 
+# ----------------------------------------------------
+# CACHE (shared across worker processes; holds compiled viva prompts)
+# ----------------------------------------------------
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", str(BASE_DIR / ".cache")),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "2000"))},
+    }
+}
+
 # ----------------------------------------------------
 # MEDIA (File uploads)
 # ----------------------------------------------------
@@ -0,0 +1,128 @@
+"""
+Sealed archives of finished vivas.
+
+Once a viva has ended and been evaluated, its transcript, event timeline,
+files, integrity flags and durations no longer change. They are written
+once to a VivaSessionArchive row as zlib-compressed JSON, so the dashboards
+and the attempt download read one row instead of reassembling the session
+from VivaMessage, InteractionLog and link rows. Feedback and the knowledge
+flag stay on VivaSession because teachers can still edit them.
+
+An archive whose version is not ARCHIVE_VERSION is ignored, so readers fall
+back to the raw rows until the archive_viva_sessions command rewrites it.
+"""
+
+import json
+import logging
+import os
+import zlib
+
+from tool.models import VivaMessage, VivaSessionArchive, VivaSessionResource, VivaSessionSubmission
+
+logger = logging.getLogger(__name__)
+
+ARCHIVES_ENABLED = os.getenv("VIVA_ARCHIVES", "true").lower() in ["1", "true", "yes", "on"]
+ARCHIVE_VERSION = 1
+
+
+def _duration_seconds(session):
+    if session.duration_seconds:
+        return session.duration_seconds
+    if session.started_at and session.ended_at:
+        return int((session.ended_at - session.started_at).total_seconds())
+    return session.duration_seconds
+
+
+def build(session):
+    """The archive payload for an ended session, read from the raw rows."""
+    # Imported here: the viva views import this module.
+    from tool.views.viva import compute_integrity_flags, session_logs
+
+    resource_links = list(VivaSessionResource.objects.filter(session=session).select_related("resource"))
+    return {
+        "version": ARCHIVE_VERSION,
+        "session_id": session.id,
+        "started_at": session.started_at.isoformat() if session.started_at else "",
+        "ended_at": session.ended_at.isoformat() if session.ended_at else "",
+        "duration_seconds": _duration_seconds(session),
+        "messages": [
+            {
+                "sender": msg.sender,
+                "text": msg.text,
+                "timestamp": msg.timestamp.isoformat(),
+                "model_answer": msg.model_answer,
+            }
+            for msg in VivaMessage.objects.filter(session=session).order_by("timestamp", "id")
+        ],
+        "events": [
+            {
+                "type": log.event_type,
+                "timestamp": log.timestamp.isoformat(),
+                "data": log.event_data,
+            }
+            for log in session_logs(session)
+        ],
+        "submissions": [
+            {
+                "submission_id": link.submission_id,
+                "file_name": link.submission.file.name if link.submission.file else "",
+                "comment": link.submission.comment,
+                "included": link.included,
+            }
+            for link in VivaSessionSubmission.objects.filter(
+                session=session,
+                submission__is_placeholder=False,
+            ).select_related("submission")
+        ],
+        # None when the session never recorded its resources; readers then use the assignment's defaults.
+        "resources": [
+            {
+                "file_name": link.resource.file.name if link.resource and link.resource.file else "",
+                "comment": link.resource.comment,
+                "included": link.included,
+            }
+            for link in resource_links
+        ] if resource_links else None,
+        "flags": compute_integrity_flags(session),
+        "tamper_suspected": bool(session.tamper_suspected),
+    }
+
+
+def seal(session):
+    """Writes (or rewrites) the session's archive. Only call it for ended sessions."""
+    data = zlib.compress(json.dumps(build(session), separators=(",", ":")).encode("utf-8"))
+    VivaSessionArchive.objects.update_or_create(
+        session=session,
+        defaults={"version": ARCHIVE_VERSION, "data": data},
+    )
+
+
+def seal_quietly(session):
+    """seal() for the end of an evaluation, where a failed archive must not fail the viva."""
+    if not ARCHIVES_ENABLED or not session.ended_at:
+        return
+    try:
+        seal(session)
+    except Exception:
+        logger.exception("Archiving viva session %s failed", session.id)
+
+
+def load(session):
+    """The session's archive payload, or None when it has no current archive."""
+    try:
+        archive = session.archive
+    except VivaSessionArchive.DoesNotExist:
+        return None
+    if archive.version != ARCHIVE_VERSION:
+        return None
+    return json.loads(zlib.decompress(bytes(archive.data)).decode("utf-8"))
+
+
+def integrity_flags(session, archived=None):
+    """The archived integrity flags for a sealed session, else freshly computed ones."""
+    from tool.views.viva import compute_integrity_flags
+
+    archived = archived if archived is not None else load(session)
+    if archived is not None:
+        return archived["flags"]
+    return compute_integrity_flags(session)
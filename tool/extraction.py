@@ -0,0 +1,216 @@
+"""
+Background text extraction for uploaded submissions and assignment resources.
+
+An upload only stores its files: each row is created with extraction_status
+"pending" and the text is pulled out here, so a large PDF no longer holds a
+web worker for as long as pdfminer takes. Files uploaded together are one
+batch and stand or fall together, as they did when extraction ran inline:
+if any of them has no extractable text, the whole batch is deleted and the
+reason is left in the cache for the status endpoints to report.
+
+The files of a batch are read in parallel on a bounded process pool shared
+by every upload in the worker process, since pdfminer is CPU-bound Python
+and threads would only take turns on the GIL. A ten-file upload takes about
+as long as its slowest file, and the web threads keep the interpreter.
+
+A viva cannot start while any of its files is still pending.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils.timezone import now
+
+from tool import question_plans, retrieval, summaries, tasks
+from tool.models import STATUS_FAILED, STATUS_PENDING, STATUS_READY, AssignmentResource, Submission
+from tool.utils import MAX_SUBMISSION_TEXT_CHARS, extract_text_from_file
+
+logger = logging.getLogger(__name__)
+
+ASYNC_EXTRACTION = os.getenv("VIVA_ASYNC_EXTRACTION", "true").lower() in ["1", "true", "yes", "on"]
+EXTRACTION_PROCESSES = int(os.getenv("EXTRACTION_PROCESSES", str(min(4, os.cpu_count() or 1))))  # 0 disables the pool
+# A batch still pending after this long lost its worker and is queued again by the status endpoints.
+STALE_SECONDS = 600
+FAILURE_TTL_SECONDS = 3600
+
+EMPTY_TEXT_MESSAGE = "No extractable text found. If this is a scanned PDF, upload a text-based version."
+FAILED_MESSAGE = "Text extraction failed. Please upload the file again."
+
+MODELS = {"submission": Submission, "resource": AssignmentResource}
+
+
+def _kind(obj):
+    return "resource" if isinstance(obj, AssignmentResource) else "submission"
+
+
+def _failure_key(kind, object_id):
+    return f"extraction_failed:{kind}:{object_id}"
+
+
+def is_text_empty(extracted):
+    if not extracted:
+        return True
+    stripped = extracted.strip()
+    if not stripped:
+        return True
+    if stripped.startswith("[Extraction Error"):
+        return True
+    return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the web process has threads and open database connections.
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _extract_in_pool(paths):
+    futures = [_get_pool().submit(extract_text_from_file, path) for path in paths]
+    try:
+        remaining = set(futures)
+        while remaining:
+            finished, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+            # One empty file dooms the batch, so stop waiting for the rest.
+            if any(is_text_empty(future.result()) for future in finished):
+                return None
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory on a huge PDF); start a fresh pool next time.
+        _reset_pool()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+    return [future.result() for future in futures]
+
+
+def extract_texts(objs):
+    """The capped text of each object's file, in order, or None if any file has none."""
+    paths = []
+    for obj in objs:
+        try:
+            paths.append(obj.file.path if obj.file else "")
+        except Exception:
+            return None
+    if EXTRACTION_PROCESSES > 0:
+        texts = _extract_in_pool(paths)
+    else:
+        texts = [extract_text_from_file(path) for path in paths]
+    if texts is None or any(is_text_empty(text) for text in texts):
+        return None
+    return [text[:MAX_SUBMISSION_TEXT_CHARS] for text in texts]
+
+
+def discard(objs):
+    for obj in objs:
+        if obj.file:
+            obj.file.delete(save=False)
+        obj.delete()
+
+
+def _after_extraction(kind, objs):
+    for obj in objs:
+        retrieval.index_text(obj)
+        summaries.queue_summary(obj)
+        if kind == "submission":
+            question_plans.queue_question_plan(obj)
+    if kind == "resource":
+        # Imported here: the viva views import this module.
+        from tool.views.viva import invalidate_assignment_context
+
+        assignment = objs[0].assignment
+        invalidate_assignment_context(assignment.id)
+        summaries.queue_resource_digest(assignment)
+
+
+def extract_batch(kind, object_ids):
+    """
+    Extracts the text of a batch uploaded together. Returns None on success,
+    else the message saying why the batch was discarded.
+    """
+    model = MODELS[kind]
+    objs = list(model.objects.select_related("assignment").filter(id__in=object_ids).order_by("id"))
+    if not objs:
+        return None
+    try:
+        texts = extract_texts(objs)
+        message = EMPTY_TEXT_MESSAGE
+    except Exception:
+        logger.exception("Extracting text from %s batch %s failed", kind, object_ids)
+        texts = None
+        message = FAILED_MESSAGE
+    if texts is None:
+        cache.set_many({_failure_key(kind, object_id): message for object_id in object_ids}, FAILURE_TTL_SECONDS)
+        discard(objs)
+        return message
+    for obj, text in zip(objs, texts):
+        obj.comment = text
+        obj.extraction_status = STATUS_READY
+    model.objects.bulk_update(objs, ["comment", "extraction_status"])
+    _after_extraction(kind, objs)
+    return None
+
+
+def queue_extraction(objs):
+    """Extracts a batch of newly uploaded, pending objects in the background."""
+    if objs:
+        tasks.submit_extraction(extract_batch, _kind(objs[0]), [obj.id for obj in objs])
+
+
+def requeue_if_stale(obj):
+    """Queues obj again if its extraction has been pending too long. Returns True if it did."""
+    if obj.extraction_status != STATUS_PENDING:
+        return False
+    if obj.created_at > now() - timedelta(seconds=STALE_SECONDS):
+        return False
+    if not cache.add(f"extraction_requeue:{_kind(obj)}:{obj.id}", 1, STALE_SECONDS):
+        return False
+    queue_extraction([obj])
+    return True
+
+
+def status_payload(kind, object_id, obj=None):
+    """
+    What the upload page polls for: {"extraction_status": "pending" | "ready" | "failed", ...}.
+    None if the object does not exist and did not fail recently.
+    """
+    if obj is None:
+        message = cache.get(_failure_key(kind, object_id))
+        if message is None:
+            return None
+        return {"status": "ok", "id": object_id, "extraction_status": STATUS_FAILED, "message": message}
+    requeue_if_stale(obj)
+    return {
+        "status": "ok",
+        "id": obj.id,
+        "extraction_status": obj.extraction_status or STATUS_READY,
+        "message": "",
+    }
+
+
+def not_ready(queryset):
+    """The rows of queryset whose text is not extracted yet."""
+    return queryset.filter(extraction_status=STATUS_PENDING)
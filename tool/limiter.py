@@ -0,0 +1,246 @@
+"""
+Cross-process limit on concurrent LLM calls.
+
+Every gunicorn/uvicorn worker shares one pool of LLM_MAX_CONCURRENCY slots,
+so a cohort starting at once queues here instead of turning the provider's
+429s into retry storms. Two backends:
+
+- "db" (default): slots are LLMSlot rows claimed with conditional updates,
+  and waiters leave an LLMTicket. A free slot goes to the waiter with the
+  best (priority, calls already in flight for its assignment, arrival)
+  order, so live viva turns go before feedback and background work, and one
+  busy assignment cannot starve another.
+- "cache": slots are cache keys claimed with cache.add(). Needs a shared,
+  atomic cache such as Redis or Memcached. Priority is kept by holding
+  LLM_LIVE_RESERVED_SLOTS back for live calls; there is no fair queue.
+
+A slot is leased for LLM_SLOT_LEASE_SECONDS so one held by a crashed worker
+frees itself. A caller that cannot get a slot within its wait limit gets
+SlotUnavailable.
+
+This caps calls in flight rather than metering a request rate with a token
+bucket. Each call holds its slot for as long as the provider takes to answer,
+so the cap already bounds the rate at about slots per call duration, and it
+adapts when the provider slows down, where a fixed rate would keep adding
+load. Short bursts that still draw a 429 are left to llm's retry-after
+backoff.
+
+Waiters poll for a slot. Each failed poll doubles the wait before the next,
+with jitter, up to LLM_LIMITER_MAX_POLL_SECONDS, so a long queue does not
+turn into a steady stream of database queries.
+"""
+
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils.timezone import now
+
+from tool.models import LLMSlot, LLMTicket
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "0"))  # 0 disables the limiter
+BACKEND = os.getenv("LLM_LIMITER_BACKEND", "db").strip().lower()
+MAX_WAIT_SECONDS = float(os.getenv("LLM_LIMITER_MAX_WAIT_SECONDS", "60"))
+POLL_SECONDS = float(os.getenv("LLM_LIMITER_POLL_SECONDS", "0.1"))
+MAX_POLL_SECONDS = float(os.getenv("LLM_LIMITER_MAX_POLL_SECONDS", "1"))
+SLOT_LEASE_SECONDS = int(os.getenv("LLM_SLOT_LEASE_SECONDS", "300"))
+LIVE_RESERVED_SLOTS = int(os.getenv("LLM_LIVE_RESERVED_SLOTS", "0"))
+TICKET_STALE_SECONDS = 5
+
+PRIORITY_LIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class SlotUnavailable(RuntimeError):
+    """No LLM slot became free within the caller's wait limit."""
+
+
+def enabled():
+    return MAX_CONCURRENCY > 0
+
+
+def _free_slots():
+    return Q(holder="") | Q(expires_at__lt=now())
+
+
+def _ensure_slots():
+    missing = MAX_CONCURRENCY - LLMSlot.objects.filter(id__lte=MAX_CONCURRENCY).count()
+    if missing > 0:
+        existing = set(LLMSlot.objects.filter(id__lte=MAX_CONCURRENCY).values_list("id", flat=True))
+        LLMSlot.objects.bulk_create(
+            [LLMSlot(id=slot_id) for slot_id in range(1, MAX_CONCURRENCY + 1) if slot_id not in existing],
+            ignore_conflicts=True,
+        )
+
+
+def _my_turn(ticket_id, priority, assignment_id, free_count):
+    """Whether this caller ranks within the first free_count waiters."""
+    waiters = list(
+        LLMTicket.objects.filter(seen_at__gte=now() - timedelta(seconds=TICKET_STALE_SECONDS))
+        .exclude(id=ticket_id)
+        .values_list("id", "priority", "assignment_id")
+    )
+    if not waiters:
+        return True
+    in_flight = Counter(dict(
+        LLMSlot.objects.filter(id__lte=MAX_CONCURRENCY, holder__gt="", expires_at__gte=now())
+        .values_list("assignment_id")
+        .annotate(count=Count("id"))
+        .values_list("assignment_id", "count")
+    ))
+    # A new caller has no ticket yet and so sorts after every waiter of equal rank.
+    me = (priority, in_flight[assignment_id], ticket_id or float("inf"))
+    ahead = sum(
+        1 for waiter_id, waiter_priority, waiter_assignment in waiters
+        if (waiter_priority, in_flight[waiter_assignment], waiter_id) < me
+    )
+    return ahead < free_count
+
+
+def _try_claim_db(holder, priority, assignment_id, ticket_id):
+    free = list(LLMSlot.objects.filter(_free_slots(), id__lte=MAX_CONCURRENCY).values_list("id", flat=True))
+    if not free or not _my_turn(ticket_id, priority, assignment_id, len(free)):
+        return False
+    expires_at = now() + timedelta(seconds=SLOT_LEASE_SECONDS)
+    for slot_id in free:
+        claimed = LLMSlot.objects.filter(_free_slots(), id=slot_id).update(
+            holder=holder,
+            assignment_id=assignment_id,
+            expires_at=expires_at,
+        )
+        if claimed:
+            return True
+    return False
+
+
+def _try_claim_cache(holder, priority):
+    slots = MAX_CONCURRENCY
+    if priority != PRIORITY_LIVE:
+        slots = max(1, MAX_CONCURRENCY - LIVE_RESERVED_SLOTS)
+    for slot_id in range(1, slots + 1):
+        if cache.add(f"llm_slot:{slot_id}", holder, SLOT_LEASE_SECONDS):
+            return f"llm_slot:{slot_id}"
+    return None
+
+
+class _Waiter:
+    """One acquire attempt; poll() is called until it returns True or time runs out."""
+
+    def __init__(self, priority, assignment_id):
+        self.holder = uuid.uuid4().hex
+        self.priority = priority
+        self.assignment_id = assignment_id
+        self.ticket_id = None
+        self.cache_key = None
+        self.attempts = 0
+
+    def delay(self, deadline):
+        """Seconds to sleep after a failed poll: doubling, jittered, and never past deadline."""
+        self.attempts += 1
+        # A waiter must refresh its ticket well within TICKET_STALE_SECONDS to keep its place.
+        ceiling = min(MAX_POLL_SECONDS, TICKET_STALE_SECONDS / 2)
+        backoff = min(ceiling, POLL_SECONDS * 2 ** min(self.attempts - 1, 10))
+        return max(0.0, min(backoff * random.uniform(0.5, 1.0), deadline - time.monotonic()))
+
+    def poll(self):
+        if BACKEND == "cache":
+            self.cache_key = _try_claim_cache(self.holder, self.priority)
+            return self.cache_key is not None
+        if _try_claim_db(self.holder, self.priority, self.assignment_id, self.ticket_id):
+            self._drop_ticket()
+            return True
+        if self.ticket_id is None:
+            LLMTicket.objects.filter(seen_at__lt=now() - timedelta(minutes=5)).delete()
+            self.ticket_id = LLMTicket.objects.create(
+                priority=self.priority,
+                assignment_id=self.assignment_id,
+                seen_at=now(),
+            ).id
+        else:
+            LLMTicket.objects.filter(id=self.ticket_id).update(seen_at=now())
+        return False
+
+    def give_up(self):
+        self._drop_ticket()
+
+    def release(self):
+        if self.cache_key is not None:
+            if cache.get(self.cache_key) == self.holder:
+                cache.delete(self.cache_key)
+            return
+        LLMSlot.objects.filter(holder=self.holder).update(holder="", assignment_id=None, expires_at=None)
+
+    def _drop_ticket(self):
+        if self.ticket_id is not None:
+            LLMTicket.objects.filter(id=self.ticket_id).delete()
+            self.ticket_id = None
+
+
+def _wait_limit(timeout):
+    return min(timeout, MAX_WAIT_SECONDS) if timeout else MAX_WAIT_SECONDS
+
+
+def _start(priority, assignment_id):
+    if BACKEND != "cache":
+        _ensure_slots()
+    return _Waiter(priority, assignment_id)
+
+
+def try_acquire(priority, assignment_id=None):
+    """
+    Claims a slot only if one is free right now, for work worth doing only
+    then (such as a hedge request). Returns the function that releases it,
+    or None. Waiting callers keep their place ahead of this one.
+    """
+    if not enabled():
+        return lambda: None
+    waiter = _start(priority, assignment_id)
+    if waiter.poll():
+        return waiter.release
+    waiter.give_up()
+    return None
+
+
+@contextmanager
+def slot(priority, assignment_id=None, timeout=None):
+    """Holds one LLM slot for the duration of the block; a no-op when disabled."""
+    if not enabled():
+        yield
+        return
+    waiter = _start(priority, assignment_id)
+    deadline = time.monotonic() + _wait_limit(timeout)
+    while not waiter.poll():
+        if time.monotonic() >= deadline:
+            waiter.give_up()
+            raise SlotUnavailable("No LLM slot became free in time")
+        time.sleep(waiter.delay(deadline))
+    try:
+        yield
+    finally:
+        waiter.release()
+
+
+@asynccontextmanager
+async def aslot(priority, assignment_id=None, timeout=None):
+    if not enabled():
+        yield
+        return
+    waiter = await sync_to_async(_start)(priority, assignment_id)
+    deadline = time.monotonic() + _wait_limit(timeout)
+    while not await sync_to_async(waiter.poll)():
+        if time.monotonic() >= deadline:
+            await sync_to_async(waiter.give_up)()
+            raise SlotUnavailable("No LLM slot became free in time")
+        await asyncio.sleep(waiter.delay(deadline))
+    try:
+        yield
+    finally:
+        await sync_to_async(waiter.release)()
@@ -0,0 +1,839 @@
+"""
+Single gateway for every OpenAI call made by the viva flow and its background jobs.
+
+One pooled HTTP client is shared per process, each call type gets its own
+timeout, transient provider errors are retried with jittered backoff, and a
+circuit breaker fails fast while the provider is degraded. Every call, failed
+or not, is recorded as an LLMCall row with its tokens, latency and retries.
+
+A caller with a hard deadline passes timeout= (seconds for the whole call,
+retries included) and may pass hedge_after= to send a second, identical
+request when the first has not answered by then; the first to succeed wins.
+Calls also wait for a slot in the cross-process limiter (tool.limiter) when
+LLM_MAX_CONCURRENCY is set, live questions ahead of everything else.
+
+LLM_PROVIDER swaps OpenAI for a local stub or recorded responses; see
+tool.llm_providers.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+
+import httpx
+import openai
+from asgiref.sync import sync_to_async
+from django.db import connection
+from openai import AsyncOpenAI, OpenAI
+
+from tool import limiter
+from tool.models import LLMCall
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").strip().lower()
+
+TASK_QUESTION = "question"
+TASK_MODEL_ANSWER = "model_answer"
+TASK_FEEDBACK = "feedback"
+TASK_KNOWLEDGE_FLAG = "knowledge_flag"
+TASK_SUMMARY = "summary"
+TASK_QUESTION_PLAN = "question_plan"
+TASK_HISTORY_SUMMARY = "history_summary"
+TASK_ANSWER_SCORE = "answer_score"
+TASK_EVALUATION = "evaluation"
+
+# Calls a student is waiting on right now; the limiter serves them first.
+LIVE_TASKS = {TASK_QUESTION}
+
+TASK_TIMEOUTS = {
+    TASK_QUESTION: float(os.getenv("LLM_TIMEOUT_QUESTION", "30")),
+    TASK_MODEL_ANSWER: float(os.getenv("LLM_TIMEOUT_MODEL_ANSWER", "30")),
+    TASK_FEEDBACK: float(os.getenv("LLM_TIMEOUT_FEEDBACK", "60")),
+    TASK_KNOWLEDGE_FLAG: float(os.getenv("LLM_TIMEOUT_KNOWLEDGE_FLAG", "30")),
+    TASK_SUMMARY: float(os.getenv("LLM_TIMEOUT_SUMMARY", "120")),
+    TASK_QUESTION_PLAN: float(os.getenv("LLM_TIMEOUT_QUESTION_PLAN", "120")),
+    TASK_HISTORY_SUMMARY: float(os.getenv("LLM_TIMEOUT_HISTORY_SUMMARY", "30")),
+    TASK_ANSWER_SCORE: float(os.getenv("LLM_TIMEOUT_ANSWER_SCORE", "30")),
+    TASK_EVALUATION: float(os.getenv("LLM_TIMEOUT_EVALUATION", "60")),
+}
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT_DEFAULT", "60"))
+
+# How much of the submission a post-question task sees: everything the viva
+# sees, only the passages retrieved for it, or nothing beyond its own prompt.
+CONTEXT_FULL = "full"
+CONTEXT_PASSAGES = "passages"
+CONTEXT_NONE = "none"
+CONTEXT_POLICIES = (CONTEXT_FULL, CONTEXT_PASSAGES, CONTEXT_NONE)
+ROUTE_FIELDS = ("model", "max_tokens", "timeout", "context")
+
+
+def _env_route(task):
+    name = task.upper()
+    context = os.getenv(f"LLM_CONTEXT_{name}", CONTEXT_FULL).strip().lower()
+    return {
+        "model": os.getenv(f"LLM_MODEL_{name}") or OPENAI_MODEL,
+        "max_tokens": int(os.getenv(f"LLM_MAX_TOKENS_{name}", "0")) or None,
+        "timeout": TASK_TIMEOUTS.get(task, DEFAULT_TIMEOUT),
+        "context": context if context in CONTEXT_POLICIES else CONTEXT_FULL,
+    }
+
+
+# Deployment-wide routing per task; Assignment.llm_routes overrides it field by field.
+TASK_ROUTES = {task: _env_route(task) for task in TASK_TIMEOUTS}
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Threads that run the two legs of a hedged synchronous call.
+HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+
+# USD per million input, cached input and output tokens, used by the llm_usage
+# report. LLM_PRICES (JSON, same shape) adds or replaces models.
+MODEL_PRICES = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+
+def _price_overrides(raw):
+    """
+    The {model: (input, cached input, output)} entries of LLM_PRICES. A bad
+    value is logged and skipped rather than stopping the app from starting.
+    """
+    try:
+        data = json.loads(raw or "{}")
+    except ValueError:
+        logger.warning("Ignoring LLM_PRICES: not valid JSON")
+        return {}
+    if not isinstance(data, dict):
+        logger.warning("Ignoring LLM_PRICES: expected a JSON object of model names to prices")
+        return {}
+    prices = {}
+    for name, value in data.items():
+        if (
+            isinstance(value, list)
+            and len(value) == 3
+            and all(isinstance(price, (int, float)) and not isinstance(price, bool) and price >= 0 for price in value)
+        ):
+            prices[name] = tuple(float(price) for price in value)
+        else:
+            logger.warning("Ignoring LLM_PRICES entry %r: expected [input, cached input, output] per million tokens", name)
+    return prices
+
+
+MODEL_PRICES.update(_price_overrides(os.getenv("LLM_PRICES")))
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_DISCARDED = "discarded"  # the losing leg of a hedged call
+
+# A timeout this close to the caller's deadline is taken to be the deadline's.
+DEADLINE_SLACK_SECONDS = 0.05
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMUnavailable(RuntimeError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+# A caller on a deadline can answer without the model after one of these.
+FALLBACK_ERRORS = (openai.APITimeoutError, LLMUnavailable)
+
+
+class CircuitBreaker:
+    """
+    Opens after a run of consecutive provider failures and rejects calls until
+    reset_seconds have passed; then a single trial call is let through.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_inconclusive(self):
+        """A call ended without saying anything about the provider, e.g. our own deadline cut it short."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("LLM circuit breaker opened after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+
+def _api_key():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    return api_key
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def openai_client():
+    global _client
+    if _client is None:
+        api_key = _api_key()
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=httpx.Client(limits=_pool_limits()),
+                )
+    return _client
+
+
+def async_openai_client():
+    # httpx async pools are bound to the event loop that created them.
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=_api_key(),
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=_pool_limits()),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def get_client(task=None):
+    """The client for task under LLM_PROVIDER."""
+    if LLM_PROVIDER == "openai":
+        return openai_client()
+    from tool import llm_providers
+
+    return llm_providers.get_client(LLM_PROVIDER, task)
+
+
+def get_async_client(task=None):
+    if LLM_PROVIDER == "openai":
+        return async_openai_client()
+    from tool import llm_providers
+
+    return llm_providers.get_async_client(LLM_PROVIDER, task)
+
+
+def _route_override(field, value):
+    if field == "model":
+        return str(value).strip() or None
+    if field == "max_tokens":
+        return int(value) if int(value) > 0 else None
+    if field == "timeout":
+        return float(value) if float(value) > 0 else None
+    value = str(value).strip().lower()
+    return value if value in CONTEXT_POLICIES else None
+
+
+def route(task, assignment=None):
+    """
+    The model, max_tokens, timeout (seconds) and context policy for task,
+    with the assignment's llm_routes entry for that task applied on top.
+    """
+    resolved = dict(TASK_ROUTES.get(task) or _env_route(task))
+    overrides = (getattr(assignment, "llm_routes", None) or {}).get(task)
+    if isinstance(overrides, dict):
+        for field in ROUTE_FIELDS:
+            if overrides.get(field) in (None, ""):
+                continue
+            try:
+                value = _route_override(field, overrides[field])
+            except (TypeError, ValueError):
+                value = None
+            if value is not None:
+                resolved[field] = value
+    return resolved
+
+
+def _route_assignment(session, assignment):
+    if assignment is not None:
+        return assignment
+    return session.submission.assignment if session is not None else None
+
+
+def task_timeout(seconds):
+    return httpx.Timeout(seconds, connect=min(CONNECT_TIMEOUT, seconds))
+
+
+def _is_retryable(exc):
+    if isinstance(exc, RETRYABLE_ERRORS):
+        return True
+    return isinstance(exc, openai.APIStatusError) and exc.status_code >= 500
+
+
+def _provider_answered(exc):
+    """Whether exc is the provider rejecting a valid-looking request, which says it is up."""
+    if isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return False
+    return isinstance(exc, openai.APIStatusError) and 400 <= exc.status_code < 500
+
+
+def _retry_delay(exc, attempt):
+    retry_after = None
+    response = getattr(exc, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX_SECONDS)
+    ceiling = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _deadline_cut(exc, deadline):
+    """
+    Whether exc is a timeout imposed by the caller's deadline (such as a live
+    turn's budget) rather than by the provider's route timeout.
+    """
+    return (
+        isinstance(exc, openai.APITimeoutError)
+        and deadline is not None
+        and time.monotonic() >= deadline - DEADLINE_SLACK_SECONDS
+    )
+
+
+def _check_breaker():
+    if not breaker.allow():
+        raise LLMUnavailable("LLM provider unavailable (circuit open)")
+
+
+def _request_kwargs(task, messages, temperature, model, extra, session=None, assignment=None):
+    task_route = route(task, _route_assignment(session, assignment))
+    kwargs = {
+        "model": model or task_route["model"],
+        "messages": messages,
+        "temperature": temperature,
+        "timeout": task_timeout(task_route["timeout"]),
+    }
+    if task_route["max_tokens"]:
+        kwargs["max_completion_tokens"] = task_route["max_tokens"]
+    kwargs.update(extra)
+    return kwargs
+
+
+def _response_text(response):
+    return (response.choices[0].message.content or "").strip()
+
+
+def _usage_counts(usage):
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens or 0, cached, usage.completion_tokens or 0
+
+
+def price(model):
+    """(input, cached input, output) USD per million tokens for model, or None if unknown."""
+    model = model or ""
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    # Responses name a dated snapshot, e.g. gpt-4.1-mini-2025-04-14.
+    matches = [name for name in MODEL_PRICES if model.startswith(f"{name}-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def call_cost(model, prompt_tokens, cached_tokens, completion_tokens):
+    prices = price(model)
+    if prices is None:
+        return None
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * prices[0] + cached_tokens * prices[1] + completion_tokens * prices[2]) / 1_000_000
+
+
+def _elapsed_ms(started):
+    return int((time.monotonic() - started) * 1000)
+
+
+def record_usage(
+    task,
+    model,
+    usage,
+    session=None,
+    assignment=None,
+    latency_ms=0,
+    retries=0,
+    status=STATUS_OK,
+    error="",
+    hedged=False,
+):
+    """Stores one ledger row for a call; telemetry never fails the call."""
+    prompt_tokens, cached_tokens, completion_tokens = _usage_counts(usage)
+    try:
+        assignment_id = assignment.id if assignment is not None else None
+        if assignment_id is None and session is not None:
+            assignment_id = session.submission.assignment_id
+        LLMCall.objects.create(
+            assignment_id=assignment_id,
+            session_id=session.id if session is not None else None,
+            task=task,
+            model=model or "",
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached_tokens,
+            completion_tokens=completion_tokens,
+            latency_ms=latency_ms,
+            retries=retries,
+            status=status,
+            error=error[:100],
+            hedged=hedged,
+        )
+    except Exception:
+        logger.exception("Could not record LLM usage for %s call", task)
+
+
+arecord_usage = sync_to_async(record_usage)
+
+
+def _record_failure(task, kwargs, exc, started, session, assignment):
+    record_usage(
+        task,
+        kwargs.get("model"),
+        None,
+        session,
+        assignment,
+        latency_ms=_elapsed_ms(started),
+        retries=getattr(exc, "llm_retries", 0),
+        status=STATUS_ERROR,
+        error=type(exc).__name__,
+    )
+
+
+_arecord_failure = sync_to_async(_record_failure)
+
+
+def _deadline(timeout):
+    return time.monotonic() + timeout if timeout else None
+
+
+def _attempt_kwargs(kwargs, deadline):
+    """kwargs with the attempt's timeout cut down to what is left before deadline."""
+    if deadline is None:
+        return kwargs
+    remaining = max(deadline - time.monotonic(), 0.1)
+    if remaining >= kwargs["timeout"].read:
+        return kwargs
+    return {**kwargs, "timeout": task_timeout(remaining)}
+
+
+def _retry_allowed(attempt, delay, deadline):
+    if attempt >= MAX_RETRIES:
+        return False
+    return deadline is None or time.monotonic() + delay < deadline
+
+
+def _create(client, kwargs, deadline=None):
+    """Returns (response, retries); a raised exception carries llm_retries."""
+    attempt = 0
+    while True:
+        _check_breaker()
+        try:
+            return client.chat.completions.create(**_attempt_kwargs(kwargs, deadline)), attempt
+        except Exception as exc:
+            exc.llm_retries = attempt
+            if _deadline_cut(exc, deadline):
+                # A slow answer that missed our budget is not a provider failure.
+                breaker.record_inconclusive()
+                raise
+            if not _is_retryable(exc):
+                # A 400 means the provider is up; a bad key or a local bug says nothing either way.
+                if _provider_answered(exc):
+                    breaker.record_success()
+                else:
+                    breaker.record_inconclusive()
+                raise
+            breaker.record_failure()
+            delay = _retry_delay(exc, attempt)
+            if not _retry_allowed(attempt, delay, deadline):
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+
+async def _acreate(client, kwargs, deadline=None):
+    attempt = 0
+    while True:
+        _check_breaker()
+        try:
+            return await client.chat.completions.create(**_attempt_kwargs(kwargs, deadline)), attempt
+        except asyncio.CancelledError:
+            breaker.record_inconclusive()
+            raise
+        except Exception as exc:
+            exc.llm_retries = attempt
+            if _deadline_cut(exc, deadline):
+                # A slow answer that missed our budget is not a provider failure.
+                breaker.record_inconclusive()
+                raise
+            if not _is_retryable(exc):
+                # A 400 means the provider is up; a bad key or a local bug says nothing either way.
+                if _provider_answered(exc):
+                    breaker.record_success()
+                else:
+                    breaker.record_inconclusive()
+                raise
+            breaker.record_failure()
+            delay = _retry_delay(exc, attempt)
+            if not _retry_allowed(attempt, delay, deadline):
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def _slot_args(task, session, assignment):
+    """The (priority, assignment_id) a call queues for its limiter slot with."""
+    priority = limiter.PRIORITY_LIVE if task in LIVE_TASKS else limiter.PRIORITY_BACKGROUND
+    return priority, getattr(_route_assignment(session, assignment), "id", None)
+
+
+@contextmanager
+def _limited(task, session, assignment, timeout):
+    try:
+        with limiter.slot(*_slot_args(task, session, assignment), timeout=timeout):
+            yield
+    except limiter.SlotUnavailable as exc:
+        raise LLMUnavailable(str(exc)) from exc
+
+
+@asynccontextmanager
+async def _alimited(task, session, assignment, timeout):
+    try:
+        async with limiter.aslot(*_slot_args(task, session, assignment), timeout=timeout):
+            yield
+    except limiter.SlotUnavailable as exc:
+        raise LLMUnavailable(str(exc)) from exc
+
+
+def _hedge_callback(fn, caller):
+    """
+    Wraps a done-callback for a hedge leg. It runs on the hedge thread that
+    finished the leg, which keeps no connection between calls, or straight
+    away on the caller's thread if the leg had already finished.
+    """
+    def callback(future):
+        try:
+            fn(future)
+        finally:
+            if threading.current_thread() is not caller:
+                connection.close()
+    return callback
+
+
+class _HedgeSlot:
+    """The extra limiter slot of a hedged call, freed once both of its legs have finished."""
+
+    def __init__(self, release):
+        self._release = release
+        self._legs = 2
+        self._lock = threading.Lock()
+
+    def leg_done(self, future):
+        with self._lock:
+            self._legs -= 1
+            last = self._legs == 0
+        if last:
+            self._release()
+
+
+def _discard_leg(task, kwargs, session, assignment, started, future):
+    """Done-callback for the losing leg of a hedged call: closes or records it."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    response, retries = future.result()
+    if kwargs.get("stream"):
+        close = getattr(response, "close", None)
+        if close is not None:
+            close()
+    else:
+        record_usage(
+            task, response.model, response.usage, session, assignment,
+            _elapsed_ms(started), retries, status=STATUS_DISCARDED, hedged=True,
+        )
+
+
+def _create_hedged(task, kwargs, deadline, hedge_after, session, assignment):
+    """
+    Like _create, but sends a second request if the first has not answered
+    within hedge_after seconds and a limiter slot is free for it. Returns
+    (response, retries, hedged).
+    """
+    if not hedge_after:
+        return (*_create(get_client(task), kwargs, deadline), False)
+    started = time.monotonic()
+    first = _hedge_executor.submit(_create, get_client(task), kwargs, deadline)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return (*first.result(), False)
+    release = limiter.try_acquire(*_slot_args(task, session, assignment))
+    if release is None:
+        # Hedging without a slot would break the concurrency limit, so keep waiting instead.
+        return (*first.result(), False)
+    caller = threading.current_thread()
+    second = _hedge_executor.submit(_create, get_client(task), kwargs, deadline)
+    hedge_slot = _HedgeSlot(release)
+    for leg in (first, second):
+        leg.add_done_callback(_hedge_callback(hedge_slot.leg_done, caller))
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                discard = partial(_discard_leg, task, kwargs, session, assignment, started)
+                for other in pending | (done - {future}):
+                    other.add_done_callback(_hedge_callback(discard, caller))
+                return (*future.result(), True)
+            error = future.exception()
+    raise error
+
+
+async def _acreate_hedged(task, kwargs, deadline, hedge_after, session, assignment):
+    """Async _create_hedged; the losing leg is cancelled rather than left to finish."""
+    if not hedge_after:
+        return (*await _acreate(get_async_client(task), kwargs, deadline), False)
+    first = asyncio.ensure_future(_acreate(get_async_client(task), kwargs, deadline))
+    done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    if done:
+        return (*first.result(), False)
+    release = await sync_to_async(lambda: limiter.try_acquire(*_slot_args(task, session, assignment)))()
+    if release is None:
+        return (*await first, False)
+    try:
+        pending = {first, asyncio.ensure_future(_acreate(get_async_client(task), kwargs, deadline))}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for leg in done:
+                if leg.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return (*leg.result(), True)
+                error = leg.exception()
+        raise error
+    finally:
+        await sync_to_async(release)()
+
+
+def complete(
+    task,
+    messages,
+    temperature,
+    model=None,
+    session=None,
+    assignment=None,
+    timeout=None,
+    hedge_after=None,
+    **extra,
+):
+    """
+    Runs one chat completion for the given task and returns its text. Usage is
+    attributed to the session and/or assignment when they are given.
+    """
+    kwargs = _request_kwargs(task, messages, temperature, model, extra, session, assignment)
+    started = time.monotonic()
+    deadline = _deadline(timeout)
+    try:
+        with _limited(task, session, assignment, timeout):
+            response, retries, hedged = _create_hedged(task, kwargs, deadline, hedge_after, session, assignment)
+    except Exception as exc:
+        _record_failure(task, kwargs, exc, started, session, assignment)
+        raise
+    breaker.record_success()
+    record_usage(
+        task, response.model, response.usage, session, assignment,
+        _elapsed_ms(started), retries, hedged=hedged,
+    )
+    return _response_text(response)
+
+
+async def acomplete(
+    task,
+    messages,
+    temperature,
+    model=None,
+    session=None,
+    assignment=None,
+    timeout=None,
+    hedge_after=None,
+    **extra,
+):
+    kwargs = _request_kwargs(task, messages, temperature, model, extra, session, assignment)
+    started = time.monotonic()
+    deadline = _deadline(timeout)
+    try:
+        async with _alimited(task, session, assignment, timeout):
+            response, retries, hedged = await _acreate_hedged(task, kwargs, deadline, hedge_after, session, assignment)
+    except Exception as exc:
+        await _arecord_failure(task, kwargs, exc, started, session, assignment)
+        raise
+    breaker.record_success()
+    await arecord_usage(
+        task, response.model, response.usage, session, assignment,
+        _elapsed_ms(started), retries, hedged=hedged,
+    )
+    return _response_text(response)
+
+
+def _chunk_text(chunk):
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def _stream_kwargs(task, messages, temperature, model, extra, session=None, assignment=None):
+    kwargs = _request_kwargs(task, messages, temperature, model, extra, session, assignment)
+    kwargs["stream"] = True
+    # The usage block only arrives, in a final choice-less chunk, when asked for.
+    kwargs.setdefault("stream_options", {"include_usage": True})
+    return kwargs
+
+
+def stream(
+    task,
+    messages,
+    temperature,
+    model=None,
+    session=None,
+    assignment=None,
+    timeout=None,
+    hedge_after=None,
+    **extra,
+):
+    """
+    Streams a chat completion, yielding text deltas. Retries and hedging only
+    happen before the response has started.
+    """
+    kwargs = _stream_kwargs(task, messages, temperature, model, extra, session, assignment)
+    started = time.monotonic()
+    retries = 0
+    hedged = False
+    usage = None
+    response_model = None
+    deadline = _deadline(timeout)
+    try:
+        with _limited(task, session, assignment, timeout):
+            response, retries, hedged = _create_hedged(task, kwargs, deadline, hedge_after, session, assignment)
+            for chunk in response:
+                response_model = getattr(chunk, "model", None) or response_model
+                usage = getattr(chunk, "usage", None) or usage
+                content = _chunk_text(chunk)
+                if content:
+                    yield content
+    except Exception as exc:
+        if not hasattr(exc, "llm_retries"):
+            # Failed mid-stream; _create has already accounted for its own errors.
+            if _is_retryable(exc) and not _deadline_cut(exc, deadline):
+                breaker.record_failure()
+            exc.llm_retries = retries
+        _record_failure(task, kwargs, exc, started, session, assignment)
+        raise
+    breaker.record_success()
+    record_usage(task, response_model, usage, session, assignment, _elapsed_ms(started), retries, hedged=hedged)
+
+
+async def astream(
+    task,
+    messages,
+    temperature,
+    model=None,
+    session=None,
+    assignment=None,
+    timeout=None,
+    hedge_after=None,
+    **extra,
+):
+    kwargs = _stream_kwargs(task, messages, temperature, model, extra, session, assignment)
+    started = time.monotonic()
+    retries = 0
+    hedged = False
+    usage = None
+    response_model = None
+    deadline = _deadline(timeout)
+    try:
+        async with _alimited(task, session, assignment, timeout):
+            response, retries, hedged = await _acreate_hedged(task, kwargs, deadline, hedge_after, session, assignment)
+            async for chunk in response:
+                response_model = getattr(chunk, "model", None) or response_model
+                usage = getattr(chunk, "usage", None) or usage
+                content = _chunk_text(chunk)
+                if content:
+                    yield content
+    except Exception as exc:
+        if not hasattr(exc, "llm_retries"):
+            # Failed mid-stream; _create has already accounted for its own errors.
+            if _is_retryable(exc) and not _deadline_cut(exc, deadline):
+                breaker.record_failure()
+            exc.llm_retries = retries
+        await _arecord_failure(task, kwargs, exc, started, session, assignment)
+        raise
+    breaker.record_success()
+    await arecord_usage(
+        task, response_model, usage, session, assignment,
+        _elapsed_ms(started), retries, hedged=hedged,
+    )
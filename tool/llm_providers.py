@@ -0,0 +1,389 @@
+"""
+Stand-ins for the OpenAI client, selected with LLM_PROVIDER.
+
+- "openai" (default): the real provider.
+- "stub": answers locally with deterministic, schema-valid responses for each
+  task, after a sampled latency and with an optional error rate, so the viva
+  flow can be load tested and exercised in CI without network access.
+- "record": calls OpenAI and writes every response to a cassette file.
+- "replay": answers from the cassette files only.
+
+Every client here exposes the chat.completions.create() surface that tool.llm
+uses and returns objects shaped like the OpenAI SDK's, so retries, the circuit
+breaker and usage recording behave exactly as they do against the provider.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from tool import llm
+
+PROVIDER_OPENAI = "openai"
+PROVIDER_STUB = "stub"
+PROVIDER_RECORD = "record"
+PROVIDER_REPLAY = "replay"
+
+CASSETTE_DIR = Path(os.getenv("LLM_CASSETTE_DIR", "llm_cassettes"))
+
+# Latency of a stubbed call: "fixed", "uniform" (0 to 2x the median) or
+# "lognormal" (median LLM_STUB_LATENCY_MS, spread as the log-scale sigma).
+STUB_LATENCY_DISTRIBUTION = os.getenv("LLM_STUB_LATENCY_DISTRIBUTION", "lognormal").strip().lower()
+STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "0"))
+STUB_LATENCY_SPREAD = float(os.getenv("LLM_STUB_LATENCY_SPREAD", "0.5"))
+STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+STUB_SEED = os.getenv("LLM_STUB_SEED", "0")
+STUB_MODEL = "stub"
+STUB_CHUNK_CHARS = 12
+STUB_CHUNK_DELAY_MS = float(os.getenv("LLM_STUB_CHUNK_DELAY_MS", "0"))
+
+STUB_QUESTIONS = [
+    "Can you summarise the main argument of your submission in your own words?",
+    "What led you to choose the approach you used, and what alternatives did you consider?",
+    "Which piece of evidence best supports your conclusion, and why?",
+    "What is the most significant limitation of your work?",
+    "How would you extend this work if you had more time?",
+    "Can you explain one key term from your submission as you would to a classmate?",
+]
+
+STUB_FEEDBACK = (
+    "You engaged with the questions and referred to parts of your submission, "
+    "but several answers stayed general. Next time, support each point with a "
+    "specific example or figure from your work and explain how it backs up your claim."
+)
+
+
+def _usage(prompt_chars, completion_chars):
+    return SimpleNamespace(
+        prompt_tokens=max(1, prompt_chars // 4),
+        completion_tokens=max(1, completion_chars // 4),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _completion(text, model, usage):
+    return SimpleNamespace(
+        model=model,
+        usage=usage,
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+    )
+
+
+def _chunks(text, model, usage):
+    for start in range(0, len(text), STUB_CHUNK_CHARS):
+        yield SimpleNamespace(
+            model=model,
+            usage=None,
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=text[start:start + STUB_CHUNK_CHARS]))],
+        )
+    yield SimpleNamespace(model=model, usage=usage, choices=[])
+
+
+def _usage_from_json(data):
+    return SimpleNamespace(
+        prompt_tokens=data.get("prompt_tokens", 0),
+        completion_tokens=data.get("completion_tokens", 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=data.get("cached_tokens", 0)),
+    )
+
+
+def request_key(kwargs):
+    """Identifies a request by everything that shapes its answer."""
+    payload = {
+        name: kwargs.get(name)
+        for name in ("model", "messages", "temperature", "response_format")
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _prompt_chars(kwargs):
+    return sum(len(str(message.get("content") or "")) for message in kwargs.get("messages") or [])
+
+
+# ---------------------------------------------------------
+# Stub provider
+# ---------------------------------------------------------
+def _stub_rng(kwargs):
+    return random.Random(f"{STUB_SEED}:{request_key(kwargs)}")
+
+
+def _stub_question(kwargs, rng):
+    turn = sum(1 for message in kwargs.get("messages") or [] if message.get("role") == "assistant")
+    question = STUB_QUESTIONS[(turn + rng.randrange(len(STUB_QUESTIONS))) % len(STUB_QUESTIONS)]
+    return json.dumps({
+        "question": question,
+        "model_answer": "A strong answer would restate the relevant claim and support it with evidence from the submission.",
+    })
+
+
+def _stub_model_answers(kwargs):
+    content = str((kwargs.get("messages") or [{}])[-1].get("content") or "")
+    ids = [int(number) for number in re.findall(r"^(\d+)\. ", content, re.MULTILINE)]
+    count = max(ids) if ids else 1
+    return json.dumps({
+        "answers": [
+            {"id": idx, "model_answer": "The submission addresses this by stating its claim and supporting it with evidence."}
+            for idx in range(1, count + 1)
+        ]
+    })
+
+
+def _stub_answer_scores(kwargs, rng):
+    content = str((kwargs.get("messages") or [{}])[-1].get("content") or "")
+    ids = [int(number) for number in re.findall(r"^(\d+)\. ", content, re.MULTILINE)]
+    return json.dumps({"scores": [{"id": idx, "score": rng.choice([1, 2, 3])} for idx in ids or [1]]})
+
+
+def _stub_question_plan(kwargs):
+    system = str((kwargs.get("messages") or [{}])[0].get("content") or "")
+    match = re.search(r"up to (\d+)", system)
+    count = min(int(match.group(1)) if match else 5, len(STUB_QUESTIONS))
+    aspects = ["argument", "methodology", "evidence", "limitations", "implications", "concepts"]
+    return json.dumps({
+        "questions": [
+            {
+                "aspect": aspects[idx % len(aspects)],
+                "question": STUB_QUESTIONS[idx],
+                "model_answer": "The submission answers this directly; a strong response cites the relevant section.",
+            }
+            for idx in range(count)
+        ]
+    })
+
+
+def _stub_summary(kwargs):
+    content = str((kwargs.get("messages") or [{}])[-1].get("content") or "")
+    words = content.split()
+    return f"Summary ({len(words)} words in): " + " ".join(words[:40])
+
+
+def stub_text(task, kwargs):
+    """The stub's answer to a request for task; the same request always gets the same answer."""
+    rng = _stub_rng(kwargs)
+    if task == llm.TASK_QUESTION:
+        return _stub_question(kwargs, rng)
+    if task == llm.TASK_MODEL_ANSWER:
+        return _stub_model_answers(kwargs)
+    if task == llm.TASK_FEEDBACK:
+        return STUB_FEEDBACK
+    if task == llm.TASK_KNOWLEDGE_FLAG:
+        return rng.choice(["Aligned", "Partially aligned", "Needs clarification", "Unclear"])
+    if task == llm.TASK_QUESTION_PLAN:
+        return _stub_question_plan(kwargs)
+    if task == llm.TASK_ANSWER_SCORE:
+        return _stub_answer_scores(kwargs, rng)
+    if task == llm.TASK_EVALUATION:
+        return json.dumps({
+            "feedback": STUB_FEEDBACK,
+            "knowledge_flag": rng.choice(["Aligned", "Partially aligned", "Needs clarification", "Unclear"]),
+        })
+    return _stub_summary(kwargs)
+
+
+def sample_latency():
+    """Seconds a stubbed call takes before it answers."""
+    median = STUB_LATENCY_MS / 1000
+    if median <= 0:
+        return 0.0
+    if STUB_LATENCY_DISTRIBUTION == "fixed":
+        return median
+    if STUB_LATENCY_DISTRIBUTION == "uniform":
+        return random.uniform(0, 2 * median)
+    return random.lognormvariate(math.log(median), STUB_LATENCY_SPREAD)
+
+
+def _stub_failure(kwargs, latency):
+    """The error a stubbed call should raise, if any, and how long it waits first."""
+    request = httpx.Request("POST", "https://stub.invalid/v1/chat/completions")
+    timeout = kwargs.get("timeout")
+    read_timeout = getattr(timeout, "read", None)
+    if read_timeout is not None and latency > read_timeout:
+        return openai.APITimeoutError(request=request), read_timeout
+    if STUB_ERROR_RATE and random.random() < STUB_ERROR_RATE:
+        response = httpx.Response(500, request=request)
+        return openai.InternalServerError("Stubbed provider error", response=response, body=None), latency
+    return None, latency
+
+
+def _stub_response(kwargs, text):
+    usage = _usage(_prompt_chars(kwargs), len(text))
+    if kwargs.get("stream"):
+        return _chunks(text, STUB_MODEL, usage)
+    return _completion(text, STUB_MODEL, usage)
+
+
+class _StubCompletions:
+    def __init__(self, task):
+        self.task = task
+
+    def create(self, **kwargs):
+        error, delay = _stub_failure(kwargs, sample_latency())
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        response = _stub_response(kwargs, stub_text(self.task, kwargs))
+        if kwargs.get("stream") and STUB_CHUNK_DELAY_MS:
+            return _paced(response)
+        return response
+
+
+class _AsyncStubCompletions(_StubCompletions):
+    async def create(self, **kwargs):
+        error, delay = _stub_failure(kwargs, sample_latency())
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        response = _stub_response(kwargs, stub_text(self.task, kwargs))
+        if kwargs.get("stream"):
+            return _apaced(response)
+        return response
+
+
+def _paced(chunks):
+    for chunk in chunks:
+        time.sleep(STUB_CHUNK_DELAY_MS / 1000)
+        yield chunk
+
+
+async def _apaced(chunks):
+    for chunk in chunks:
+        if STUB_CHUNK_DELAY_MS:
+            await asyncio.sleep(STUB_CHUNK_DELAY_MS / 1000)
+        yield chunk
+
+
+# ---------------------------------------------------------
+# Record / replay
+# ---------------------------------------------------------
+def cassette_path(task, kwargs):
+    return CASSETTE_DIR / (task or "default") / f"{request_key(kwargs)}.json"
+
+
+def _save_cassette(task, kwargs, text, model, usage):
+    prompt_tokens, cached_tokens, completion_tokens = llm._usage_counts(usage)
+    path = cassette_path(task, kwargs)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "request": {
+            "model": kwargs.get("model"),
+            "messages": kwargs.get("messages"),
+            "temperature": kwargs.get("temperature"),
+            "response_format": kwargs.get("response_format"),
+        },
+        "response": {
+            "text": text,
+            "model": model or "",
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+        },
+    }, indent=2), encoding="utf-8")
+
+
+def _load_cassette(task, kwargs):
+    path = cassette_path(task, kwargs)
+    if not path.exists():
+        raise LookupError(f"No recorded LLM response for this {task} request ({path})")
+    data = json.loads(path.read_text(encoding="utf-8"))["response"]
+    usage = _usage_from_json(data)
+    if kwargs.get("stream"):
+        return _chunks(data["text"], data.get("model", ""), usage)
+    return _completion(data["text"], data.get("model", ""), usage)
+
+
+def _recording_stream(task, kwargs, response):
+    parts = []
+    usage = None
+    model = None
+    for chunk in response:
+        model = getattr(chunk, "model", None) or model
+        usage = getattr(chunk, "usage", None) or usage
+        if chunk.choices:
+            parts.append(chunk.choices[0].delta.content or "")
+        yield chunk
+    _save_cassette(task, kwargs, "".join(parts), model, usage)
+
+
+async def _arecording_stream(task, kwargs, response):
+    parts = []
+    usage = None
+    model = None
+    async for chunk in response:
+        model = getattr(chunk, "model", None) or model
+        usage = getattr(chunk, "usage", None) or usage
+        if chunk.choices:
+            parts.append(chunk.choices[0].delta.content or "")
+        yield chunk
+    _save_cassette(task, kwargs, "".join(parts), model, usage)
+
+
+class _RecordingCompletions:
+    def __init__(self, task, client):
+        self.task = task
+        self.client = client
+
+    def create(self, **kwargs):
+        response = self.client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _recording_stream(self.task, kwargs, response)
+        _save_cassette(self.task, kwargs, llm._response_text(response), response.model, response.usage)
+        return response
+
+
+class _AsyncRecordingCompletions(_RecordingCompletions):
+    async def create(self, **kwargs):
+        response = await self.client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _arecording_stream(self.task, kwargs, response)
+        _save_cassette(self.task, kwargs, llm._response_text(response), response.model, response.usage)
+        return response
+
+
+class _ReplayCompletions:
+    def __init__(self, task):
+        self.task = task
+
+    def create(self, **kwargs):
+        return _load_cassette(self.task, kwargs)
+
+
+class _AsyncReplayCompletions(_ReplayCompletions):
+    async def create(self, **kwargs):
+        response = _load_cassette(self.task, kwargs)
+        if kwargs.get("stream"):
+            return _apaced(response)
+        return response
+
+
+def _client(completions):
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+def get_client(provider, task):
+    if provider == PROVIDER_STUB:
+        return _client(_StubCompletions(task))
+    if provider == PROVIDER_RECORD:
+        return _client(_RecordingCompletions(task, llm.openai_client()))
+    if provider == PROVIDER_REPLAY:
+        return _client(_ReplayCompletions(task))
+    raise ValueError(f"Unknown LLM_PROVIDER: {provider}")
+
+
+def get_async_client(provider, task):
+    if provider == PROVIDER_STUB:
+        return _client(_AsyncStubCompletions(task))
+    if provider == PROVIDER_RECORD:
+        return _client(_AsyncRecordingCompletions(task, llm.async_openai_client()))
+    if provider == PROVIDER_REPLAY:
+        return _client(_AsyncReplayCompletions(task))
+    raise ValueError(f"Unknown LLM_PROVIDER: {provider}")
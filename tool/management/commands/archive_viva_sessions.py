@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils.timezone import now
+
+from tool import archives
+from tool.models import STATUS_READY, InteractionLog, VivaMessage, VivaSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Archives evaluated viva sessions that have no current archive, e.g. ones that ended before archiving "
+        "existed or whose archive version is out of date. With --prune, also deletes the messages and "
+        "session-tagged event logs of sessions archived more than --prune-after-days ago."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Sessions per batch (default 200).")
+        parser.add_argument("--prune", action="store_true", help="Delete raw rows that an archive now covers.")
+        parser.add_argument(
+            "--prune-after-days",
+            type=int,
+            default=30,
+            help="Only prune sessions archived at least this many days ago (default 30).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report counts without changing anything.")
+
+    def handle(self, *args, **options):
+        sealable = VivaSession.objects.filter(
+            ended_at__isnull=False,
+            evaluation_status__in=["", STATUS_READY],
+        ).filter(Q(archive__isnull=True) | ~Q(archive__version=archives.ARCHIVE_VERSION))
+        # A pruned session has nothing left to rebuild an outdated archive from.
+        sealable = sealable.exclude(archive__isnull=False, vivamessage__isnull=True).distinct()
+
+        archived = 0
+        last_id = 0
+        while True:
+            batch = list(
+                sealable.filter(id__gt=last_id)
+                .select_related("submission__assignment")
+                .order_by("id")[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            if not options["dry_run"]:
+                for session in batch:
+                    archives.seal(session)
+            archived += len(batch)
+
+        pruned = 0
+        if options["prune"]:
+            prunable = VivaSession.objects.filter(
+                archive__version=archives.ARCHIVE_VERSION,
+                archive__created_at__lt=now() - timedelta(days=options["prune_after_days"]),
+                vivamessage__isnull=False,
+            ).distinct()
+            session_ids = list(prunable.values_list("id", flat=True))
+            pruned = len(session_ids)
+            if not options["dry_run"]:
+                for start in range(0, len(session_ids), options["batch_size"]):
+                    chunk = session_ids[start:start + options["batch_size"]]
+                    VivaMessage.objects.filter(session_id__in=chunk).delete()
+                    # Untagged logs can belong to several sessions of the same submission, so only tagged ones go.
+                    InteractionLog.objects.filter(event_data__session_id__in=chunk).delete()
+
+        prefix = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(f"{prefix} {archived} sessions.")
+        if options["prune"]:
+            prefix = "Would prune" if options["dry_run"] else "Pruned"
+            self.stdout.write(f"{prefix} raw rows for {pruned} archived sessions.")
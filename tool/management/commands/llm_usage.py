@@ -0,0 +1,117 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils.timezone import now
+
+from tool import llm
+from tool.models import LLMCall
+
+GROUPINGS = {
+    "assignment": ("assignment_id", "assignment__title"),
+    "session": ("session_id", "assignment__title"),
+    "day": ("day",),
+    "task": ("task",),
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    index = max(0, math.ceil(fraction * len(values)) - 1)
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = "Prints LLM calls, tokens, prompt-cache hit rate, cost and latency from the LLMCall ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Only include calls from the last N days (0 for all).")
+        parser.add_argument("--assignment", type=int, help="Only include this assignment ID.")
+        parser.add_argument("--session", type=int, help="Only include this viva session ID.")
+        parser.add_argument(
+            "--by",
+            choices=sorted(GROUPINGS),
+            default="assignment",
+            help="Group the usage table by assignment (default), session, day or task.",
+        )
+
+    def handle(self, *args, **options):
+        calls = LLMCall.objects.all()
+        if options["days"]:
+            calls = calls.filter(created_at__gte=now() - timedelta(days=options["days"]))
+        if options["assignment"]:
+            calls = calls.filter(assignment_id=options["assignment"])
+        if options["session"]:
+            calls = calls.filter(session_id=options["session"])
+        if not calls.exists():
+            self.stdout.write("No LLM calls recorded.")
+            return
+
+        self.usage_table(calls, options["by"])
+        self.stdout.write("")
+        self.latency_table(calls)
+
+    def usage_table(self, calls, by):
+        fields = GROUPINGS[by]
+        if by == "day":
+            calls = calls.annotate(day=TruncDate("created_at"))
+        # Grouped by model too so each row's cost uses the right prices.
+        rows = calls.values(*fields, "model").annotate(
+            calls=Count("id"),
+            errors=Count("id", filter=Q(status=llm.STATUS_ERROR)),
+            prompt=Sum("prompt_tokens"),
+            cached=Sum("cached_tokens"),
+            completion=Sum("completion_tokens"),
+        )
+        groups = defaultdict(lambda: {
+            "calls": 0, "errors": 0, "prompt": 0, "cached": 0, "completion": 0, "cost": 0.0, "priced": True,
+        })
+        for row in rows:
+            group = groups[tuple(row[field] for field in fields)]
+            for name in ("calls", "errors", "prompt", "cached", "completion"):
+                group[name] += row[name] or 0
+            cost = llm.call_cost(row["model"], row["prompt"] or 0, row["cached"] or 0, row["completion"] or 0)
+            if cost is None:
+                group["priced"] = group["priced"] and not (row["prompt"] or row["completion"])
+            else:
+                group["cost"] += cost
+
+        header = by.capitalize()
+        self.stdout.write(
+            f"{header:<40} {'Calls':>7} {'Errors':>7} {'Prompt':>12} {'Cached':>12} {'Hit rate':>9} {'Output':>10} {'Cost $':>10}"
+        )
+        ordered = sorted(groups.items(), key=lambda item: (str(item[0][0]) if by == "day" else -item[1]["prompt"]))
+        for key, group in ordered:
+            if by == "day":
+                label = str(key[0])
+            elif by == "task":
+                label = key[0]
+            else:
+                label = f"{key[0] or '-'} {key[1] or '(none)'}"
+            hit_rate = f"{group['cached'] / group['prompt']:.0%}" if group["prompt"] else "-"
+            cost = f"{group['cost']:.4f}" + ("" if group["priced"] else "+")
+            self.stdout.write(
+                f"{label[:40]:<40} {group['calls']:>7} {group['errors']:>7} {group['prompt']:>12} "
+                f"{group['cached']:>12} {hit_rate:>9} {group['completion']:>10} {cost:>10}"
+            )
+        if any(not group["priced"] for group in groups.values()):
+            self.stdout.write("+ includes calls to models without a price (set LLM_PRICES).")
+
+    def latency_table(self, calls):
+        latencies = defaultdict(list)
+        retries = defaultdict(int)
+        for task, latency_ms, retry_count in calls.filter(status=llm.STATUS_OK).values_list("task", "latency_ms", "retries"):
+            latencies[task].append(latency_ms)
+            retries[task] += retry_count
+        self.stdout.write(f"{'Task':<20} {'Calls':>7} {'p50 ms':>9} {'p95 ms':>9} {'Max ms':>9} {'Retries':>8}")
+        for task in sorted(latencies):
+            values = sorted(latencies[task])
+            self.stdout.write(
+                f"{task:<20} {len(values):>7} {percentile(values, 0.5):>9} {percentile(values, 0.95):>9} "
+                f"{values[-1]:>9} {retries[task]:>8}"
+            )
@@ -0,0 +1,129 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Max, Q
+from django.utils.timezone import now
+
+from tool import tasks
+from tool.models import STATUS_FAILED, STATUS_PENDING, VivaSession
+from tool.views import viva
+
+logger = logging.getLogger(__name__)
+
+
+def evaluate_one(session_id):
+    close_old_connections()
+    try:
+        viva.run_evaluation(session_id)
+    except Exception:
+        logger.exception("Evaluation of viva session %s failed", session_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        "Ends viva sessions whose time ran out while the browser was gone, then writes their feedback "
+        "and knowledge flag in batches. Also retries evaluations lost with their worker. "
+        "Meant to run from cron every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-seconds",
+            type=int,
+            default=120,
+            help="How long past its time limit, and since its last heartbeat, a session must be (default 120).",
+        )
+        parser.add_argument(
+            "--stuck-minutes",
+            type=int,
+            default=15,
+            help="Retry evaluations still pending this long after the viva ended (default 15).",
+        )
+        parser.add_argument("--retry-failed", action="store_true", help="Also retry evaluations that failed.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Sessions per batch (default 100).")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=tasks.BACKGROUND_WORKERS,
+            help="Evaluations run at once within a batch (default BACKGROUND_WORKERS).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be done without changing anything.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        closed = self.close_abandoned()
+        retried = self.retry_evaluations()
+        if options["dry_run"]:
+            self.stdout.write(f"Would close {closed} abandoned sessions and retry {retried} evaluations.")
+        else:
+            self.stdout.write(f"Closed {closed} abandoned sessions and retried {retried} evaluations.")
+
+    def batches(self, sessions):
+        """Yields lists of sessions in id order without holding one large queryset open."""
+        last_id = 0
+        while True:
+            batch = list(sessions.filter(id__gt=last_id).order_by("id")[: self.options["batch_size"]])
+            if not batch:
+                return
+            last_id = batch[-1].id
+            yield batch
+
+    def evaluate(self, sessions):
+        """Runs the evaluations not already running elsewhere. Returns how many it ran."""
+        if self.options["dry_run"] or not sessions:
+            return len(sessions)
+        # run_evaluation releases the lock when it finishes, so take it first as queue_evaluation does.
+        session_ids = [session.id for session in sessions if viva.claim_evaluation(session.id)]
+        if not session_ids:
+            return 0
+        VivaSession.objects.filter(id__in=session_ids).update(evaluation_status=STATUS_PENDING)
+        with ThreadPoolExecutor(max_workers=max(1, self.options["workers"])) as pool:
+            list(pool.map(evaluate_one, session_ids))
+        return len(session_ids)
+
+    def close_abandoned(self):
+        current = now()
+        grace = timedelta(seconds=self.options["grace_seconds"])
+        candidates = (
+            VivaSession.objects.filter(ended_at__isnull=True, started_at__lt=current - grace)
+            .filter(Q(last_heartbeat_at__isnull=True) | Q(last_heartbeat_at__lt=current - grace))
+            .select_related("submission__assignment")
+            .annotate(last_message_at=Max("vivamessage__timestamp"))
+        )
+        closed = 0
+        for batch in self.batches(candidates):
+            expired = []
+            for session in batch:
+                deadline = session.started_at + timedelta(seconds=session.submission.assignment.viva_duration_seconds or 0)
+                if deadline + grace > current:
+                    continue
+                # The viva ended when the student was last seen, or when its time ran out.
+                last_seen = max(
+                    moment for moment in (session.started_at, session.last_heartbeat_at, session.last_message_at) if moment
+                )
+                session.ended_at = min(last_seen, deadline)
+                session.duration_seconds = int((session.ended_at - session.started_at).total_seconds())
+                expired.append(session)
+            if expired and not self.options["dry_run"]:
+                VivaSession.objects.bulk_update(expired, ["ended_at", "duration_seconds"])
+            self.evaluate(expired)
+            closed += len(expired)
+        return closed
+
+    def retry_evaluations(self):
+        stuck = Q(
+            evaluation_status=STATUS_PENDING,
+            ended_at__lt=now() - timedelta(minutes=self.options["stuck_minutes"]),
+        )
+        if self.options["retry_failed"]:
+            stuck |= Q(evaluation_status=STATUS_FAILED)
+        stuck = VivaSession.objects.filter(stuck)
+        retried = 0
+        for batch in self.batches(stuck):
+            retried += self.evaluate(batch)
+        return retried
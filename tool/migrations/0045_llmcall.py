@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-18 07:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0044_merge_20260109_0803'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=32)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('cached_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('assignment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='tool.assignment')),
+                ('session', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to='tool.vivasession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['assignment', 'created_at'], name='tool_llmcal_assignm_403ee0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0046_textindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignmentresource',
+            name='summary',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='assignmentresource',
+            name='summary_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='summary',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='summary_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0047_document_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='resource_digest',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='resource_digest_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='resource_digest_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0048_assignment_resource_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='question_plan',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='question_plan_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0049_submission_question_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vivasession',
+            name='history_summary',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='vivasession',
+            name='history_summary_message_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
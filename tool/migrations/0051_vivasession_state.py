@@ -0,0 +1,65 @@
+# Generated by Django 5.0 on 2026-10-18 07:49
+
+import re
+
+from django.db import migrations, models
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+def _priority_questions(text):
+    questions = []
+    for raw in str(text or "").splitlines():
+        line = re.sub(r"^[-*\u2022\s]+", "", raw.strip())
+        line = re.sub(r"^[0-9]+[.)\s]+", "", line).strip()
+        if line:
+            questions.append(line)
+    return questions
+
+
+def _seed_session_state(apps, schema_editor):
+    VivaSession = apps.get_model("tool", "VivaSession")
+    VivaMessage = apps.get_model("tool", "VivaMessage")
+    sessions = VivaSession.objects.select_related("submission__assignment")
+    for session in sessions.iterator():
+        asked_ai = [
+            _normalize(text)
+            for text in VivaMessage.objects.filter(session=session, sender="ai").values_list("text", flat=True)
+        ]
+        if not asked_ai:
+            continue
+        priority = _priority_questions(session.submission.assignment.additional_prompts)
+        session.turn_count = len(asked_ai)
+        session.asked_priority = [
+            idx for idx, question in enumerate(priority)
+            if _normalize(question) and any(_normalize(question) in asked for asked in asked_ai)
+        ]
+        session.save(update_fields=["turn_count", "asked_priority"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0050_vivasession_history_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vivasession',
+            name='asked_priority',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='vivasession',
+            name='aspects_covered',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='vivasession',
+            name='turn_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(_seed_session_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0051_vivasession_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='llm_routes',
+            field=models.JSONField(blank=True, default=dict, help_text='Per-task LLM overrides, e.g. {"knowledge_flag": {"model": "gpt-4.1-nano", "max_tokens": 10}}.'),
+        ),
+    ]
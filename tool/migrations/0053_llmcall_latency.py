@@ -0,0 +1,37 @@
+# Generated by Django 5.0 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0052_assignment_llm_routes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmcall',
+            name='error',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='llmcall',
+            name='latency_ms',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='llmcall',
+            name='retries',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='llmcall',
+            name='status',
+            field=models.CharField(default='ok', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='llmcall',
+            index=models.Index(fields=['task', 'created_at'], name='tool_llmcal_task_950b87_idx'),
+        ),
+    ]
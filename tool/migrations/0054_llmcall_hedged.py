@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0053_llmcall_latency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmcall',
+            name='hedged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
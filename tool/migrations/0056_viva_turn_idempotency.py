@@ -0,0 +1,32 @@
+# Generated by Django 5.0 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0055_llm_limiter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vivamessage',
+            name='client_message_id',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='vivasession',
+            name='turn_lock_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vivasession',
+            name='turn_lock_holder',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='vivamessage',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_message_id', ''), _negated=True), fields=('session', 'client_message_id'), name='unique_viva_client_message'),
+        ),
+    ]
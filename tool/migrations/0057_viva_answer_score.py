@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0056_viva_turn_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vivamessage',
+            name='answer_score',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0057_viva_answer_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vivasession',
+            name='evaluation_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0 on 2026-10-18 08:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0058_viva_evaluation_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VivaSessionArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveSmallIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='tool.vivasession')),
+            ],
+        ),
+    ]
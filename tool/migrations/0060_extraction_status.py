@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0059_viva_session_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignmentresource',
+            name='extraction_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='extraction_status',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0060_extraction_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assignment',
+            name='resource_digest_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='assignmentresource',
+            name='summary_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='summary_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0062_question_plan_status_choices'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vivasession',
+            name='evaluation_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=16),
+        ),
+    ]
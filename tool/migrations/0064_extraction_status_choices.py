@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tool', '0063_evaluation_status_choices'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assignmentresource',
+            name='extraction_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='extraction_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=16),
+        ),
+    ]
@@ -4,6 +4,17 @@ from django.utils import timezone
 
 User = get_user_model()
 
+# Lifecycle of work done in the background for a row (summaries, question
+# plans, text extraction, viva evaluation). "" means it was never queued.
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+JOB_STATUS_CHOICES = [
+    (STATUS_PENDING, "Pending"),
+    (STATUS_READY, "Ready"),
+    (STATUS_FAILED, "Failed"),
+]
+
 class Assignment(models.Model):
     slug = models.SlugField(unique=True)  # matches Canvas resource_link_id
     title = models.CharField(max_length=255)
@@ -82,6 +93,15 @@ class Assignment(models.Model):
     allow_student_uploads = models.BooleanField(default=True)
     self_enroll_token = models.CharField(max_length=64, unique=True, null=True, blank=True)
     self_enroll_domain = models.CharField(max_length=255, blank=True, default="")
+    # Condensed text of the included resources, shared by every session (tool.summaries).
+    resource_digest = models.TextField(blank=True)
+    resource_digest_key = models.CharField(max_length=64, blank=True)
+    resource_digest_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
+    llm_routes = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text='Per-task LLM overrides, e.g. {"knowledge_flag": {"model": "gpt-4.1-nano", "max_tokens": 10}}.',
+    )
 
 
     def __str__(self):
@@ -123,6 +143,14 @@ class Submission(models.Model):
     file = models.FileField(upload_to="submissions/")
     comment = models.TextField(blank=True)
     is_placeholder = models.BooleanField(default=False)
+    # Text is extracted from the file in the background (tool.extraction); "" predates that.
+    extraction_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
+    # Section summaries and a digest of long extracted text (tool.summaries).
+    summary = models.JSONField(default=dict, blank=True)
+    summary_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
+    # Prepared viva questions with model answers (tool.question_plans).
+    question_plan = models.JSONField(default=dict, blank=True)
+    question_plan_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
 
     # Optional: store grade if using AGS later
     grade = models.FloatField(null=True, blank=True)
@@ -137,6 +165,9 @@ class AssignmentResource(models.Model):
     comment = models.TextField(blank=True)
     included = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    extraction_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
+    summary = models.JSONField(default=dict, blank=True)
+    summary_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
 
     def __str__(self):
         file_name = self.file.name if self.file else "resource"
@@ -176,6 +207,20 @@ class VivaSession(models.Model):
     )
     rating = models.IntegerField(null=True, blank=True)
     knowledge_flag = models.CharField(max_length=32, blank=True)
+    # Rolling summary of the messages up to and including history_summary_message_id.
+    history_summary = models.TextField(blank=True)
+    history_summary_message_id = models.IntegerField(null=True, blank=True)
+    # Viva progress, advanced as examiner messages are written so that a turn
+    # reads it from this row instead of rescanning the transcript.
+    turn_count = models.PositiveIntegerField(default=0)
+    asked_priority = models.JSONField(default=list, blank=True)  # indices into additional_prompts
+    aspects_covered = models.JSONField(default=list, blank=True)  # question plan aspects
+    # Post-viva job writing the model answers, feedback and knowledge flag:
+    # "" before the viva ends, then pending, ready or failed.
+    evaluation_status = models.CharField(max_length=16, blank=True, choices=JOB_STATUS_CHOICES)
+    # Lease held while a /viva/send/ request is working on this session, so turns run one at a time.
+    turn_lock_holder = models.CharField(max_length=32, blank=True)
+    turn_lock_expires_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Viva for {self.submission.user_id} (session {self.id})"
@@ -187,6 +232,20 @@ class VivaMessage(models.Model):
     text = models.TextField()
     model_answer = models.TextField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Student answers only: 0 (no evidence) to 3 (aligned with the question's model answer),
+    # written in the background as the viva runs. Null until scored.
+    answer_score = models.PositiveSmallIntegerField(null=True, blank=True)
+    # Idempotency key sent by the browser; a retried request with the same key is replayed.
+    client_message_id = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["session", "client_message_id"],
+                condition=~models.Q(client_message_id=""),
+                name="unique_viva_client_message",
+            ),
+        ]
 
 
 class VivaSessionSubmission(models.Model):
@@ -207,12 +266,108 @@ class VivaSessionResource(models.Model):
         unique_together = ("session", "resource")
 
 
+class VivaSessionArchive(models.Model):
+    """
+    Sealed copy of a finished viva: transcript, event timeline, files, integrity
+    flags and durations as zlib-compressed JSON (see tool.archives).
+    """
+    session = models.OneToOneField(VivaSession, on_delete=models.CASCADE, related_name="archive")
+    version = models.PositiveSmallIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class InteractionLog(models.Model):
     submission = models.ForeignKey(Submission, on_delete=models.CASCADE)
     event_type = models.CharField(max_length=50)   # "keypress", "paste", "blur", etc.
     event_data = models.JSONField(default=dict)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+
+class TextIndex(models.Model):
+    """Retrieval index (tool.retrieval) over the extracted text of one submission or resource."""
+    submission = models.OneToOneField(
+        Submission,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="text_index",
+    )
+    resource = models.OneToOneField(
+        AssignmentResource,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="text_index",
+    )
+    text_hash = models.CharField(max_length=64)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class LLMCall(models.Model):
+    """Ledger row for one call made through tool.llm: tokens, latency and outcome."""
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="llm_calls",
+    )
+    session = models.ForeignKey(
+        VivaSession,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="llm_calls",
+    )
+    task = models.CharField(max_length=32)
+    model = models.CharField(max_length=100, blank=True)
+    prompt_tokens = models.IntegerField(default=0)
+    cached_tokens = models.IntegerField(default=0)  # part of prompt_tokens served from the provider's prompt cache
+    completion_tokens = models.IntegerField(default=0)
+    latency_ms = models.PositiveIntegerField(default=0)  # wall time including retries and, for streams, the whole stream
+    retries = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=16, default="ok")  # "ok" or "error"
+    error = models.CharField(max_length=100, blank=True)  # exception class of a failed call
+    hedged = models.BooleanField(default=False)  # a second, identical request was sent
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["assignment", "created_at"]),
+            models.Index(fields=["task", "created_at"]),
+        ]
+
+    @property
+    def uncached_tokens(self):
+        return max(self.prompt_tokens - self.cached_tokens, 0)
+
+    def __str__(self):
+        return f"{self.task} call ({self.cached_tokens}/{self.prompt_tokens} prompt tokens cached)"
+
+
+class LLMSlot(models.Model):
+    """One unit of the cross-process LLM concurrency limit; see tool.limiter."""
+    holder = models.CharField(max_length=32, blank=True)
+    assignment_id = models.IntegerField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"LLM slot {self.id} ({self.holder or 'free'})"
+
+
+class LLMTicket(models.Model):
+    """A caller waiting for an LLMSlot, kept fresh while it waits."""
+    priority = models.PositiveSmallIntegerField()
+    assignment_id = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    seen_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"LLM ticket {self.id} (priority {self.priority})"
+
+
 class ToolConfig(models.Model):
     """
     Stores Canvas platform details.
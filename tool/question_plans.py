@@ -0,0 +1,151 @@
+"""
+Question plans: an ordered list of viva questions, each with a model answer,
+prepared in the background for a submission so that the opening turn of a
+viva is served without waiting on the LLM.
+"""
+
+import json
+import os
+import re
+
+from tool import llm, retrieval, summaries, tasks
+from tool.models import STATUS_FAILED, STATUS_PENDING, STATUS_READY, AssignmentResource, Submission
+
+QUESTION_PLANS_ENABLED = os.getenv("VIVA_QUESTION_PLANS", "true").lower() in ["1", "true", "yes", "on"]
+PLAN_QUESTIONS = int(os.getenv("VIVA_PLAN_QUESTIONS", "8"))
+PLAN_INPUT_CHARS = 150000
+PLAN_RESOURCE_CHARS = 20000
+
+QUESTION_PLAN_PROMPT = """You are preparing a time-limited, text-based academic viva on the student's submission.
+Write an ordered plan of up to {count} viva questions. The first must be a broad opening question suitable to start the viva.
+The rest should cover the argument, methodology, evidence, limitations and implications of the work, in a sensible order.
+Each question is one sentence, asks one thing, and can be answered from the submission materials.
+For each question, give a concise exemplar answer (2-4 sentences) grounded only in the materials. Do not invent details.
+Respond ONLY in JSON: {{"questions": [{{"aspect": "argument", "question": "...", "model_answer": "..."}}]}}"""
+
+
+def _plan_materials(submission):
+    assignment = submission.assignment
+    parts = []
+    if assignment.resource_digest_status == STATUS_READY and assignment.resource_digest:
+        parts.append(f"Assignment resources (digest):\n{assignment.resource_digest}")
+    else:
+        resources = AssignmentResource.objects.filter(assignment=assignment, included=True).exclude(comment="")
+        for resource in resources.order_by("id"):
+            file_name = resource.file.name if resource.file else "Resource file"
+            parts.append(f"Resource: {file_name}\n{resource.comment.strip()[:PLAN_RESOURCE_CHARS]}")
+
+    text = (submission.comment or "").strip()
+    if text:
+        file_name = submission.file.name if submission.file else "Uploaded text"
+        summary = summaries.ready_summary(submission) if len(text) > PLAN_INPUT_CHARS else None
+        if summary:
+            sections = "\n\n".join(f"{section['title']}:\n{section['summary']}" for section in summary["sections"])
+            parts.append(f"File: {file_name} (summarised)\nDocument digest:\n{summary['digest']}\n\n{sections}")
+        else:
+            parts.append(f"File: {file_name}\n{text[:PLAN_INPUT_CHARS]}")
+    return parts
+
+
+def _plan_messages(submission, materials):
+    assignment = submission.assignment
+    settings_lines = [
+        f"Assignment: {assignment.title or 'Untitled assignment'}",
+        f"Description: {assignment.description or ''}",
+        f"Tone: {assignment.viva_tone or 'Supportive'}",
+    ]
+    if assignment.viva_instructions:
+        settings_lines.append(f"Viva instructions: {assignment.viva_instructions.strip()}")
+    return [
+        {"role": "system", "content": QUESTION_PLAN_PROMPT.format(count=PLAN_QUESTIONS)},
+        {
+            "role": "user",
+            "content": "\n".join(settings_lines) + "\n\nSubmission materials:\n" + "\n\n".join(materials),
+        },
+    ]
+
+
+def parse_plan(raw_text):
+    """Returns [{"aspect", "question", "model_answer"}] from the model's JSON, dropping malformed items."""
+    raw_text = (raw_text or "").strip()
+    try:
+        data = json.loads(raw_text)
+    except Exception:
+        match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except Exception:
+            data = {}
+    items = data.get("questions") if isinstance(data, dict) else data
+    plan = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        question = str(item.get("question") or "").strip()
+        if not question:
+            continue
+        plan.append({
+            "aspect": str(item.get("aspect") or "").strip(),
+            "question": question,
+            "model_answer": str(item.get("model_answer") or "").strip(),
+        })
+    return plan[:PLAN_QUESTIONS]
+
+
+def build_question_plan(submission_id):
+    """Background job: prepares and stores the question plan for one submission."""
+    submission = Submission.objects.select_related("assignment").filter(id=submission_id).first()
+    if submission is None:
+        return
+    try:
+        materials = _plan_materials(submission)
+        questions = []
+        if materials:
+            raw_text = llm.complete(
+                llm.TASK_QUESTION_PLAN,
+                _plan_messages(submission, materials),
+                temperature=0.4,
+                assignment=submission.assignment,
+                response_format={"type": "json_object"},
+            )
+            questions = parse_plan(raw_text)
+    except Exception:
+        Submission.objects.filter(id=submission_id).update(question_plan_status=STATUS_FAILED)
+        raise
+    Submission.objects.filter(id=submission_id).update(
+        question_plan={"text_hash": retrieval.text_hash(submission.comment or ""), "questions": questions},
+        question_plan_status=STATUS_READY if questions else STATUS_FAILED,
+    )
+
+
+def queue_question_plan(submission):
+    """
+    Prepares the submission's question plan in the background unless a current
+    one is ready, one is queued, or the last attempt failed. Returns True when a
+    job was queued.
+    """
+    if not QUESTION_PLANS_ENABLED:
+        return False
+    if submission.question_plan_status not in ("", STATUS_READY):
+        return False
+    if ready_question_plan(submission):
+        return False
+    claimed = Submission.objects.filter(
+        id=submission.id,
+        question_plan_status=submission.question_plan_status,
+    ).update(question_plan_status=STATUS_PENDING)
+    if not claimed:
+        return False
+    submission.question_plan_status = STATUS_PENDING
+    tasks.submit(build_question_plan, submission.id)
+    return True
+
+
+def ready_question_plan(submission):
+    """The submission's planned questions if the plan is ready and matches its text, else []."""
+    plan = submission.question_plan or {}
+    if submission.question_plan_status != STATUS_READY:
+        return []
+    if plan.get("text_hash") != retrieval.text_hash(submission.comment or ""):
+        return []
+    return plan.get("questions") or []
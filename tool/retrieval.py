@@ -0,0 +1,221 @@
+"""
+Chunking and a local BM25 index over extracted submission and resource text.
+
+Long documents are split into passages once, when their text is extracted; a
+viva turn then sends the passages relevant to the current exchange instead of
+the whole document.
+"""
+
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from tool.models import TextIndex
+
+INDEX_VERSION = 1
+CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "1500"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+MAX_OUTLINE_ITEMS = 40
+# Loaded indexes kept per process, so a viva turn does not reload the postings.
+INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "32"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have having
+he her here hers herself him himself his how i if in into is it its itself just me more most my myself no
+nor not now of off on once only or other our ours ourselves out over own same she should so some such than
+that the their theirs them themselves then there these they this those through to too under until up very
+was we were what when where which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+SECTION_NAMES = (
+    "abstract", "summary", "introduction", "background", "literature review", "methods", "methodology",
+    "materials and methods", "results", "findings", "discussion", "analysis", "evaluation", "conclusion",
+    "conclusions", "limitations", "future work", "recommendations", "references", "bibliography",
+    "appendix", "acknowledgements", "acknowledgments",
+)
+HEADING_RE = re.compile(
+    r"^(?:#{1,6}\s+\S.{0,100}"  # markdown
+    r"|(?:\d{1,2}(?:\.\d{1,2}){0,3}\.?|[IVX]{1,5}\.)\s+[A-Z][^.!?]{1,100}"  # "2.1 Methods", "IV. Results"
+    r"|(?:chapter|section|part)\s+\w{1,6}\b.{0,80})$",
+    re.IGNORECASE,
+)
+
+
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall((text or "").lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def chunk_spans(text, chunk_chars=CHUNK_CHARS):
+    """
+    Splits text into [start, end] spans of at most chunk_chars, preferring to
+    break at a paragraph, then a line, then a sentence boundary.
+    """
+    spans = []
+    length = len(text)
+    start = 0
+    while start < length:
+        while start < length and text[start].isspace():
+            start += 1
+        if start >= length:
+            break
+        end = min(start + chunk_chars, length)
+        if end < length:
+            floor = start + chunk_chars // 2
+            cut = text.rfind("\n\n", floor, end)
+            if cut == -1:
+                cut = text.rfind("\n", floor, end)
+            if cut == -1:
+                cut = text.rfind(". ", floor, end)
+                if cut != -1:
+                    cut += 1
+            if cut != -1:
+                end = cut
+        spans.append([start, end])
+        start = end
+    return spans
+
+
+def _is_heading(line):
+    stripped = line.strip()
+    if not stripped or len(stripped) > 110:
+        return False
+    if stripped.lower().rstrip(":") in SECTION_NAMES:
+        return True
+    return bool(HEADING_RE.match(stripped))
+
+
+def find_outline(text, spans):
+    """Headings found in the text, each with the index of the chunk it starts."""
+    outline = []
+    span_starts = [start for start, _ in spans]
+    offset = 0
+    chunk = 0
+    for line in text.splitlines(keepends=True):
+        if _is_heading(line):
+            while chunk + 1 < len(span_starts) and span_starts[chunk + 1] <= offset:
+                chunk += 1
+            outline.append({"title": line.strip().lstrip("#").strip(), "chunk": chunk})
+            if len(outline) >= MAX_OUTLINE_ITEMS:
+                break
+        offset += len(line)
+    return outline
+
+
+def build_index(text):
+    text = text or ""
+    spans = chunk_spans(text)
+    lengths = []
+    postings = {}
+    for chunk_id, (start, end) in enumerate(spans):
+        counts = Counter(tokenize(text[start:end]))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append([chunk_id, tf])
+    return {
+        "version": INDEX_VERSION,
+        "spans": spans,
+        "lengths": lengths,
+        "postings": postings,
+        "outline": find_outline(text, spans),
+    }
+
+
+def search(index, query, top_k):
+    """Returns [(chunk_id, score)] for the top_k chunks matching query, best first."""
+    spans = index.get("spans") or []
+    terms = Counter(tokenize(query))
+    if not spans or not terms:
+        return []
+    lengths = np.asarray(index["lengths"], dtype=float)
+    avgdl = lengths.mean() or 1.0
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avgdl)
+    scores = np.zeros(len(spans))
+    postings = index["postings"]
+    for term in terms:
+        posting = postings.get(term)
+        if not posting:
+            continue
+        rows = np.asarray(posting)
+        ids = rows[:, 0]
+        tf = rows[:, 1].astype(float)
+        idf = math.log(1 + (len(spans) - len(posting) + 0.5) / (len(posting) + 0.5))
+        scores[ids] += idf * tf * (BM25_K1 + 1) / (tf + norm[ids])
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [(int(i), float(scores[i])) for i in order if scores[i] > 0]
+
+
+def _owner_field(obj):
+    return "resource" if obj._meta.model_name == "assignmentresource" else "submission"
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def _remember(key, stored_hash, text_length, data):
+    with _index_cache_lock:
+        _index_cache[key] = (stored_hash, text_length, data)
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+
+def _cached(key):
+    with _index_cache_lock:
+        entry = _index_cache.get(key)
+        if entry is not None:
+            _index_cache.move_to_end(key)
+        return entry
+
+
+def index_text(obj):
+    """
+    Builds and stores the index for a Submission or AssignmentResource from its
+    extracted text (the comment field).
+    """
+    text = obj.comment or ""
+    index, _ = TextIndex.objects.update_or_create(
+        **{_owner_field(obj): obj},
+        defaults={"text_hash": text_hash(text), "data": build_index(text)},
+    )
+    _remember((_owner_field(obj), obj.pk), index.text_hash, len(text), index.data)
+    return index
+
+
+def get_index(obj):
+    """
+    Returns the index data for obj, rebuilding it if the text has changed.
+
+    Every write of the text goes through index_text, so the stored hash says
+    whether this process's copy is current: a turn only reads that hash, and
+    loads the postings or hashes the text again only when it has moved (or
+    the text length no longer matches what was indexed).
+    """
+    owner = {_owner_field(obj): obj}
+    key = (_owner_field(obj), obj.pk)
+    text_length = len(obj.comment or "")
+    stored_hash = TextIndex.objects.filter(**owner).values_list("text_hash", flat=True).first()
+    entry = _cached(key)
+    if entry is not None and stored_hash is not None and entry[:2] == (stored_hash, text_length):
+        return entry[2]
+    index = TextIndex.objects.filter(**owner).first()
+    if (
+        index is None
+        or index.text_hash != text_hash(obj.comment)
+        or index.data.get("version") != INDEX_VERSION
+    ):
+        return index_text(obj).data
+    _remember(key, index.text_hash, text_length, index.data)
+    return index.data
@@ -757,11 +757,17 @@ document.addEventListener("DOMContentLoaded", () => {
         return bubble;
     };
 
-    const showVivaThinking = () => {
+    const showVivaThinking = (label = "") => {
         if (!vivaChatWindow) return null;
         const bubble = document.createElement("div");
         bubble.className = "bubble ai thinking";
         bubble.innerHTML = `<span class="dots"><span></span><span></span><span></span></span>`;
+        if (label) {
+            const text = document.createElement("span");
+            text.className = "thinking-label";
+            text.textContent = label;
+            bubble.appendChild(text);
+        }
         vivaChatWindow.appendChild(bubble);
         scrollVivaChat();
         return bubble;
@@ -903,6 +909,50 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     };
 
+    const SEND_ATTEMPTS = 3;
+    const SEND_RETRY_DELAY_MS = 1500;
+    const wait = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    const newClientMessageId = () => (
+        window.crypto?.randomUUID
+            ? window.crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(16).slice(2)}`
+    );
+
+    const sendVivaMessage = async (payload) => {
+        // Retries reuse the client_message_id, so the server replays rather than recording the message twice.
+        const body = { ...payload, client_message_id: newClientMessageId() };
+        let response = null;
+        for (let attempt = 0; attempt < SEND_ATTEMPTS; attempt += 1) {
+            if (attempt) await wait(SEND_RETRY_DELAY_MS * attempt);
+            response = await sendToServer(body);
+            if (response && response.status !== "busy") break;
+        }
+        return response;
+    };
+
+    const EVALUATION_POLL_MS = 2000;
+    const EVALUATION_MAX_POLLS = 90;
+
+    const waitForEvaluation = async (sessionId, response) => {
+        // The server evaluates an ended viva in the background; poll until the feedback lands.
+        let latest = response;
+        for (let poll = 0; poll < EVALUATION_MAX_POLLS && latest?.evaluation_status === "pending"; poll += 1) {
+            await wait(EVALUATION_POLL_MS);
+            try {
+                const res = await fetch(`/viva/evaluation/${sessionId}/`, {
+                    headers: jsHeaders,
+                    credentials: "same-origin",
+                });
+                if (res.ok) {
+                    latest = (await res.json().catch(() => null)) || latest;
+                }
+            } catch (err) {
+                console.warn("Failed to check viva evaluation", err);
+            }
+        }
+        return latest;
+    };
+
     const ensureSession = async (startUrl) => {
         if (vivaSessionId) return vivaSessionId;
         if (!startUrl) return null;
@@ -928,6 +978,10 @@ document.addEventListener("DOMContentLoaded", () => {
                 body: JSON.stringify(bodyPayload),
             });
             const data = await res.json();
+            if (data.status === "processing") {
+                setUploadHint(data.message || "Your files are still being processed.");
+                return null;
+            }
             if (data.session_id) {
                 vivaSessionId = data.session_id;
                 lastSessionId = vivaSessionId;
@@ -1034,7 +1088,7 @@ document.addEventListener("DOMContentLoaded", () => {
         const duration = Math.max(0, vivaTotalSeconds - vivaTimeRemaining);
         const closingSessionId = vivaSessionId || lastSessionId;
         if (!closingSessionId) return;
-        const response = await sendToServer({
+        let response = await sendVivaMessage({
             session_id: closingSessionId,
             sender: "student",
             text: finalText || undefined,
@@ -1057,20 +1111,107 @@ document.addEventListener("DOMContentLoaded", () => {
             updateVivaControls();
         }
         stopHeartbeat();
+        response = await waitForEvaluation(closingSessionId, response);
         return {
             sessionId: closingSessionId,
             feedbackText: response?.feedback_text || "",
             feedbackVisible: !!response?.feedback_visible,
+            modelAnswers: Array.isArray(response?.model_answers) ? response.model_answers : [],
         };
     };
 
-    const requestAiReply = async (sessionId, text) => {
-        if (!sessionId) return null;
-        return await sendToServer({
-            session_id: sessionId,
-            sender: "student",
-            text,
+    const applyModelAnswers = (history, modelAnswers) => {
+        // Model answers are written after each question is sent; fill in the ones the chat never received.
+        if (!Array.isArray(history) || !modelAnswers?.length) return history;
+        const byText = new Map(modelAnswers.map((item) => [(item.text || "").trim(), item.model_answer || ""]));
+        history.forEach((entry) => {
+            if ((entry.sender || "").toLowerCase() !== "ai" || entry.model_answer) return;
+            const answer = byText.get((entry.text || "").trim());
+            if (answer) entry.model_answer = answer;
+        });
+        return history;
+    };
+
+    const parseSseEvent = (raw) => {
+        let event = "message";
+        const dataLines = [];
+        raw.split("\n").forEach((line) => {
+            if (line.startsWith("event:")) event = line.slice(6).trim();
+            else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
         });
+        if (!dataLines.length) return null;
+        try {
+            return { event, data: JSON.parse(dataLines.join("\n")) };
+        } catch (err) {
+            return null;
+        }
+    };
+
+    const requestAiReplyOnce = async (sessionId, text, clientMessageId, onDelta) => {
+        try {
+            const res = await fetch("/viva/send/", {
+                method: "POST",
+                headers: {
+                    "Content-Type": "application/json",
+                    "Accept": "text/event-stream",
+                    ...jsHeaders,
+                },
+                credentials: "same-origin",
+                body: JSON.stringify({
+                    session_id: sessionId,
+                    sender: "student",
+                    text,
+                    stream: true,
+                    client_message_id: clientMessageId,
+                }),
+            });
+            const contentType = res.headers.get("content-type") || "";
+            if (!res.body || !contentType.includes("text/event-stream")) {
+                const data = await res.json().catch(() => null);
+                if (!res.ok) {
+                    return data || { status: "error" };
+                }
+                return data;
+            }
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let finalPayload = null;
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary = buffer.indexOf("\n\n");
+                while (boundary >= 0) {
+                    const parsed = parseSseEvent(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                    if (parsed?.event === "delta" && parsed.data?.text) {
+                        onDelta?.(parsed.data.text);
+                    } else if (parsed?.event === "done") {
+                        finalPayload = parsed.data;
+                    }
+                    boundary = buffer.indexOf("\n\n");
+                }
+            }
+            return finalPayload;
+        } catch (err) {
+            console.warn("Failed to send viva message", err);
+            return null;
+        }
+    };
+
+    const requestAiReply = async (sessionId, text, onDelta) => {
+        if (!sessionId) return null;
+        // A dropped connection or a busy session is retried with the same key; the server
+        // waits for any reply still being written and sends it back instead of asking again.
+        const clientMessageId = newClientMessageId();
+        let response = null;
+        for (let attempt = 0; attempt < SEND_ATTEMPTS; attempt += 1) {
+            if (attempt) await wait(SEND_RETRY_DELAY_MS * attempt);
+            response = await requestAiReplyOnce(sessionId, text, clientMessageId, onDelta);
+            if (response && response.status !== "busy") break;
+        }
+        return response || { status: "error" };
     };
 
     const enterSubmitMode = () => {
@@ -1097,14 +1238,14 @@ document.addEventListener("DOMContentLoaded", () => {
             let thinking = null;
             if (expectAiFeedback) {
                 clearVivaChat();
-                thinking = showVivaThinking();
+                thinking = showVivaThinking("Evaluating your viva…");
             }
             const result = await endSession(text);
             const sessionId = result?.sessionId;
             const aiText = result?.feedbackText || "";
             const aiVisible = !!result?.feedbackVisible;
             if (sessionId) {
-                sessionHistories[String(sessionId)] = historySnapshot;
+                sessionHistories[String(sessionId)] = applyModelAnswers(historySnapshot, result?.modelAnswers);
                 if (aiVisible && aiText) {
                     sessionFeedback[String(sessionId)] = {
                         ai_text: aiText,
@@ -1155,12 +1296,25 @@ document.addEventListener("DOMContentLoaded", () => {
         vivaInput.value = "";
         const thinking = showVivaThinking();
         setVivaInputDisabled(true);
-        const response = await requestAiReply(activeId, text);
+        let streamedBubble = null;
+        let streamedText = "";
+        const response = await requestAiReply(activeId, text, (delta) => {
+            streamedText += delta;
+            if (!streamedBubble) {
+                thinking?.remove();
+                streamedBubble = addVivaBubble("ai", streamedText);
+                return;
+            }
+            const content = streamedBubble.querySelector(".bubble-text");
+            if (content) content.textContent = streamedText;
+            scrollVivaChat();
+        });
         if (response?.status === "error") {
             console.warn("AI reply error:", response?.error || "Unknown error");
         }
         thinking?.remove();
-        if (response?.status === "error") {
+        if (response?.status === "error" || response?.status === "busy") {
+            streamedBubble?.remove();
             userBubble?.remove();
             removeLastHistoryEntry(activeId, "student", text);
             addVivaBubble("system", response?.message || "Message too long. Please shorten your response.");
@@ -1174,7 +1328,14 @@ document.addEventListener("DOMContentLoaded", () => {
         if (!reply) {
             reply = "Thanks. Could you clarify that point a little more?";
         }
-        addVivaBubble("ai", reply, { modelAnswer });
+        if (streamedBubble) {
+            const content = streamedBubble.querySelector(".bubble-text");
+            if (content) content.textContent = reply;
+            if (modelAnswer) streamedBubble.dataset.modelAnswer = modelAnswer;
+            scrollVivaChat();
+        } else {
+            addVivaBubble("ai", reply, { modelAnswer });
+        }
         addHistoryEntry(activeId, "ai", reply, modelAnswer);
         if (!vivaTimerStarted) startVivaTimer();
         setVivaInputDisabled(false);
@@ -1528,6 +1689,33 @@ document.addEventListener("DOMContentLoaded", () => {
         return !uploadSizeInvalid;
     }
 
+    const EXTRACTION_POLL_MS = 2000;
+
+    const waitForExtraction = async (submissionIds) => {
+        // Resolves with the failure message, or "" once every file's text is ready.
+        let pending = [...submissionIds];
+        while (pending.length) {
+            await wait(EXTRACTION_POLL_MS);
+            const still = [];
+            for (const id of pending) {
+                try {
+                    const res = await fetch(`/submission/${id}/`, {
+                        headers: { "Accept": "application/json" },
+                        credentials: "same-origin",
+                    });
+                    const data = await res.json().catch(() => null);
+                    if (data?.extraction_status === "failed") return data.message || "Upload failed. Please try again.";
+                    if (data?.extraction_status !== "ready" && res.status !== 404) still.push(id);
+                } catch (err) {
+                    console.warn("Extraction status check failed", err);
+                    still.push(id);
+                }
+            }
+            pending = still;
+        }
+        return "";
+    };
+
     const submitUploadForm = async (form) => {
         if (!form) return;
         const action = form.getAttribute("action");
@@ -1557,6 +1745,17 @@ document.addEventListener("DOMContentLoaded", () => {
                 return;
             }
             if (data?.status === "ok") {
+                const pendingIds = (data.submissions || [])
+                    .filter((entry) => entry.extraction_status === "pending")
+                    .map((entry) => entry.id);
+                if (pendingIds.length) {
+                    setUploadHint("Extracting text from your files…");
+                    const failure = await waitForExtraction(pendingIds);
+                    if (failure) {
+                        setUploadHint(failure);
+                        return;
+                    }
+                }
                 window.location.reload();
                 return;
             }
@@ -1591,6 +1790,12 @@ document.addEventListener("DOMContentLoaded", () => {
         validateUploadSelection();
     }
 
+    const extractingIds = Array.from(document.querySelectorAll("[data-submission-id][data-extracting]"))
+        .map((row) => row.dataset.submissionId);
+    if (extractingIds.length) {
+        waitForExtraction(extractingIds).then(() => window.location.reload());
+    }
+
     if (eventTracking) {
         window.addEventListener("blur", () => queueLog("blur"));
         window.addEventListener("focus", () => queueLog("focus"));
@@ -362,6 +362,14 @@ document.addEventListener("DOMContentLoaded", () => {
         preview.className = "link file-preview";
         preview.textContent = "Preview text";
         preview.dataset.previewText = resource.comment || "";
+        if (resource.extraction_status === "pending") {
+            row.dataset.extracting = "";
+            const label = document.createElement("span");
+            label.dataset.extractingLabel = "";
+            label.textContent = "Extracting text…";
+            meta.appendChild(label);
+            preview.classList.add("is-hidden");
+        }
         meta.appendChild(preview);
         fileCell.appendChild(fileName);
         fileCell.appendChild(meta);
@@ -401,6 +409,56 @@ document.addEventListener("DOMContentLoaded", () => {
         recalcResourceTotals();
     };
 
+    const EXTRACTION_POLL_MS = 2000;
+    let extractionPolling = false;
+
+    const getExtractingRows = () => getResourceRows().filter((row) => "extracting" in row.dataset);
+
+    const finishResourceExtraction = (row, data) => {
+        delete row.dataset.extracting;
+        row.dataset.comment = data.comment || "";
+        row.querySelector("[data-extracting-label]")?.remove();
+        const preview = row.querySelector(".file-preview");
+        if (preview) {
+            preview.dataset.previewText = data.comment || "";
+            preview.classList.remove("is-hidden");
+        }
+    };
+
+    const pollResourceExtraction = async () => {
+        for (const row of getExtractingRows()) {
+            try {
+                const res = await fetch(`/assignment/resources/${row.dataset.resourceId}/status/`, {
+                    headers: { "Accept": "application/json" },
+                    credentials: "same-origin",
+                });
+                const data = await res.json().catch(() => null);
+                if (data?.extraction_status === "ready") {
+                    finishResourceExtraction(row, data);
+                } else if (data?.extraction_status === "failed" || res.status === 404) {
+                    // The whole upload batch is discarded, so each of its rows goes the same way.
+                    row.remove();
+                    if (data?.message) setResourceHint(data.message);
+                }
+            } catch (err) {
+                console.warn("Extraction status check failed", err);
+            }
+        }
+        recalcResourceTotals();
+        validateResourceSelection();
+        if (getExtractingRows().length) {
+            setTimeout(pollResourceExtraction, EXTRACTION_POLL_MS);
+        } else {
+            extractionPolling = false;
+        }
+    };
+
+    const watchResourceExtraction = () => {
+        if (extractionPolling || !getExtractingRows().length) return;
+        extractionPolling = true;
+        setTimeout(pollResourceExtraction, EXTRACTION_POLL_MS);
+    };
+
     const buildEventTimeline = (events = []) => {
         const output = [];
         let lastBlur = null;
@@ -1189,6 +1247,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
     if (resourceList) {
         getResourceRows().forEach(bindResourceRow);
+        watchResourceExtraction();
         recalcResourceTotals();
     }
 
@@ -1224,6 +1283,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 (data.resources || []).forEach(appendResourceRow);
                 resourceUploadInput.value = "";
                 validateResourceSelection();
+                watchResourceExtraction();
             } catch (err) {
                 console.warn("Upload failed", err);
                 setResourceHint("Upload failed. Please try again.");
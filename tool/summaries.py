@@ -0,0 +1,251 @@
+"""
+Map-reduce summaries of long extracted text.
+
+A long Submission or AssignmentResource text is split into sections, each
+section is summarised (map), and the section summaries are folded into one
+document digest (reduce), in as many rounds as it takes to fit. The result is
+computed once in the background, stored on the row, and used by the viva
+context builder instead of truncated text.
+
+The included resources of an assignment are also condensed into one resource
+digest, stored on the Assignment and reused verbatim by every student's viva.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from tool import llm, retrieval, tasks
+from tool.models import STATUS_FAILED, STATUS_PENDING, STATUS_READY, Assignment, AssignmentResource, Submission
+
+SUMMARIES_ENABLED = os.getenv("VIVA_SUMMARIES", "true").lower() in ["1", "true", "yes", "on"]
+SUMMARY_MIN_CHARS = int(os.getenv("VIVA_SUMMARY_MIN_CHARS", "40000"))
+SECTION_CHARS = 20000
+REDUCE_INPUT_CHARS = 24000
+REDUCE_GROUP_SIZE = 8
+MAP_CONCURRENCY = 4
+
+RESOURCE_DIGEST_ENABLED = os.getenv("VIVA_RESOURCE_DIGEST", "true").lower() in ["1", "true", "yes", "on"]
+RESOURCE_DIGEST_MIN_CHARS = int(os.getenv("VIVA_RESOURCE_DIGEST_MIN_CHARS", "20000"))
+RESOURCE_DIGEST_INPUT_CHARS = 400000
+
+SECTION_SUMMARY_PROMPT = """Summarise this section of a document used in an academic viva, for an examiner who will question the student about it.
+Keep the specific claims, methods, data, results, figures and named sources. Do not evaluate the work or add anything.
+Write plain text, at most 200 words."""
+
+DIGEST_PROMPT = """Below are summaries of consecutive parts of one document used in an academic viva.
+Combine them into a single digest for the examiner: aims, approach, main findings or arguments, and conclusions.
+Keep specific details and do not add anything. Write plain text, at most 400 words."""
+
+RESOURCE_DIGEST_PROMPT = """Condense the instructor-provided resources below (for example an assignment brief, marking rubric or reading) into a reference digest for an examiner running a viva on student submissions.
+Keep every task requirement, marking criterion, key concept, definition, figure and named source that could inform a question or a reference answer.
+Drop formatting, repetition and administrative detail. Write plain text, at most 1500 words."""
+
+MODELS = {"submission": Submission, "resource": AssignmentResource}
+
+
+def _kind(obj):
+    return "resource" if isinstance(obj, AssignmentResource) else "submission"
+
+
+def split_sections(text, index):
+    """
+    Groups the index's chunks into sections of at most SECTION_CHARS, starting a
+    new section at a heading once the current one is a reasonable size.
+    """
+    titles = {item["chunk"]: item["title"] for item in index.get("outline") or []}
+    sections = []
+    current = None
+    last_title = "Opening"
+    for chunk_id, (start, end) in enumerate(index.get("spans") or []):
+        title = titles.get(chunk_id)
+        if current is not None:
+            at_heading = title is not None and current["end"] - current["start"] >= SECTION_CHARS // 4
+            if end - current["start"] > SECTION_CHARS or at_heading:
+                sections.append(current)
+                current = None
+        if title is not None:
+            last_title = title
+        if current is None:
+            if title is None and sections:
+                section_title = f"{last_title} (continued)"
+            else:
+                section_title = last_title
+            current = {"title": section_title, "start": start, "end": end}
+        else:
+            current["end"] = end
+    if current is not None:
+        sections.append(current)
+    return sections
+
+
+def _summarise(prompt, content, assignment):
+    return llm.complete(
+        llm.TASK_SUMMARY,
+        [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": content},
+        ],
+        temperature=0.2,
+        assignment=assignment,
+    )
+
+
+def _digest(summaries, assignment):
+    parts = list(summaries)
+    while len(parts) > 1 and sum(len(part) for part in parts) > REDUCE_INPUT_CHARS:
+        parts = [
+            _summarise(DIGEST_PROMPT, "\n\n".join(parts[i:i + REDUCE_GROUP_SIZE]), assignment)
+            for i in range(0, len(parts), REDUCE_GROUP_SIZE)
+        ]
+    return _summarise(DIGEST_PROMPT, "\n\n".join(parts), assignment)
+
+
+def summarise_text(text, index, assignment=None):
+    sections = split_sections(text, index)
+
+    def summarise_section(section):
+        content = f"Section: {section['title']}\n\n{text[section['start']:section['end']]}"
+        try:
+            return _summarise(SECTION_SUMMARY_PROMPT, content, assignment)
+        finally:
+            # llm.complete logs the call from this pool thread, and nothing
+            # closes a thread's connection once the pool is gone.
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=MAP_CONCURRENCY) as pool:
+        section_summaries = list(pool.map(summarise_section, sections))
+    return {
+        "text_hash": retrieval.text_hash(text),
+        "sections": [
+            {"title": section["title"], "summary": summary}
+            for section, summary in zip(sections, section_summaries)
+        ],
+        "digest": _digest(section_summaries, assignment),
+    }
+
+
+def summarise_document(kind, object_id):
+    """Background job: summarises one submission or resource and stores the result."""
+    model = MODELS[kind]
+    obj = model.objects.select_related("assignment").filter(id=object_id).first()
+    if obj is None:
+        return
+    try:
+        summary = summarise_text(obj.comment or "", retrieval.get_index(obj), obj.assignment)
+    except Exception:
+        model.objects.filter(id=object_id).update(summary_status=STATUS_FAILED)
+        raise
+    model.objects.filter(id=object_id).update(summary=summary, summary_status=STATUS_READY)
+
+
+def needs_summary(obj):
+    return SUMMARIES_ENABLED and len((obj.comment or "").strip()) > SUMMARY_MIN_CHARS
+
+
+def queue_summary(obj):
+    """
+    Marks obj pending and summarises it in the background when its text is long
+    enough. Returns False if it is too short or another caller queued it first.
+    """
+    if not needs_summary(obj):
+        return False
+    model = type(obj)
+    claimed = model.objects.filter(id=obj.id, summary_status=obj.summary_status).update(
+        summary_status=STATUS_PENDING
+    )
+    if not claimed:
+        return False
+    obj.summary_status = STATUS_PENDING
+    tasks.submit(summarise_document, _kind(obj), obj.id)
+    return True
+
+
+def ready_summary(obj):
+    """The stored summary of obj if it is complete and matches the current text, else None."""
+    if obj.summary_status != STATUS_READY or not obj.summary:
+        return None
+    if obj.summary.get("text_hash") != retrieval.text_hash(obj.comment or ""):
+        return None
+    return obj.summary
+
+
+def resource_digest_key(resource_ids):
+    """Identifies a set of resources; the digest is reused while the set is unchanged."""
+    return hashlib.sha256(json.dumps(sorted(resource_ids)).encode("utf-8")).hexdigest()
+
+
+def _digest_resources(assignment_id):
+    return AssignmentResource.objects.filter(assignment_id=assignment_id, included=True).exclude(comment="")
+
+
+def build_resource_digest(assignment_id):
+    """Background job: condenses the assignment's included resources into its resource digest."""
+    assignment = Assignment.objects.filter(id=assignment_id).first()
+    if assignment is None:
+        return
+    resources = list(_digest_resources(assignment_id).order_by("id"))
+    key = resource_digest_key([resource.id for resource in resources])
+    try:
+        documents = [
+            f"Resource: {resource.file.name if resource.file else 'Resource file'}\n{resource.comment.strip()}"
+            for resource in resources
+        ]
+        if sum(len(document) for document in documents) > RESOURCE_DIGEST_INPUT_CHARS:
+            per_document = RESOURCE_DIGEST_INPUT_CHARS // len(documents)
+            documents = [
+                _summarise(RESOURCE_DIGEST_PROMPT, document[:per_document], assignment)
+                for document in documents
+            ]
+        digest = _summarise(RESOURCE_DIGEST_PROMPT, "\n\n".join(documents), assignment) if documents else ""
+    except Exception:
+        Assignment.objects.filter(id=assignment_id).update(resource_digest_status=STATUS_FAILED)
+        raise
+    Assignment.objects.filter(id=assignment_id).update(
+        resource_digest=digest,
+        resource_digest_key=key,
+        resource_digest_status=STATUS_READY,
+    )
+
+
+def queue_resource_digest(assignment):
+    """
+    Regenerates the assignment's resource digest in the background if its
+    included resources have changed and are long enough to be worth condensing.
+    """
+    if not RESOURCE_DIGEST_ENABLED:
+        return False
+    resources = _digest_resources(assignment.id)
+    key = resource_digest_key(list(resources.values_list("id", flat=True)))
+    current = Assignment.objects.filter(id=assignment.id).values(
+        "resource_digest_key", "resource_digest_status"
+    ).first()
+    if current is None or current["resource_digest_status"] == STATUS_PENDING:
+        return False
+    if current["resource_digest_key"] == key and current["resource_digest_status"] == STATUS_READY:
+        return False
+    total_chars = resources.aggregate(total=Sum(Length("comment")))["total"] or 0
+    if total_chars < RESOURCE_DIGEST_MIN_CHARS:
+        return False
+    claimed = Assignment.objects.filter(
+        id=assignment.id,
+        resource_digest_status=current["resource_digest_status"],
+    ).update(resource_digest_status=STATUS_PENDING)
+    if not claimed:
+        return False
+    tasks.submit(build_resource_digest, assignment.id)
+    return True
+
+
+def ready_resource_digest(assignment, resource_ids):
+    """The assignment's resource digest if it was built from exactly resource_ids, else None."""
+    if assignment.resource_digest_status != STATUS_READY or not assignment.resource_digest:
+        return None
+    if assignment.resource_digest_key != resource_digest_key(resource_ids):
+        return None
+    return assignment.resource_digest
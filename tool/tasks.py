@@ -0,0 +1,45 @@
+"""
+In-process background runner for work that should not hold a request open,
+such as summarising long documents after they are uploaded.
+
+Jobs run on a shared thread pool once the surrounding transaction commits.
+They are not persisted, so every job must be safe to queue again, and callers
+keep a status field that lets an unfinished job be picked up later.
+
+Text extraction from uploads has a pool of its own (submit_extraction), so a
+burst of large uploads cannot hold up summaries or viva evaluations.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "4"))
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="machinaviva-bg")
+_extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="machinaviva-extract")
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background job %s failed", getattr(fn, "__name__", fn))
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs):
+    """Runs fn(*args, **kwargs) on the background pool after the current transaction commits."""
+    transaction.on_commit(lambda: _executor.submit(_run, fn, args, kwargs))
+
+
+def submit_extraction(fn, *args, **kwargs):
+    """submit() on the text-extraction pool."""
+    transaction.on_commit(lambda: _extraction_executor.submit(_run, fn, args, kwargs))
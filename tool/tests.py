@@ -1,3 +1,676 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import openai
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+
+from tool import archives, extraction, limiter, llm
+from tool.models import (
+    STATUS_FAILED,
+    STATUS_PENDING,
+    STATUS_READY,
+    Assignment,
+    InteractionLog,
+    LLMSlot,
+    LLMTicket,
+    Submission,
+    TextIndex,
+    VivaMessage,
+    VivaSession,
+    VivaSessionArchive,
+    VivaSessionSubmission,
+)
+from tool.views import viva
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def make_session(user_id="student-1", **assignment_fields):
+    assignment = Assignment.objects.create(
+        slug=f"assignment-{Assignment.objects.count() + 1}",
+        title="Assignment",
+        **assignment_fields,
+    )
+    submission = Submission.objects.create(assignment=assignment, user_id=user_id, comment="Submitted text. " * 50)
+    session = VivaSession.objects.create(submission=submission)
+    VivaSessionSubmission.objects.create(session=session, submission=submission)
+    return session
+
+
+def feed_in_chunks(parser, text, size):
+    return "".join(parser.feed(text[start:start + size]) for start in range(0, len(text), size))
+
+
+class QuestionStreamParserTests(SimpleTestCase):
+    def test_pulls_the_question_out_of_streamed_json(self):
+        raw = '{"question": "Why did you\\nchoose \\"X\\" over caf\\u00e9?", "model_answer": "Because."}'
+        for size in (1, 3, 7, len(raw)):
+            parser = viva.QuestionStreamParser()
+            self.assertEqual(feed_in_chunks(parser, raw, size), 'Why did you\nchoose "X" over café?')
+            self.assertTrue(parser.done)
+
+    def test_ignores_everything_after_the_question(self):
+        parser = viva.QuestionStreamParser()
+        self.assertEqual(parser.feed('{"question": "Why?"'), "Why?")
+        self.assertEqual(parser.feed(', "model_answer": "Because."}'), "")
+
+    def test_waits_for_the_question_key(self):
+        parser = viva.QuestionStreamParser()
+        self.assertEqual(parser.feed('{"model_answer": "Because.", '), "")
+        self.assertEqual(parser.feed('"question": "Why?"}'), "Why?")
+
+    def test_reads_a_fenced_payload(self):
+        parser = viva.QuestionStreamParser()
+        self.assertEqual(feed_in_chunks(parser, '```json\n{"question": "Why?"}\n```', 4), "Why?")
+
+    def test_passes_plain_text_through(self):
+        parser = viva.QuestionStreamParser()
+        self.assertEqual(feed_in_chunks(parser, "  What did you find?", 5), "What did you find?")
+        self.assertFalse(parser.done)
+
+
+class ParseModelAnswersTests(SimpleTestCase):
+    def test_places_answers_by_id(self):
+        raw = '{"answers": [{"id": 2, "model_answer": "Second."}, {"id": 1, "model_answer": " First. "}]}'
+        self.assertEqual(viva.parse_model_answers(raw, 2), ["First.", "Second."])
+
+    def test_leaves_missing_and_out_of_range_answers_empty(self):
+        raw = '{"answers": [{"id": 3, "model_answer": "Third."}, {"id": 9, "model_answer": "Stray."}, {"id": 1}]}'
+        self.assertEqual(viva.parse_model_answers(raw, 3), ["", "", "Third."])
+
+    def test_falls_back_to_position_without_ids(self):
+        self.assertEqual(viva.parse_model_answers('{"answers": ["One.", "Two."]}', 2), ["One.", "Two."])
+        self.assertEqual(viva.parse_model_answers('{"answers": [{"model_answer": "One."}]}', 1), ["One."])
+
+    def test_finds_json_inside_surrounding_text(self):
+        raw = 'Here you go:\n```json\n{"answers": [{"id": 1, "model_answer": "One."}]}\n```'
+        self.assertEqual(viva.parse_model_answers(raw, 1), ["One."])
+
+    def test_unreadable_reply_gives_no_answers(self):
+        for raw in ("", None, "not json", "{broken", '{"answers": "none"}'):
+            self.assertEqual(viva.parse_model_answers(raw, 2), ["", ""])
+
+
+class ParseAnswerScoresTests(SimpleTestCase):
+    def test_places_scores_by_id(self):
+        raw = '{"scores": [{"id": 2, "score": 1}, {"id": 1, "score": "3"}]}'
+        self.assertEqual(viva.parse_answer_scores(raw, 2), [3, 1])
+
+    def test_drops_scores_out_of_range(self):
+        raw = '{"scores": [{"id": 1, "score": 4}, {"id": 2, "score": -1}, {"id": 3, "score": "high"}, {"id": 7, "score": 2}]}'
+        self.assertEqual(viva.parse_answer_scores(raw, 3), [None, None, None])
+
+    def test_reads_a_bare_list(self):
+        self.assertEqual(viva.parse_answer_scores("[2, 0]", 2), [2, 0])
+
+    def test_unreadable_reply_gives_no_scores(self):
+        for raw in ("", None, "Scores: good", '{"scores": 3}'):
+            self.assertEqual(viva.parse_answer_scores(raw, 2), [None, None])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ScoreAnswersTests(TestCase):
+    def converse(self, session, question, answer, model_answer=""):
+        VivaMessage.objects.create(session=session, sender="ai", text=question, model_answer=model_answer)
+        return VivaMessage.objects.create(session=session, sender="student", text=answer)
+
+    def score(self, session, reply, final=False):
+        with mock.patch.object(viva.llm, "complete", return_value=reply) as complete:
+            scored = viva.score_answers(session.id, final)
+        return scored, complete
+
+    def test_scores_answers_in_one_call(self):
+        session = make_session()
+        first = self.converse(session, "Why this method?", "It fits the data we collected.", "It fits the data.")
+        second = self.converse(session, "What would you change?", "A larger sample next time.", "A larger sample.")
+        scored, complete = self.score(session, json.dumps({"scores": [{"id": 1, "score": 3}, {"id": 2, "score": 1}]}))
+        self.assertEqual(scored, 2)
+        self.assertEqual(complete.call_count, 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.answer_score, second.answer_score), (3, 1))
+
+    def test_non_answers_score_zero_without_a_call(self):
+        session = make_session()
+        answer = self.converse(session, "Why this method?", "", "It fits the data.")
+        scored, complete = self.score(session, "{}")
+        self.assertEqual(scored, 0)
+        complete.assert_not_called()
+        answer.refresh_from_db()
+        self.assertEqual(answer.answer_score, 0)
+
+    def test_waits_for_a_model_answer_that_is_coming(self):
+        session = make_session(enable_model_answers=True)
+        answer = self.converse(session, "Why this method?", "It fits the data we collected.")
+        scored, complete = self.score(session, '{"scores": [2]}')
+        self.assertEqual(scored, 0)
+        complete.assert_not_called()
+        scored, _ = self.score(session, '{"scores": [2]}', final=True)
+        self.assertEqual(scored, 1)
+        answer.refresh_from_db()
+        self.assertEqual(answer.answer_score, 2)
+
+    def test_scores_against_the_question_without_model_answers(self):
+        session = make_session(enable_model_answers=False)
+        answer = self.converse(session, "Why this method?", "It fits the data we collected.")
+        scored, complete = self.score(session, '{"scores": [2]}')
+        self.assertEqual(scored, 1)
+        self.assertIn("Reference answer: None given.", complete.call_args.args[1][-1]["content"])
+        answer.refresh_from_db()
+        self.assertEqual(answer.answer_score, 2)
+
+    def test_scored_answers_are_not_sent_again(self):
+        session = make_session()
+        self.converse(session, "Why this method?", "It fits the data we collected.", "It fits the data.")
+        self.score(session, '{"scores": [3]}')
+        scored, complete = self.score(session, '{"scores": [3]}')
+        self.assertEqual(scored, 0)
+        complete.assert_not_called()
+
+
+class ParseEvaluationTests(SimpleTestCase):
+    def analysis(self, **overrides):
+        analysis = {
+            "total_responses": 4,
+            "substantive_answers": 4,
+            "off_topic_ratio": 0,
+            "unanswered_questions": 0,
+            "max_consecutive_unanswered": 0,
+        }
+        analysis.update(overrides)
+        return analysis
+
+    def test_reads_feedback_and_flag(self):
+        raw = '{"feedback": " Clear reasoning throughout. ", "knowledge_flag": "aligned"}'
+        self.assertEqual(viva.parse_evaluation(raw, self.analysis()), ("Clear reasoning throughout.", "Aligned"))
+
+    def test_guardrails_cap_the_flag(self):
+        raw = '{"feedback": "Good.", "knowledge_flag": "Aligned"}'
+        self.assertEqual(viva.parse_evaluation(raw, self.analysis(substantive_answers=1))[1], "Needs clarification")
+        self.assertEqual(viva.parse_evaluation(raw, self.analysis(unanswered_questions=2))[1], "Partially aligned")
+        self.assertEqual(viva.parse_evaluation(raw, self.analysis(substantive_answers=0))[1], "Unclear")
+
+    def test_missing_parts_are_empty(self):
+        self.assertEqual(viva.parse_evaluation('{"feedback": "Good."}', self.analysis()), ("Good.", ""))
+        self.assertEqual(viva.parse_evaluation('{"knowledge_flag": "Unclear"}', self.analysis()), ("", "Unclear"))
+        self.assertEqual(viva.parse_evaluation('{"knowledge_flag": "Excellent"}', self.analysis()), ("", ""))
+
+    def test_finds_json_inside_surrounding_text(self):
+        raw = 'Evaluation:\n{"feedback": "Good.", "knowledge_flag": "Partially aligned"}\nThanks.'
+        self.assertEqual(viva.parse_evaluation(raw, self.analysis()), ("Good.", "Partially aligned"))
+
+    def test_unreadable_reply_gives_nothing(self):
+        for raw in ("", None, "Feedback: good", "[1, 2]"):
+            self.assertEqual(viva.parse_evaluation(raw, self.analysis()), ("", ""))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TurnLockTests(TestCase):
+    def setUp(self):
+        self.session = make_session()
+
+    def send(self, payload):
+        request = RequestFactory().post("/viva/send/", json.dumps(payload), content_type="application/json")
+        SessionMiddleware(lambda request: None).process_request(request)
+        return viva.viva_send_message(request)
+
+    def test_one_holder_at_a_time(self):
+        holder = viva.acquire_turn_lock(self.session.id)
+        self.assertTrue(holder)
+        with mock.patch.object(viva, "TURN_LOCK_WAIT_SECONDS", 0):
+            self.assertIsNone(viva.acquire_turn_lock(self.session.id))
+            viva.release_turn_lock(self.session.id, "someone-else")
+            self.assertIsNone(viva.acquire_turn_lock(self.session.id))
+            viva.release_turn_lock(self.session.id, holder)
+            self.assertTrue(viva.acquire_turn_lock(self.session.id))
+
+    def test_expired_lock_can_be_taken(self):
+        with mock.patch.object(viva, "TURN_LOCK_LEASE_SECONDS", -1):
+            self.assertTrue(viva.acquire_turn_lock(self.session.id))
+        with mock.patch.object(viva, "TURN_LOCK_WAIT_SECONDS", 0):
+            self.assertTrue(viva.acquire_turn_lock(self.session.id))
+
+    def test_busy_session_answers_409(self):
+        viva.acquire_turn_lock(self.session.id)
+        with mock.patch.object(viva, "TURN_LOCK_WAIT_SECONDS", 0), \
+                mock.patch.object(viva, "generate_viva_reply") as generate:
+            response = self.send({"session_id": self.session.id, "text": "My answer."})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)["status"], "busy")
+        generate.assert_not_called()
+
+    def test_repeated_message_replays_the_stored_reply(self):
+        payload = {"session_id": self.session.id, "text": "My answer.", "client_message_id": "c-1"}
+        with mock.patch.object(viva, "generate_viva_reply", return_value=("Why?", "Because.")) as generate:
+            first = json.loads(self.send(payload).content)
+            second = json.loads(self.send(payload).content)
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first["ai_text"], "Why?")
+        self.assertEqual(VivaMessage.objects.filter(session=self.session, sender="student").count(), 1)
+        self.assertEqual(VivaMessage.objects.filter(session=self.session, sender="ai").count(), 1)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.turn_lock_holder, "")
+
+    def test_repeated_message_without_a_reply_is_answered_once(self):
+        # The first attempt stored the message and died before the reply was saved.
+        VivaMessage.objects.create(session=self.session, sender="student", text="My answer.", client_message_id="c-1")
+        payload = {"session_id": self.session.id, "text": "My answer.", "client_message_id": "c-1"}
+        with mock.patch.object(viva, "generate_viva_reply", return_value=("Why?", "")) as generate:
+            retried = json.loads(self.send(payload).content)
+        generate.assert_called_once()
+        self.assertEqual(retried["ai_text"], "Why?")
+        self.assertEqual(VivaMessage.objects.filter(session=self.session, sender="student").count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LimiterTests(TestCase):
+    def setUp(self):
+        for name, value in (("MAX_CONCURRENCY", 2), ("BACKEND", "db"), ("POLL_SECONDS", 0.01)):
+            patcher = mock.patch.object(limiter, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ticket(self, priority, assignment_id=None):
+        return LLMTicket.objects.create(priority=priority, assignment_id=assignment_id, seen_at=now()).id
+
+    def hold(self, slot_id, assignment_id):
+        limiter._ensure_slots()
+        LLMSlot.objects.filter(id=slot_id).update(
+            holder=f"holder-{slot_id}",
+            assignment_id=assignment_id,
+            expires_at=now() + timedelta(minutes=1),
+        )
+
+    def test_slots_are_held_and_released(self):
+        with limiter.slot(limiter.PRIORITY_LIVE, 1):
+            with limiter.slot(limiter.PRIORITY_LIVE, 1):
+                self.assertEqual(LLMSlot.objects.exclude(holder="").count(), 2)
+                self.assertIsNone(limiter.try_acquire(limiter.PRIORITY_LIVE, 1))
+                with self.assertRaises(limiter.SlotUnavailable):
+                    with limiter.slot(limiter.PRIORITY_LIVE, 1, timeout=0.05):
+                        pass
+        self.assertEqual(LLMSlot.objects.exclude(holder="").count(), 0)
+        self.assertEqual(LLMTicket.objects.count(), 0)
+
+    def test_expired_slot_is_reclaimed(self):
+        self.hold(1, 1)
+        self.hold(2, 1)
+        LLMSlot.objects.filter(id=1).update(expires_at=now() - timedelta(seconds=1))
+        release = limiter.try_acquire(limiter.PRIORITY_LIVE, 2)
+        self.assertIsNotNone(release)
+        release()
+        self.assertEqual(LLMSlot.objects.get(id=1).holder, "")
+
+    def test_live_calls_go_before_background_work(self):
+        background = self.ticket(limiter.PRIORITY_BACKGROUND)
+        live = self.ticket(limiter.PRIORITY_LIVE)
+        self.assertTrue(limiter._my_turn(live, limiter.PRIORITY_LIVE, None, 1))
+        self.assertFalse(limiter._my_turn(background, limiter.PRIORITY_BACKGROUND, None, 1))
+        self.assertTrue(limiter._my_turn(background, limiter.PRIORITY_BACKGROUND, None, 2))
+
+    def test_waiters_go_in_arrival_order(self):
+        first = self.ticket(limiter.PRIORITY_LIVE, 1)
+        second = self.ticket(limiter.PRIORITY_LIVE, 1)
+        self.assertTrue(limiter._my_turn(first, limiter.PRIORITY_LIVE, 1, 1))
+        self.assertFalse(limiter._my_turn(second, limiter.PRIORITY_LIVE, 1, 1))
+        # A caller without a ticket queues behind both.
+        self.assertFalse(limiter._my_turn(None, limiter.PRIORITY_LIVE, 1, 2))
+
+    def test_busy_assignment_waits_behind_a_quiet_one(self):
+        self.hold(1, 1)
+        busy = self.ticket(limiter.PRIORITY_LIVE, 1)
+        quiet = self.ticket(limiter.PRIORITY_LIVE, 2)
+        self.assertTrue(limiter._my_turn(quiet, limiter.PRIORITY_LIVE, 2, 1))
+        self.assertFalse(limiter._my_turn(busy, limiter.PRIORITY_LIVE, 1, 1))
+
+    def test_stale_tickets_are_ignored(self):
+        stale = self.ticket(limiter.PRIORITY_LIVE)
+        LLMTicket.objects.filter(id=stale).update(seen_at=now() - timedelta(seconds=limiter.TICKET_STALE_SECONDS + 1))
+        self.assertTrue(limiter._my_turn(None, limiter.PRIORITY_BACKGROUND, None, 1))
+
+    def test_cache_backend_keeps_slots_for_live_calls(self):
+        with mock.patch.object(limiter, "BACKEND", "cache"), mock.patch.object(limiter, "LIVE_RESERVED_SLOTS", 1):
+            release = limiter.try_acquire(limiter.PRIORITY_BACKGROUND)
+            self.assertIsNotNone(release)
+            self.assertIsNone(limiter.try_acquire(limiter.PRIORITY_BACKGROUND))
+            live_release = limiter.try_acquire(limiter.PRIORITY_LIVE)
+            self.assertIsNotNone(live_release)
+            release()
+            live_release()
+            release = limiter.try_acquire(limiter.PRIORITY_BACKGROUND)
+            self.assertIsNotNone(release)
+            release()
+
+    def test_polling_backs_off_up_to_the_ceiling(self):
+        waiter = limiter._Waiter(limiter.PRIORITY_LIVE, None)
+        deadline = time.monotonic() + 60
+        with mock.patch.object(limiter, "POLL_SECONDS", 0.1), mock.patch.object(limiter, "MAX_POLL_SECONDS", 1):
+            delays = [waiter.delay(deadline) for _ in range(8)]
+            self.assertLessEqual(delays[0], 0.1)
+            self.assertGreaterEqual(delays[-1], 0.5)
+            self.assertTrue(all(delay <= 1 for delay in delays))
+            self.assertLessEqual(waiter.delay(time.monotonic() + 0.01), 0.01)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(llm, "logger")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = llm.CircuitBreaker(failure_threshold=3, reset_seconds=60)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+    def test_lets_one_trial_through_after_the_reset(self):
+        breaker = llm.CircuitBreaker(failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        breaker.opened_at -= 61
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_opens_it_again(self):
+        breaker = llm.CircuitBreaker(failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+        breaker.opened_at -= 61
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+    def test_inconclusive_trial_frees_the_next_one(self):
+        breaker = llm.CircuitBreaker(failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+        breaker.opened_at -= 61
+        self.assertTrue(breaker.allow())
+        breaker.record_inconclusive()
+        self.assertTrue(breaker.allow())
+
+
+class FailingCompletions:
+    def __init__(self, error, delay=0):
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        raise self.error
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BreakerIntegrationTests(TestCase):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+    def setUp(self):
+        self.breaker = llm.CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        self.logger = mock.Mock()
+        overrides = (("breaker", self.breaker), ("MAX_RETRIES", 0), ("LLM_PROVIDER", "openai"), ("logger", self.logger))
+        for name, value in overrides:
+            patcher = mock.patch.object(llm, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def call(self, error, delay=0, **kwargs):
+        completions = FailingCompletions(error, delay)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        with mock.patch.object(llm, "get_client", return_value=client):
+            with self.assertRaises(Exception) as raised:
+                llm.complete(llm.TASK_FEEDBACK, [{"role": "user", "content": "Hi"}], temperature=0, **kwargs)
+        return raised.exception, completions.calls
+
+    def test_provider_outage_opens_the_breaker(self):
+        for _ in range(2):
+            error, calls = self.call(openai.APIConnectionError(request=self.request))
+            self.assertIsInstance(error, openai.APIConnectionError)
+        error, calls = self.call(openai.APIConnectionError(request=self.request))
+        self.assertIsInstance(error, llm.LLMUnavailable)
+        self.assertEqual(calls, 0)
+        self.logger.warning.assert_called_once()
+
+    def test_rejected_request_shows_the_provider_is_up(self):
+        self.call(openai.APIConnectionError(request=self.request))
+        response = httpx.Response(400, request=self.request)
+        self.call(openai.BadRequestError("Bad request", response=response, body=None))
+        self.call(openai.APIConnectionError(request=self.request))
+        self.assertTrue(self.breaker.allow())
+
+    def test_our_own_deadline_is_not_a_provider_failure(self):
+        for _ in range(3):
+            error, calls = self.call(openai.APITimeoutError(request=self.request), delay=0.05, timeout=0.05)
+            self.assertIsInstance(error, openai.APITimeoutError)
+            self.assertEqual(calls, 1)
+        self.assertTrue(self.breaker.allow())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ExtractionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(extraction, "EXTRACTION_PROCESSES", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.assignment = make_session().submission.assignment
+
+    def upload(self, *names):
+        submissions = []
+        for name in names:
+            submission = Submission(assignment=self.assignment, user_id="student-2", extraction_status=STATUS_PENDING)
+            submission.file.save(name, ContentFile(b"file"), save=False)
+            submission.save()
+            submissions.append(submission)
+        return submissions
+
+    def extract(self, submissions, texts):
+        def extract_text(path):
+            return texts[path.rsplit("/", 1)[-1]]
+
+        with mock.patch.object(extraction, "extract_text_from_file", side_effect=extract_text):
+            return extraction.extract_batch("submission", [submission.id for submission in submissions])
+
+    def test_stores_the_text_of_every_file(self):
+        submissions = self.upload("one.txt", "two.txt")
+        self.assertIsNone(self.extract(submissions, {"one.txt": "First file.", "two.txt": "Second file."}))
+        for submission, text in zip(submissions, ("First file.", "Second file.")):
+            submission.refresh_from_db()
+            self.assertEqual((submission.comment, submission.extraction_status), (text, STATUS_READY))
+            self.assertTrue(TextIndex.objects.filter(submission=submission).exists())
+
+    def test_one_empty_file_discards_the_batch(self):
+        submissions = self.upload("one.txt", "scan.txt")
+        paths = [submission.file.path for submission in submissions]
+        message = self.extract(submissions, {"one.txt": "First file.", "scan.txt": "  "})
+        self.assertEqual(message, extraction.EMPTY_TEXT_MESSAGE)
+        self.assertFalse(Submission.objects.filter(id__in=[submission.id for submission in submissions]).exists())
+        self.assertFalse(any(Path(path).exists() for path in paths))
+        payload = extraction.status_payload("submission", submissions[0].id)
+        self.assertEqual((payload["extraction_status"], payload["message"]), (STATUS_FAILED, extraction.EMPTY_TEXT_MESSAGE))
+
+    def test_extraction_error_discards_the_batch(self):
+        submissions = self.upload("one.txt")
+        with mock.patch.object(extraction, "extract_text_from_file", side_effect=ValueError("corrupt")), \
+                mock.patch.object(extraction, "logger"):
+            message = extraction.extract_batch("submission", [submissions[0].id])
+        self.assertEqual(message, extraction.FAILED_MESSAGE)
+        self.assertFalse(Submission.objects.filter(id=submissions[0].id).exists())
+        self.assertEqual(extraction.status_payload("submission", submissions[0].id)["message"], extraction.FAILED_MESSAGE)
+
+    def test_unknown_object_has_no_status(self):
+        self.assertIsNone(extraction.status_payload("submission", 999))
+
+    def test_stale_pending_upload_is_queued_again_once(self):
+        submission = self.upload("one.txt")[0]
+        with mock.patch.object(extraction.tasks, "submit_extraction") as submit:
+            self.assertFalse(extraction.requeue_if_stale(submission))
+            Submission.objects.filter(id=submission.id).update(
+                created_at=now() - timedelta(seconds=extraction.STALE_SECONDS + 1)
+            )
+            submission.refresh_from_db()
+            self.assertTrue(extraction.requeue_if_stale(submission))
+            self.assertFalse(extraction.requeue_if_stale(submission))
+        submit.assert_called_once_with(extraction.extract_batch, "submission", [submission.id])
+
+    def test_finished_upload_is_not_queued_again(self):
+        submission = self.upload("one.txt")[0]
+        Submission.objects.filter(id=submission.id).update(
+            extraction_status=STATUS_READY,
+            created_at=now() - timedelta(seconds=extraction.STALE_SECONDS + 1),
+        )
+        submission.refresh_from_db()
+        with mock.patch.object(extraction.tasks, "submit_extraction") as submit:
+            self.assertFalse(extraction.requeue_if_stale(submission))
+        submit.assert_not_called()
+        self.assertFalse(extraction.not_ready(Submission.objects.filter(id=submission.id)).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SweepVivaSessionsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.evaluated = []
+        patcher = mock.patch.object(viva, "run_evaluation", side_effect=self.run_evaluation)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_evaluation(self, session_id):
+        # Stands in for the real job, which runs on the sweeper's own threads.
+        # It must stay off the database: the test's transaction is not visible from those threads.
+        self.evaluated.append((session_id, cache.get(f"viva_evaluation:{session_id}")))
+        cache.delete(f"viva_evaluation:{session_id}")
+
+    def sweep(self, *args):
+        out = StringIO()
+        call_command("sweep_viva_sessions", *args, stdout=out)
+        return out.getvalue().strip()
+
+    def started(self, minutes_ago, **fields):
+        session = make_session()
+        VivaSession.objects.filter(id=session.id).update(started_at=now() - timedelta(minutes=minutes_ago), **fields)
+        session.refresh_from_db()
+        return session
+
+    def test_closes_abandoned_sessions_and_evaluates_them(self):
+        abandoned = self.started(60)
+        message = VivaMessage.objects.create(session=abandoned, sender="student", text="My answer.")
+        VivaMessage.objects.filter(id=message.id).update(timestamp=abandoned.started_at + timedelta(minutes=3))
+        active = self.started(60, last_heartbeat_at=now())
+        in_time = self.started(5)
+        # Its evaluation is left pending by the stand-in, so keep the retry pass away from it.
+        self.assertEqual(self.sweep("--stuck-minutes", "120"), "Closed 1 abandoned sessions and retried 0 evaluations.")
+        abandoned.refresh_from_db()
+        # The student was last seen at their message, before the time limit ran out.
+        self.assertEqual(abandoned.ended_at, abandoned.started_at + timedelta(minutes=3))
+        self.assertEqual(abandoned.duration_seconds, 180)
+        self.assertEqual(self.evaluated, [(abandoned.id, 1)])
+        for session in (active, in_time):
+            session.refresh_from_db()
+            self.assertIsNone(session.ended_at)
+
+    def test_retries_stuck_evaluations_not_already_running(self):
+        ended = now() - timedelta(hours=1)
+        stuck = self.started(120, ended_at=ended, evaluation_status=STATUS_PENDING)
+        running = self.started(120, ended_at=ended, evaluation_status=STATUS_PENDING)
+        failed = self.started(120, ended_at=ended, evaluation_status=STATUS_FAILED)
+        cache.add(f"viva_evaluation:{running.id}", 1, 600)
+        self.assertEqual(self.sweep(), "Closed 0 abandoned sessions and retried 1 evaluations.")
+        self.assertEqual(self.evaluated, [(stuck.id, 1)])
+        self.assertEqual(cache.get(f"viva_evaluation:{running.id}"), 1)
+        self.evaluated.clear()
+        self.sweep("--retry-failed")
+        self.assertEqual(sorted(self.evaluated), [(stuck.id, 1), (failed.id, 1)])
+
+    def test_dry_run_changes_nothing(self):
+        abandoned = self.started(60)
+        self.assertEqual(self.sweep("--dry-run"), "Would close 1 abandoned sessions and retry 0 evaluations.")
+        abandoned.refresh_from_db()
+        self.assertIsNone(abandoned.ended_at)
+        self.assertEqual(self.evaluated, [])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ArchiveVivaSessionsTests(TestCase):
+    def archive(self, *args):
+        out = StringIO()
+        call_command("archive_viva_sessions", *args, stdout=out)
+        return out.getvalue().strip().splitlines()
+
+    def ended(self, evaluation_status=STATUS_READY):
+        session = make_session()
+        VivaSession.objects.filter(id=session.id).update(ended_at=now(), evaluation_status=evaluation_status)
+        session.refresh_from_db()
+        VivaMessage.objects.create(session=session, sender="ai", text="Why this method?")
+        VivaMessage.objects.create(session=session, sender="student", text="It fits the data.")
+        return session
+
+    def test_archives_evaluated_sessions(self):
+        evaluated = self.ended()
+        pending = self.ended(STATUS_PENDING)
+        make_session()
+        self.assertEqual(self.archive(), ["Archived 1 sessions."])
+        archived = archives.load(VivaSession.objects.get(id=evaluated.id))
+        self.assertEqual([msg["text"] for msg in archived["messages"]], ["Why this method?", "It fits the data."])
+        self.assertFalse(VivaSessionArchive.objects.filter(session=pending).exists())
+        self.assertEqual(self.archive(), ["Archived 0 sessions."])
+
+    def test_rewrites_outdated_archives(self):
+        session = self.ended()
+        archives.seal(session)
+        VivaSessionArchive.objects.filter(session=session).update(version=archives.ARCHIVE_VERSION - 1)
+        self.assertIsNone(archives.load(VivaSession.objects.get(id=session.id)))
+        self.assertEqual(self.archive(), ["Archived 1 sessions."])
+        self.assertIsNotNone(archives.load(VivaSession.objects.get(id=session.id)))
+
+    def test_prunes_raw_rows_of_old_archives(self):
+        old = self.ended()
+        recent = self.ended()
+        for session in (old, recent):
+            archives.seal(session)
+            InteractionLog.objects.create(submission=session.submission, event_type="paste", event_data={"session_id": session.id})
+        untagged = InteractionLog.objects.create(submission=old.submission, event_type="blur", event_data={})
+        VivaSessionArchive.objects.filter(session=old).update(created_at=now() - timedelta(days=31))
+        self.assertEqual(self.archive("--prune", "--dry-run"), ["Would archive 0 sessions.", "Would prune raw rows for 1 archived sessions."])
+        self.assertTrue(VivaMessage.objects.filter(session=old).exists())
+        self.assertEqual(self.archive("--prune"), ["Archived 0 sessions.", "Pruned raw rows for 1 archived sessions."])
+        self.assertFalse(VivaMessage.objects.filter(session=old).exists())
+        self.assertFalse(InteractionLog.objects.filter(event_data__session_id=old.id).exists())
+        self.assertTrue(InteractionLog.objects.filter(id=untagged.id).exists())
+        self.assertTrue(VivaMessage.objects.filter(session=recent).exists())
+        self.assertEqual(len(archives.load(VivaSession.objects.get(id=old.id))["messages"]), 2)
+
+    def test_pruned_session_is_not_rebuilt(self):
+        session = self.ended()
+        archives.seal(session)
+        VivaMessage.objects.filter(session=session).delete()
+        VivaSessionArchive.objects.filter(session=session).update(version=archives.ARCHIVE_VERSION - 1)
+        self.assertEqual(self.archive(), ["Archived 0 sessions."])
@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# The ASGI entry point serves viva turns from the async view so pending LLM
+# calls do not hold a worker thread each.
+viva_send_view = views.viva_send_message_async if settings.VIVA_ASYNC_VIEWS else views.viva_send_message
+
 urlpatterns = [
     #path("", views.index),
     path("", views.home, name="landing_home"),
@@ -58,6 +63,7 @@ urlpatterns = [
     path("submission/<int:submission_id>/delete/", views.delete_submission, name="delete_submission"),
     path("submission/<int:submission_id>/", views.submission_status, name="submission_status"),
     path("assignment/resources/upload/", views.upload_assignment_resource, name="upload_assignment_resource"),
+    path("assignment/resources/<int:resource_id>/status/", views.assignment_resource_status, name="assignment_resource_status"),
     path("assignment/resources/<int:resource_id>/toggle/", views.toggle_assignment_resource, name="toggle_assignment_resource"),
     path("assignment/resources/<int:resource_id>/preference/", views.toggle_assignment_resource_preference, name="toggle_assignment_resource_preference"),
     path("assignment/resources/<int:resource_id>/delete/", views.delete_assignment_resource, name="delete_assignment_resource"),
@@ -69,7 +75,7 @@ urlpatterns = [
     # Viva session
     path("viva/start/<int:submission_id>/", views.viva_start, name="viva_start"),
     path("viva/session/<int:session_id>/", views.viva_session, name="viva_session"),
-    path("viva/send/", views.viva_send_message, name="viva_send_message"),
+    path("viva/send/", viva_send_view, name="viva_send_message"),
     path("viva/feedback/<int:session_id>/", views.viva_feedback_update, name="viva_feedback_update"),
     path("viva/knowledge-flag/<int:session_id>/", views.viva_knowledge_flag_update, name="viva_knowledge_flag_update"),
     path("viva/toggle_submission/", views.viva_toggle_submission, name="viva_toggle_submission"),
@@ -77,6 +83,7 @@ urlpatterns = [
     path("viva/log/", views.viva_log_event, name="viva_log_event"),
     path("viva/ping/", views.viva_ping, name="viva_ping"),
     path("viva/summary/<int:session_id>/", views.viva_summary, name="viva_summary"),
+    path("viva/evaluation/<int:session_id>/", views.viva_evaluation, name="viva_evaluation"),
     path("viva/logs/<int:session_id>/", views.viva_logs, name="viva_logs"),
 
 
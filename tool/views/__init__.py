@@ -7,12 +7,13 @@ from .submission import (
     submission_status,
     delete_submission,
     upload_assignment_resource,
+    assignment_resource_status,
     toggle_assignment_resource,
     toggle_assignment_resource_preference,
     delete_assignment_resource,
 )
 from .nrps_test import nrps_test
-from .viva import viva_start, viva_session, viva_send_message, viva_toggle_submission, viva_toggle_resource, viva_log_event, viva_ping, viva_summary, viva_logs, viva_feedback_update, viva_knowledge_flag_update
+from .viva import viva_start, viva_session, viva_send_message, viva_send_message_async, viva_toggle_submission, viva_toggle_resource, viva_log_event, viva_ping, viva_summary, viva_logs, viva_feedback_update, viva_knowledge_flag_update, viva_evaluation
 from .home import home
 from .blog import blog_list, blog_detail
 from .standalone import (
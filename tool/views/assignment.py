@@ -3,11 +3,12 @@ from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.urls import reverse
 from django.utils.text import slugify
 from .helpers import is_instructor_role, is_admin_role, fetch_nrps_roster
-from ..models import Assignment, Submission, VivaMessage, VivaSession, VivaSessionSubmission, InteractionLog, AssignmentResource, AssignmentResourcePreference, VivaSessionResource, AssignmentInvitation, AssignmentMembership, AssignmentSettingsChange
+from ..models import STATUS_PENDING, Assignment, Submission, VivaMessage, VivaSession, VivaSessionSubmission, InteractionLog, AssignmentResource, AssignmentResourcePreference, VivaSessionResource, AssignmentInvitation, AssignmentMembership, AssignmentSettingsChange
 from datetime import datetime
 from django.utils import timezone
 from django.utils.timezone import now
-from .viva import compute_integrity_flags
+from .viva import compute_integrity_flags, invalidate_assignment_context
+from .. import archives
 import json
 import secrets
 
@@ -199,6 +200,7 @@ def assignment_edit_save(request):
     assignment.allow_student_uploads = (request.POST.get("allow_student_uploads") == "on")
 
     assignment.save()
+    invalidate_assignment_context(assignment.id)
 
     snapshot_after = _collect_assignment_snapshot(assignment)
     changes = {}
@@ -296,11 +298,15 @@ def student_attempt_download(request, session_id):
     lines.append("")
     lines.append("Transcript:")
 
-    messages = VivaMessage.objects.filter(session=session).order_by("timestamp")
-    if messages.exists():
-        for msg in messages:
-            sender = "AI" if (msg.sender or "").lower() == "ai" else "Student"
-            text = (msg.text or "").strip()
+    archived = archives.load(session)
+    if archived is not None:
+        messages = [(msg["sender"], msg["text"]) for msg in archived["messages"]]
+    else:
+        messages = VivaMessage.objects.filter(session=session).order_by("timestamp").values_list("sender", "text")
+    if messages:
+        for sender, text in messages:
+            sender = "AI" if (sender or "").lower() == "ai" else "Student"
+            text = (text or "").strip()
             lines.append(f"{sender}: {text}")
     else:
         lines.append("No transcript available.")
@@ -531,6 +537,7 @@ def assignment_view(request):
                 "comment": resource.comment,
                 "included": resource.included,
                 "file_size": file_size,
+                "extracting": resource.extraction_status == STATUS_PENDING,
             }
             resource_payloads.append(payload)
             if resource.included:
@@ -676,14 +683,15 @@ def assignment_view(request):
             sessions_qs = VivaSession.objects.filter(
                 submission__assignment=assignment,
                 submission__user_id__in=candidate_ids or [uid],
-            ).select_related("teacher_feedback_author").order_by("-started_at")
+            ).select_related("teacher_feedback_author", "archive").order_by("-started_at")
             active_session = sessions_qs.filter(ended_at__isnull=True).first()
             latest_session = sessions_qs.first()
             session = active_session or latest_session
 
-            flags = compute_integrity_flags(latest_session) if latest_session else []
+            flags = archives.integrity_flags(latest_session) if latest_session else []
             tamper_suspected = bool(latest_session.tamper_suspected) if latest_session else False
             knowledge_flag = session.knowledge_flag if session else ""
+            evaluating = bool(session and session.evaluation_status == STATUS_PENDING)
 
             viva_attempts = []
             if sessions_qs.exists():
@@ -715,39 +723,58 @@ def assignment_view(request):
                         "comment": res.comment,
                     })
                 for sess in sessions_qs:
-                    files = links_by_session.get(sess.id, [])
-                    if sess.id in resource_sessions_seen:
-                        resource_files = resources_by_session.get(sess.id, [])
-                    else:
-                        resource_files = included_resource_entries
-                    logs_qs = InteractionLog.objects.filter(submission=sess.submission).order_by("timestamp")
-                    logs_by_session = logs_qs.filter(event_data__session_id=sess.id)
-                    if logs_by_session.exists():
-                        logs_qs = logs_by_session
+                    archived = archives.load(sess)
+                    if archived is not None:
+                        files = [
+                            {key: entry[key] for key in ("submission_id", "file_name", "comment")}
+                            for entry in archived["submissions"] if entry["included"]
+                        ]
+                        if archived["resources"] is not None:
+                            resource_files = [
+                                {key: entry[key] for key in ("file_name", "comment")}
+                                for entry in archived["resources"] if entry["included"]
+                            ]
+                        else:
+                            resource_files = included_resource_entries
+                        events = archived["events"]
+                        messages = [
+                            dict(m, model_answer=m["model_answer"] if (m["sender"] or "").lower() == "ai" else "")
+                            for m in archived["messages"]
+                        ]
                     else:
-                        logs_qs = logs_qs.filter(timestamp__gte=sess.started_at)
-                        if sess.ended_at:
-                            logs_qs = logs_qs.filter(timestamp__lte=sess.ended_at)
-                    events = [
-                        {
-                            "type": log.event_type,
-                            "timestamp": log.timestamp.isoformat(),
-                            "data": log.event_data,
-                        }
-                        for log in logs_qs
-                    ]
-                    msgs = VivaMessage.objects.filter(
-                        session=sess
-                    ).order_by("timestamp")
-                    messages = [
-                        {
-                            "sender": m.sender,
-                            "text": m.text,
-                            "timestamp": m.timestamp.isoformat(),
-                            "model_answer": m.model_answer if (m.sender or "").lower() == "ai" else "",
-                        }
-                        for m in msgs
-                    ]
+                        files = links_by_session.get(sess.id, [])
+                        if sess.id in resource_sessions_seen:
+                            resource_files = resources_by_session.get(sess.id, [])
+                        else:
+                            resource_files = included_resource_entries
+                        logs_qs = InteractionLog.objects.filter(submission=sess.submission).order_by("timestamp")
+                        logs_by_session = logs_qs.filter(event_data__session_id=sess.id)
+                        if logs_by_session.exists():
+                            logs_qs = logs_by_session
+                        else:
+                            logs_qs = logs_qs.filter(timestamp__gte=sess.started_at)
+                            if sess.ended_at:
+                                logs_qs = logs_qs.filter(timestamp__lte=sess.ended_at)
+                        events = [
+                            {
+                                "type": log.event_type,
+                                "timestamp": log.timestamp.isoformat(),
+                                "data": log.event_data,
+                            }
+                            for log in logs_qs
+                        ]
+                        msgs = VivaMessage.objects.filter(
+                            session=sess
+                        ).order_by("timestamp")
+                        messages = [
+                            {
+                                "sender": m.sender,
+                                "text": m.text,
+                                "timestamp": m.timestamp.isoformat(),
+                                "model_answer": m.model_answer if (m.sender or "").lower() == "ai" else "",
+                            }
+                            for m in msgs
+                        ]
 
                     teacher_author = _format_feedback_author(sess.teacher_feedback_author)
                     feedback = {
@@ -770,8 +797,9 @@ def assignment_view(request):
                         "duration_seconds": duration_seconds,
                         "messages": messages,
                         "feedback": feedback,
-                        "flags": compute_integrity_flags(sess),
+                        "flags": archives.integrity_flags(sess, archived),
                         "knowledge_flag": sess.knowledge_flag or "",
+                        "evaluating": sess.evaluation_status == STATUS_PENDING,
                         "created_at": sess.started_at.isoformat(),
                         "status": "completed" if sess.ended_at else "in_progress",
                         "files": files + resource_files,
@@ -806,6 +834,7 @@ def assignment_view(request):
                 "flags": flags,
                 "tamper_suspected": tamper_suspected,
                 "knowledge_flag": knowledge_flag,
+                "evaluating": evaluating,
                 "viva": viva_payload,
                 "vivas": viva_attempts,
             }
@@ -977,7 +1006,7 @@ def assignment_view(request):
     sessions = VivaSession.objects.filter(
         submission__assignment=assignment,
         submission__user_id=user_id
-    ).select_related("teacher_feedback_author").order_by("-started_at") if has_any_submission else VivaSession.objects.none()
+    ).select_related("teacher_feedback_author", "archive").order_by("-started_at") if has_any_submission else VivaSession.objects.none()
     active_session = sessions.filter(ended_at__isnull=True).first()
     session = active_session or sessions.first()
     latest_submission = None
@@ -994,7 +1023,7 @@ def assignment_view(request):
         duration = assignment.viva_duration_seconds
         remaining_seconds = max(0, duration - int(elapsed))
         status = "completed" if session.ended_at else "in_progress"
-        flags = compute_integrity_flags(session)
+        flags = archives.integrity_flags(session)
         if teacher_feedback_visible:
             teacher_feedback_text = session.teacher_feedback_text or ""
             teacher_feedback_author = _format_feedback_author(session.teacher_feedback_author)
@@ -1040,8 +1069,29 @@ def assignment_view(request):
     active_include_map = {}
     session_meta = {}
     if sessions:
-        all_messages = VivaMessage.objects.filter(session__in=sessions).order_by("timestamp")
+        # Sealed sessions come from their archive; only the rest are rebuilt from rows.
+        archived_sessions = {}
+        for s in sessions:
+            archived = archives.load(s)
+            if archived is not None:
+                archived_sessions[s.id] = archived
+        live_sessions = [s for s in sessions if s.id not in archived_sessions]
+        all_messages = VivaMessage.objects.filter(session__in=live_sessions).order_by("timestamp")
         msgs_by_session = {}
+        for session_id, archived in archived_sessions.items():
+            msgs_by_session[session_id] = [
+                {
+                    "sender": m["sender"],
+                    "text": m["text"],
+                    "ts": m["timestamp"],
+                    "model_answer": m["model_answer"] if (m["sender"] or "").lower() == "ai" and m["model_answer"] else "",
+                }
+                for m in archived["messages"]
+            ]
+            session_links[session_id] = [
+                {key: entry[key] for key in ("submission_id", "file_name", "included", "comment")}
+                for entry in archived["submissions"]
+            ]
         for m in all_messages:
             sender = (m.sender or "").lower()
             msgs_by_session.setdefault(m.session_id, []).append({
@@ -1051,11 +1101,11 @@ def assignment_view(request):
                 "model_answer": m.model_answer if sender == "ai" and m.model_answer else "",
             })
         link_qs = VivaSessionSubmission.objects.filter(
-            session__in=sessions,
+            session__in=live_sessions,
             submission__is_placeholder=False,
         ).select_related("submission")
         resource_links_qs = VivaSessionResource.objects.filter(
-            session__in=sessions
+            session__in=live_sessions
         ).select_related("resource")
         for link in link_qs:
             session_links.setdefault(link.session_id, []).append({
@@ -1068,6 +1118,13 @@ def assignment_view(request):
                 active_include_map[link.submission_id] = link.included
         session_resource_links = {}
         resource_sessions_seen = set()
+        for session_id, archived in archived_sessions.items():
+            if archived["resources"] is not None:
+                resource_sessions_seen.add(session_id)
+                session_resource_links[session_id] = [
+                    {key: entry[key] for key in ("file_name", "comment", "included")}
+                    for entry in archived["resources"]
+                ]
         for link in resource_links_qs:
             resource_sessions_seen.add(link.session_id)
             session_resource_links.setdefault(link.session_id, []).append({
@@ -1101,6 +1158,7 @@ def assignment_view(request):
             "included": active_include_map.get(sub.id, True),
             "can_delete": sub.id not in used_as_primary,
             "file_size": file_size,
+            "extracting": sub.extraction_status == STATUS_PENDING,
         })
 
     existing_sessions = sessions.count()
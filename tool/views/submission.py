@@ -5,8 +5,10 @@ from django.http import HttpResponseBadRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from .helpers import is_instructor_role, is_admin_role
-from ..models import Assignment, Submission, VivaSession, AssignmentResource, AssignmentResourcePreference
-from ..utils import extract_text_from_file, is_allowed_upload, MAX_SUBMISSION_TEXT_CHARS, ALLOWED_UPLOAD_EXTENSIONS
+from .viva import invalidate_assignment_context
+from ..models import STATUS_PENDING, Assignment, Submission, VivaSession, AssignmentResource, AssignmentResourcePreference
+from ..utils import is_allowed_upload, MAX_SUBMISSION_TEXT_CHARS, ALLOWED_UPLOAD_EXTENSIONS
+from .. import extraction, question_plans, retrieval, summaries
 
 
 def _reject_upload(request, message):
@@ -19,31 +21,6 @@ def _allowed_ext_label():
     return ", ".join(sorted(ext.lstrip(".").upper() for ext in ALLOWED_UPLOAD_EXTENSIONS))
 
 
-def _cleanup_submissions(submissions):
-    for sub in submissions:
-        if sub.file:
-            sub.file.delete(save=False)
-        sub.delete()
-
-
-def _cleanup_resources(resources):
-    for resource in resources:
-        if resource.file:
-            resource.file.delete(save=False)
-        resource.delete()
-
-
-def _is_extracted_text_empty(extracted):
-    if not extracted:
-        return True
-    stripped = extracted.strip()
-    if not stripped:
-        return True
-    if stripped.startswith("[Extraction Error"):
-        return True
-    return False
-
-
 # ============================================================
 # Text Submission (fallback / debug mode)
 # ============================================================
@@ -64,12 +41,15 @@ def submit_text(request):
     if len(text) > MAX_SUBMISSION_TEXT_CHARS:
         return HttpResponseBadRequest(f"Text submission too long (max {MAX_SUBMISSION_TEXT_CHARS} chars).")
 
-    Submission.objects.create(
+    sub = Submission.objects.create(
         assignment=assignment,
         user_id=user_id,
         comment=text,
         file=None,
     )
+    retrieval.index_text(sub)
+    summaries.queue_summary(sub)
+    question_plans.queue_question_plan(sub)
 
     return redirect("assignment_view")
 
@@ -121,55 +101,57 @@ def submit_file(request):
             return JsonResponse({"status": "error", "message": "Total upload size limit is 50MB across all files."}, status=400)
         return redirect("assignment_view")
 
-    created_submissions = []
-    for uploaded in uploads:
-        sub = Submission.objects.create(
+    created_submissions = [
+        Submission.objects.create(
             assignment=assignment,
             user_id=user_id,
             file=uploaded,
-            comment="",  # extracted text will be added after save
+            comment="",  # extracted text is added by tool.extraction
+            extraction_status=STATUS_PENDING,
         )
-        created_submissions.append(sub)
-
-        extracted = ""
-        try:
-            if sub.file and sub.file.path:
-                extracted = extract_text_from_file(sub.file.path)
-        except Exception:
-            extracted = ""
-        if _is_extracted_text_empty(extracted):
-            _cleanup_submissions(created_submissions)
-            return _reject_upload(
-                request,
-                "No extractable text found. If this is a scanned PDF, upload a text-based version.",
-            )
-
-        sub.comment = extracted[:MAX_SUBMISSION_TEXT_CHARS]
-        sub.save(update_fields=["comment"])
+        for uploaded in uploads
+    ]
+    if extraction.ASYNC_EXTRACTION:
+        extraction.queue_extraction(created_submissions)
+    else:
+        error = extraction.extract_batch("submission", [sub.id for sub in created_submissions])
+        if error:
+            return _reject_upload(request, error)
 
     if request.headers.get("accept") == "application/json":
-        return JsonResponse({"status": "ok"})
+        return JsonResponse({
+            "status": "ok",
+            "submissions": [
+                extraction.status_payload("submission", sub.id, sub)
+                for sub in Submission.objects.filter(id__in=[sub.id for sub in created_submissions])
+            ],
+        })
 
     return redirect("assignment_view")
 
 
 # ============================================================
 # Submission Status Page
-# Automatically extracts text if needed
+# Polled as JSON while an upload's text is being extracted
 # ============================================================
 def submission_status(request, submission_id):
     """Show extracted text and submission state."""
-    try:
-        sub = Submission.objects.get(id=submission_id)
-    except Submission.DoesNotExist:
-        return HttpResponseBadRequest("Invalid submission ID")
+    roles = request.session.get("lti_roles", [])
+    is_staff = is_instructor_role(roles) or is_admin_role(roles)
+    user_id = request.session.get("lti_user_id")
+    sub = Submission.objects.filter(id=submission_id).first()
+    if sub is not None and not is_staff and str(sub.user_id) != str(user_id):
+        sub = None
 
-    # Perform extraction only if comment is empty and file exists
-    if sub.file and not sub.comment:
-        extracted = extract_text_from_file(sub.file.path)
-        sub.comment = extracted[:MAX_SUBMISSION_TEXT_CHARS]  # safety cap
-        sub.save()
+    if request.headers.get("accept") == "application/json":
+        payload = extraction.status_payload("submission", submission_id, sub)
+        if payload is None:
+            return JsonResponse({"status": "error", "message": "Invalid submission ID"}, status=404)
+        return JsonResponse(payload)
 
+    if sub is None:
+        return HttpResponseBadRequest("Invalid submission ID")
+    extraction.requeue_if_stale(sub)
     return render(request, "tool/submission_status.html", {
         "submission": sub,
     })
@@ -239,43 +221,54 @@ def upload_assignment_resource(request):
     if existing_size + new_size > max_total_bytes:
         return JsonResponse({"status": "error", "message": "Total upload size limit is 50MB across all files."}, status=400)
 
-    created = []
-    created_resources = []
-    for uploaded in uploads:
-        resource = AssignmentResource.objects.create(
+    created_resources = [
+        AssignmentResource.objects.create(
             assignment=assignment,
             file=uploaded,
             comment="",
             included=True,
+            extraction_status=STATUS_PENDING,
         )
-        created_resources.append(resource)
-
-        extracted = ""
-        try:
-            if resource.file and resource.file.path:
-                extracted = extract_text_from_file(resource.file.path)
-        except Exception:
-            extracted = ""
-        if _is_extracted_text_empty(extracted):
-            _cleanup_resources(created_resources)
-            return JsonResponse({
-                "status": "error",
-                "message": "No extractable text found. If this is a scanned PDF, upload a text-based version.",
-            }, status=400)
-
-        resource.comment = extracted[:MAX_SUBMISSION_TEXT_CHARS]
-        resource.save(update_fields=["comment"])
+        for uploaded in uploads
+    ]
+    if extraction.ASYNC_EXTRACTION:
+        extraction.queue_extraction(created_resources)
+    else:
+        error = extraction.extract_batch("resource", [resource.id for resource in created_resources])
+        if error:
+            return JsonResponse({"status": "error", "message": error}, status=400)
+
+    created = []
+    for resource in AssignmentResource.objects.filter(id__in=[r.id for r in created_resources]).order_by("id"):
         created.append({
             "id": resource.id,
             "file_name": resource.file.name if resource.file else "Uploaded file",
             "comment": resource.comment,
             "included": resource.included,
             "file_size": resource.file.size if resource.file else 0,
+            "extraction_status": resource.extraction_status,
         })
-
     return JsonResponse({"status": "ok", "resources": created})
 
 
+def assignment_resource_status(request, resource_id):
+    roles = request.session.get("lti_roles", [])
+    if not (is_instructor_role(roles) or is_admin_role(roles)):
+        return HttpResponseBadRequest("Forbidden")
+
+    resource_link_id = request.session.get("lti_resource_link_id")
+    if not resource_link_id:
+        return HttpResponseBadRequest("Missing LTI session info")
+
+    resource = AssignmentResource.objects.filter(id=resource_id, assignment__slug=resource_link_id).first()
+    payload = extraction.status_payload("resource", resource_id, resource)
+    if payload is None:
+        return JsonResponse({"status": "error", "message": "Invalid resource"}, status=404)
+    if resource is not None:
+        payload["comment"] = resource.comment
+    return JsonResponse(payload)
+
+
 @csrf_exempt
 def toggle_assignment_resource(request, resource_id=None):
     if request.method != "POST":
@@ -310,6 +303,8 @@ def toggle_assignment_resource(request, resource_id=None):
     included = str(included_raw).lower() in ["1", "true", "yes", "on"]
     resource.included = included
     resource.save(update_fields=["included"])
+    invalidate_assignment_context(assignment.id)
+    summaries.queue_resource_digest(assignment)
 
     return JsonResponse({"status": "ok", "included": resource.included})
 
@@ -378,4 +373,6 @@ def delete_assignment_resource(request, resource_id):
     except Exception:
         pass
     resource.delete()
+    invalidate_assignment_context(assignment.id)
+    summaries.queue_resource_digest(assignment)
     return JsonResponse({"status": "ok"})
@@ -1,19 +1,27 @@
+import asyncio
+import hashlib
 import json
+import logging
 import os
 import re
 import secrets
+import time
 from datetime import timedelta
+from functools import partial
 
+from django.core.cache import cache
+from django.db.models import Q
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, StreamingHttpResponse
 from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 
-from openai import OpenAI
-from tool.models import Submission, VivaSession, VivaSessionSubmission, InteractionLog, VivaMessage, AssignmentResource, AssignmentResourcePreference, VivaSessionResource
+from asgiref.sync import sync_to_async
+from tool import archives, extraction, llm, question_plans, retrieval, summaries, tasks
+from tool.models import STATUS_FAILED, STATUS_PENDING, STATUS_READY, Submission, VivaSession, VivaSessionSubmission, InteractionLog, VivaMessage, AssignmentResource, AssignmentResourcePreference, VivaSessionResource
 from .helpers import is_instructor_role, is_admin_role
 
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+logger = logging.getLogger(__name__)
 
 DEFAULT_VIVA_SYSTEM_PROMPT = """You are MachinaViva, an academic viva examiner running a time-limited, text-based viva.
 Your goal is to test the student's understanding of their submission.
@@ -42,10 +50,10 @@ TONE_GUIDANCE = {
     "Peer-like": "Conversational, collaborative, and academic.",
 }
 
-MODEL_ANSWER_SYSTEM_PROMPT = """Write a concise exemplar answer (2-4 sentences) to the viva question.
-Ground it only in the submission materials provided. Do not invent details.
+MODEL_ANSWERS_SYSTEM_PROMPT = """Write a concise exemplar answer (2-4 sentences) to each numbered viva question.
+Ground every answer only in the submission materials provided. Do not invent details.
 If the materials are insufficient, say so briefly and answer as generally as possible without adding new claims.
-Return only the answer text, with no labels or JSON."""
+Respond ONLY in JSON: {"answers": [{"id": 1, "model_answer": "..."}]}, with one entry per question id."""
 
 FEEDBACK_SYSTEM_PROMPT = """You are providing feedback after an informal, text-based viva chat.
 Write a single, concise paragraph of feedback (2-4 sentences).
@@ -64,6 +72,24 @@ Return only the label with no extra text."""
 
 KNOWLEDGE_FLAG_VALUES = ["Aligned", "Partially aligned", "Needs clarification", "Unclear"]
 
+EVALUATION_SYSTEM_PROMPT = f"""{FEEDBACK_SYSTEM_PROMPT}
+
+Also assign an alignment flag by comparing the student responses to the reference answers provided: exactly one of Aligned, Partially aligned, Needs clarification, Unclear.
+Use Unclear when there is not enough evidence in the responses to judge alignment.
+Respond ONLY in JSON: {{"feedback": "...", "knowledge_flag": "..."}}"""
+
+ANSWER_SCORE_SYSTEM_PROMPT = """Score each numbered student answer from a viva against its question and reference answer.
+3 = aligned with the reference answer; 2 = partially aligned; 1 = relevant but needs clarification; 0 = no evidence of understanding.
+Judge only the substance of the answer, not its length or style. When no reference answer is given, judge against the question alone.
+Respond ONLY in JSON: {"scores": [{"id": 1, "score": 2}]}, with one entry per answer id."""
+
+# Per-answer scores map onto the flag by their mean over the viva's questions.
+ANSWER_SCORE_LABELS = [(2.5, "Aligned"), (1.5, "Partially aligned"), (0.75, "Needs clarification"), (0, "Unclear")]
+
+HISTORY_SUMMARY_PROMPT = """You keep a running summary of a text-based viva between an examiner (AI) and a student.
+Update the current summary with the new exchanges. Keep every question asked, the substance of each student answer (claims, examples, uncertainty, points they promised to clarify) and which aspects of the work have been covered.
+Be concise and factual, and do not evaluate the student. Write plain text, at most 300 words."""
+
 FALLBACK_FEEDBACK = (
     "Your responses in this viva did not address the questions and were very brief, "
     "so your understanding of the submission could not be assessed. "
@@ -75,12 +101,65 @@ FALLBACK_FEEDBACK = (
 MAX_CONTEXT_CHARS = 450000
 MAX_FILE_CHARS = 150000
 MAX_HISTORY_MESSAGES = 20
+# Older messages are folded into the session's rolling summary in batches of
+# HISTORY_SUMMARY_EVERY, always keeping the last HISTORY_WINDOW_MESSAGES verbatim.
+HISTORY_WINDOW_MESSAGES = int(os.getenv("VIVA_HISTORY_WINDOW_MESSAGES", "8"))
+HISTORY_SUMMARY_EVERY = int(os.getenv("VIVA_HISTORY_SUMMARY_EVERY", "6"))
 MAX_VIVA_MESSAGE_CHARS = 2000
 FALLBACK_AI_REPLY = "Thanks. Could you clarify that point a little more?"
 FALLBACK_MODEL_ANSWER = "The submission does not provide enough detail to answer this directly, but a reasonable response would restate the relevant claim and support it with evidence from the work."
 HEARTBEAT_GRACE_SECONDS = 20
 HEARTBEAT_STALE_SECONDS = 25
 LOG_STALE_SECONDS = 30
+CONTEXT_CACHE_SECONDS = int(os.getenv("VIVA_CONTEXT_CACHE_SECONDS", "7200"))
+# A live turn waits at most this share of the student's remaining viva time
+# (never less than MIN_TURN_TIMEOUT_SECONDS), and sends a hedged second request
+# once the first has taken HEDGE_AFTER_SECONDS (0 disables hedging).
+TURN_TIME_SHARE = float(os.getenv("VIVA_TURN_TIME_SHARE", "0.25"))
+MIN_TURN_TIMEOUT_SECONDS = float(os.getenv("VIVA_MIN_TURN_TIMEOUT_SECONDS", "5"))
+HEDGE_AFTER_SECONDS = float(os.getenv("VIVA_HEDGE_AFTER_SECONDS", "8"))
+# How long ending a viva waits for a running model-answer job before filling
+# the remaining answers itself.
+MODEL_ANSWER_WAIT_SECONDS = int(os.getenv("VIVA_MODEL_ANSWER_WAIT_SECONDS", "15"))
+# Student answers are scored in the background as the viva runs, and the
+# knowledge flag is aggregated from those scores instead of a final call.
+ANSWER_SCORING = os.getenv("VIVA_ANSWER_SCORING", "true").lower() in ["1", "true", "yes", "on"]
+# "combined" writes the end-of-viva feedback and knowledge flag in one call;
+# "separate" makes a call for each.
+EVALUATION_COMBINED = "combined"
+EVALUATION_SEPARATE = "separate"
+EVALUATION_MODE = os.getenv("VIVA_EVALUATION_MODE", EVALUATION_COMBINED).strip().lower()
+# Ending a viva queues the evaluation as a background job and returns at once;
+# the page polls viva_evaluation for the result.
+BACKGROUND_EVALUATION = os.getenv("VIVA_BACKGROUND_EVALUATION", "true").lower() in ["1", "true", "yes", "on"]
+# Requests for one session are handled one at a time: a request waits up to
+# TURN_LOCK_WAIT_SECONDS for the previous one, and a lock left by a crashed
+# worker lapses after TURN_LOCK_LEASE_SECONDS.
+TURN_LOCK_WAIT_SECONDS = float(os.getenv("VIVA_TURN_LOCK_WAIT_SECONDS", "30"))
+TURN_LOCK_LEASE_SECONDS = int(os.getenv("VIVA_TURN_LOCK_LEASE_SECONDS", "300"))
+TURN_LOCK_POLL_SECONDS = 0.2
+MAX_CLIENT_MESSAGE_ID_CHARS = 64
+
+# "classic" keeps each call's own prompt; "prefix" makes every call for a session
+# open with the same system prompt (rules, assignment settings, resources, then
+# the submission) so the provider can serve that prefix from its prompt cache.
+PROMPT_LAYOUT_CLASSIC = "classic"
+PROMPT_LAYOUT_PREFIX = "prefix"
+PROMPT_LAYOUT = os.getenv("VIVA_PROMPT_LAYOUT", PROMPT_LAYOUT_CLASSIC).strip().lower()
+# "full" sends every included file as text; "retrieval" sends long files as an
+# opening and outline, plus the passages relevant to each call; "auto" only does
+# that for files longer than RETRIEVAL_MIN_CHARS.
+CONTEXT_MODE_FULL = "full"
+CONTEXT_MODE_RETRIEVAL = "retrieval"
+CONTEXT_MODE = os.getenv("VIVA_CONTEXT_MODE", "auto").strip().lower()
+RETRIEVAL_MIN_CHARS = int(os.getenv("VIVA_RETRIEVAL_MIN_CHARS", "40000"))
+RETRIEVAL_TOP_K = int(os.getenv("VIVA_RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_QUERY_MESSAGES = 4
+DOCUMENT_OPENING_CHARS = 3000
+PREFIX_TASK_PREAMBLE = (
+    "The viva is paused for an internal step. For this reply only, ignore the examiner "
+    "rules and JSON format above and follow these instructions, using the materials above."
+)
 
 
 def _format_feedback_author(user):
@@ -243,6 +322,88 @@ def parse_viva_payload(raw_text):
     return cleaned, ""
 
 
+JSON_STRING_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class QuestionStreamParser:
+    """
+    Incrementally pulls the "question" value out of a streamed viva payload so
+    the question text can be pushed to the student before the completion ends.
+    parse_viva_payload still decides the final question once the stream closes.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None
+        self.plain_text = False
+        self.done = False
+
+    def feed(self, chunk):
+        if not chunk or self.done:
+            return ""
+        self.buffer += chunk
+        if self.plain_text:
+            return self._take_plain_text()
+        if self.position is None:
+            stripped = self.buffer.lstrip()
+            if not stripped:
+                return ""
+            if stripped[0] not in "{`":
+                self.plain_text = True
+                self.position = len(self.buffer) - len(stripped)
+                return self._take_plain_text()
+            match = re.search(r'"question"\s*:\s*"', self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+        return self._take_json_string()
+
+    def _take_plain_text(self):
+        delta = self.buffer[self.position:]
+        self.position = len(self.buffer)
+        return delta
+
+    def _take_json_string(self):
+        buf = self.buffer
+        idx = self.position
+        out = []
+        while idx < len(buf):
+            ch = buf[idx]
+            if ch == "\\":
+                if idx + 1 >= len(buf):
+                    break
+                escape = buf[idx + 1]
+                if escape == "u":
+                    if idx + 6 > len(buf):
+                        break
+                    try:
+                        out.append(chr(int(buf[idx + 2:idx + 6], 16)))
+                    except ValueError:
+                        pass
+                    idx += 6
+                    continue
+                out.append(JSON_STRING_ESCAPES.get(escape, escape))
+                idx += 2
+                continue
+            if ch == '"':
+                self.done = True
+                idx += 1
+                break
+            out.append(ch)
+            idx += 1
+        self.position = idx
+        return "".join(out)
+
+
 def _word_count(text):
     return len(re.findall(r"[A-Za-z0-9']+", text or ""))
 
@@ -283,8 +444,66 @@ def _use_feedback_fallback(history):
     return False
 
 
-def build_submission_context(session):
-    parts = []
+def _uses_retrieval(text):
+    if CONTEXT_MODE == CONTEXT_MODE_FULL:
+        return False
+    if CONTEXT_MODE == CONTEXT_MODE_RETRIEVAL:
+        return len(text) > retrieval.CHUNK_CHARS * 2
+    return len(text) > RETRIEVAL_MIN_CHARS
+
+
+def _document_summary(obj):
+    """The ready summary of obj, queueing one if its long text has none yet."""
+    summary = summaries.ready_summary(obj)
+    if summary is None and obj.summary_status in ("", STATUS_READY):
+        summaries.queue_summary(obj)
+    return summary
+
+
+def _summary_lines(summary):
+    lines = [f"Document digest:\n{summary['digest']}"]
+    sections = summary.get("sections") or []
+    if sections:
+        lines.append(
+            "Section summaries:\n"
+            + "\n\n".join(f"{section['title']}:\n{section['summary']}" for section in sections)
+        )
+    return lines
+
+
+def _summary_part(label, file_name, summary, text):
+    lines = [f"{label}: {file_name} (summarised; the full text is {len(text):,} characters)"]
+    return "\n".join(lines + _summary_lines(summary))
+
+
+def _retrieval_part(label, file_name, obj, text):
+    lines = [
+        f"{label}: {file_name} (long document, {len(text):,} characters; "
+        "passages relevant to each exchange are supplied separately)",
+    ]
+    summary = _document_summary(obj)
+    if summary:
+        lines.extend(_summary_lines(summary))
+        return "\n".join(lines)
+    lines.append(f"Opening:\n{text[:DOCUMENT_OPENING_CHARS]}")
+    outline = retrieval.get_index(obj).get("outline") or []
+    if outline:
+        lines.append("Outline:\n" + "\n".join(f"- {item['title']}" for item in outline))
+    return "\n".join(lines)
+
+
+def _context_parts(session):
+    """
+    Returns (resource_parts, file_parts, retrieval_sources) for the session's
+    included materials, sharing one MAX_CONTEXT_CHARS budget with resources
+    taken first. The resources are replaced by the assignment's resource
+    digest when it covers exactly this selection. Long documents handled by
+    retrieval are listed in retrieval_sources as ("resource" | "submission",
+    id); text that would be truncated is replaced by its summary once ready.
+    """
+    resource_parts = []
+    file_parts = []
+    retrieval_sources = []
     total = 0
 
     resource_links_all = VivaSessionResource.objects.filter(
@@ -301,6 +520,19 @@ def build_submission_context(session):
             assignment=session.submission.assignment,
             included=True
         )
+    resources = sorted(
+        (resource for resource in resources if (resource.comment or "").strip()),
+        key=lambda resource: resource.id,
+    )
+    assignment = session.submission.assignment
+    digest = summaries.ready_resource_digest(assignment, [resource.id for resource in resources])
+    if digest:
+        names = ", ".join(resource.file.name if resource.file else "Resource file" for resource in resources)
+        resource_parts.append(f"Resource digest (condensed from: {names})\n{digest}")
+        total += len(resource_parts[-1])
+        resources = []
+    elif resources:
+        summaries.queue_resource_digest(assignment)
     for resource in resources:
         file_name = resource.file.name if resource.file else "Resource file"
         text = (resource.comment or "").strip()
@@ -309,10 +541,22 @@ def build_submission_context(session):
         remaining = MAX_CONTEXT_CHARS - total
         if remaining <= 0:
             break
+        if _uses_retrieval(text):
+            part = _retrieval_part("Resource", file_name, resource, text)
+            resource_parts.append(part)
+            retrieval_sources.append(("resource", resource.id))
+            total += len(part)
+            continue
         take = min(len(text), MAX_FILE_CHARS, remaining)
+        summary = _document_summary(resource) if take < len(text) else None
+        if summary:
+            part = _summary_part("Resource", file_name, summary, text)
+            resource_parts.append(part)
+            total += len(part)
+            continue
         snippet = text[:take]
         suffix = " (truncated)" if take < len(text) else ""
-        parts.append(f"Resource: {file_name}\n{snippet}{suffix}")
+        resource_parts.append(f"Resource: {file_name}\n{snippet}{suffix}")
         total += take
 
     links = VivaSessionSubmission.objects.filter(
@@ -328,18 +572,39 @@ def build_submission_context(session):
         remaining = MAX_CONTEXT_CHARS - total
         if remaining <= 0:
             break
+        if _uses_retrieval(text):
+            part = _retrieval_part("File", file_name, sub, text)
+            file_parts.append(part)
+            retrieval_sources.append(("submission", sub.id))
+            total += len(part)
+            continue
         take = min(len(text), MAX_FILE_CHARS, remaining)
+        summary = _document_summary(sub) if take < len(text) else None
+        if summary:
+            part = _summary_part("File", file_name, summary, text)
+            file_parts.append(part)
+            total += len(part)
+            continue
         snippet = text[:take]
         suffix = " (truncated)" if take < len(text) else ""
-        parts.append(f"File: {file_name}\n{snippet}{suffix}")
+        file_parts.append(f"File: {file_name}\n{snippet}{suffix}")
         total += take
 
+    return resource_parts, file_parts, retrieval_sources
+
+
+def _join_context_parts(parts):
     if not parts:
         return "No extracted submission text available."
     return "\n\n".join(parts)
 
 
-def build_system_prompt(assignment, submission_context):
+def build_submission_context(session):
+    resource_parts, file_parts, _ = _context_parts(session)
+    return _join_context_parts(resource_parts + file_parts)
+
+
+def _assignment_prompt_sections(assignment):
     tone_label = (assignment.viva_tone or "Supportive").strip()
     tone_detail = TONE_GUIDANCE.get(tone_label, f"Use a {tone_label} tone.")
 
@@ -362,136 +627,785 @@ def build_system_prompt(assignment, submission_context):
             "Ask these before other questions, and cover all if time allows.\n"
             f"{assignment.additional_prompts.strip()}"
         )
+    return sections
+
+
+def _session_question_plan(session):
+    """
+    Planned questions for the session: from its own submission if that has a
+    ready plan, otherwise from the first included submission that does.
+    """
+    candidates = [session.submission] + [
+        link.submission
+        for link in VivaSessionSubmission.objects.filter(session=session, included=True)
+        .select_related("submission")
+        .order_by("submission_id")
+    ]
+    for submission in candidates:
+        plan = question_plans.ready_question_plan(submission)
+        if plan:
+            return plan
+    return []
+
+
+def _question_plan_section(plan):
+    if not plan:
+        return ""
+    lines = "\n".join(f"- {item['question']}" for item in plan)
+    return (
+        "Prepared question plan (use it to choose aspects to cover; adapt the wording to the conversation):\n"
+        f"{lines}"
+    )
 
+
+def build_system_prompt(assignment, submission_context, plan=None):
+    sections = _assignment_prompt_sections(assignment)
     if submission_context:
         sections.append(f"Submission materials:\n{submission_context}")
+    if plan:
+        sections.append(_question_plan_section(plan))
+    return "\n\n".join(sections)
 
+
+def build_prefix_system_prompt(assignment, resource_parts, file_parts, plan=None):
+    """
+    Same content as build_system_prompt, ordered from most to least shared:
+    the static rules, the assignment settings and resources every student on
+    the assignment sees, then this student's files.
+    """
+    sections = _assignment_prompt_sections(assignment)
+    if resource_parts:
+        sections.append("Assignment resources:\n" + "\n\n".join(resource_parts))
+    if file_parts:
+        sections.append("Student submission:\n" + "\n\n".join(file_parts))
+    if not resource_parts and not file_parts:
+        sections.append(f"Submission materials:\n{_join_context_parts([])}")
+    if plan:
+        sections.append(_question_plan_section(plan))
     return "\n\n".join(sections)
 
 
-def build_chat_messages(session, assignment, submission_context=None):
-    if submission_context is None:
-        submission_context = build_submission_context(session)
-    system_prompt = build_system_prompt(assignment, submission_context)
-    messages = [{"role": "system", "content": system_prompt}]
+def _context_version_key(scope, object_id):
+    return f"viva_context_version:{scope}:{object_id}"
 
-    history = list(VivaMessage.objects.filter(session=session).order_by("timestamp"))
-    if MAX_HISTORY_MESSAGES and len(history) > MAX_HISTORY_MESSAGES:
-        history = history[-MAX_HISTORY_MESSAGES:]
+
+def _bump_context_version(scope, object_id):
+    key = _context_version_key(scope, object_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def invalidate_session_context(session_id):
+    _bump_context_version("session", session_id)
+
+
+def invalidate_assignment_context(assignment_id):
+    _bump_context_version("assignment", assignment_id)
+
+
+def _context_fingerprint(session):
+    """
+    Hash of everything the compiled context depends on. Only IDs, summary
+    states and short settings are read here, never the extracted text itself.
+    """
+    assignment = session.submission.assignment
+    submission_ids = list(
+        VivaSessionSubmission.objects.filter(session=session, included=True)
+        .order_by("submission_id")
+        .values_list("submission_id", "submission__summary_status", "submission__question_plan_status")
+    )
+    resource_links = VivaSessionResource.objects.filter(session=session)
+    if resource_links.exists():
+        resource_ids = list(
+            resource_links.filter(included=True)
+            .order_by("resource_id")
+            .values_list("resource_id", "resource__summary_status")
+        )
+    else:
+        resource_ids = list(
+            AssignmentResource.objects.filter(assignment=assignment, included=True)
+            .order_by("id")
+            .values_list("id", "summary_status")
+        )
+    versions = cache.get_many([
+        _context_version_key("session", session.id),
+        _context_version_key("assignment", assignment.id),
+    ])
+    parts = [
+        submission_ids,
+        resource_ids,
+        assignment.title,
+        assignment.description,
+        assignment.viva_tone,
+        assignment.viva_instructions,
+        assignment.additional_prompts,
+        PROMPT_LAYOUT,
+        CONTEXT_MODE,
+        assignment.resource_digest_key,
+        assignment.resource_digest_status,
+        session.submission.question_plan_status,
+        sorted(versions.items()),
+    ]
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+def get_compiled_context(session):
+    """
+    Returns {"submission_context", "system_prompt", "retrieval_sources",
+    "question_plan"} for the session, reusing the copy in the shared cache until
+    the included files or settings change.
+    """
+    key = f"viva_context:{session.id}:{_context_fingerprint(session)}"
+    compiled = cache.get(key)
+    if compiled is None:
+        assignment = session.submission.assignment
+        resource_parts, file_parts, retrieval_sources = _context_parts(session)
+        submission_context = _join_context_parts(resource_parts + file_parts)
+        plan = _session_question_plan(session)
+        if PROMPT_LAYOUT == PROMPT_LAYOUT_PREFIX:
+            system_prompt = build_prefix_system_prompt(assignment, resource_parts, file_parts, plan)
+        else:
+            system_prompt = build_system_prompt(assignment, submission_context, plan)
+        compiled = {
+            "submission_context": submission_context,
+            "system_prompt": system_prompt,
+            "retrieval_sources": retrieval_sources,
+            "question_plan": plan,
+        }
+        cache.set(key, compiled, CONTEXT_CACHE_SECONDS)
+    return compiled
+
+
+def retrieve_passages(compiled, query):
+    """
+    Top RETRIEVAL_TOP_K passages for query across the long documents in the
+    compiled context, formatted as one block; "" when there are none.
+    """
+    sources = compiled.get("retrieval_sources") or []
+    if not sources or not (query or "").strip():
+        return ""
+    models_by_kind = {"resource": AssignmentResource, "submission": Submission}
+    hits = []
+    for kind, object_id in sources:
+        obj = models_by_kind[kind].objects.filter(id=object_id).only("id", "file", "comment").first()
+        if obj is None:
+            continue
+        index = retrieval.get_index(obj)
+        spans = index.get("spans") or []
+        for chunk_id, score in retrieval.search(index, query, RETRIEVAL_TOP_K):
+            hits.append((score, kind, obj, chunk_id, spans))
+    if not hits:
+        return ""
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    blocks = []
+    for _, kind, obj, chunk_id, spans in hits[:RETRIEVAL_TOP_K]:
+        start, end = spans[chunk_id]
+        chunk_count = len(spans)
+        label = "Resource" if kind == "resource" else "File"
+        file_name = obj.file.name if obj.file else "Uploaded text"
+        blocks.append(f"[{label}: {file_name}, passage {chunk_id + 1} of {chunk_count}]\n{obj.comment[start:end].strip()}")
+    return "Relevant passages from the long documents:\n\n" + "\n\n".join(blocks)
+
+
+def _recent_history(session):
+    """
+    The messages not yet folded into the session's rolling summary, oldest
+    first, capped at MAX_HISTORY_MESSAGES in case folding has fallen behind.
+    """
+    history = VivaMessage.objects.filter(session=session)
+    if session.history_summary_message_id:
+        history = history.filter(id__gt=session.history_summary_message_id)
+    history = history.order_by("-timestamp", "-id")
+    if MAX_HISTORY_MESSAGES:
+        history = history[:MAX_HISTORY_MESSAGES]
+    return list(reversed(history))
+
+
+def _transcript(messages):
+    lines = []
+    for msg in messages:
+        speaker = "AI" if (msg.sender or "").lower() == "ai" else "Student"
+        lines.append(f"{speaker}: {msg.text}")
+    return "\n".join(lines)
+
+
+def summarise_history(session_id):
+    """
+    Background job: folds the session's older messages, all but the last
+    HISTORY_WINDOW_MESSAGES, into its rolling summary.
+    """
+    try:
+        session = VivaSession.objects.filter(id=session_id).first()
+        if session is None:
+            return
+        pointer = session.history_summary_message_id
+        pending = VivaMessage.objects.filter(session=session)
+        if pointer:
+            pending = pending.filter(id__gt=pointer)
+        pending = list(pending.order_by("timestamp", "id"))
+        older = pending[:-HISTORY_WINDOW_MESSAGES] if HISTORY_WINDOW_MESSAGES else pending
+        if len(older) < HISTORY_SUMMARY_EVERY:
+            return
+        summary = llm.complete(
+            llm.TASK_HISTORY_SUMMARY,
+            [
+                {"role": "system", "content": HISTORY_SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": (
+                        f"Current summary:\n{session.history_summary or 'None yet.'}\n\n"
+                        f"New exchanges:\n{_transcript(older)}"
+                    ),
+                },
+            ],
+            temperature=0.2,
+            session=session,
+        )
+        if summary:
+            VivaSession.objects.filter(id=session_id, history_summary_message_id=pointer).update(
+                history_summary=summary,
+                history_summary_message_id=older[-1].id,
+            )
+    finally:
+        cache.delete(f"viva_history_summary:{session_id}")
+
+
+def queue_history_summary(session):
+    """Queues summarise_history once enough messages have built up behind the recent window."""
+    pending = VivaMessage.objects.filter(session=session)
+    if session.history_summary_message_id:
+        pending = pending.filter(id__gt=session.history_summary_message_id)
+    if pending.count() < HISTORY_WINDOW_MESSAGES + HISTORY_SUMMARY_EVERY:
+        return False
+    if not cache.add(f"viva_history_summary:{session.id}", 1, 300):
+        return False
+    tasks.submit(summarise_history, session.id)
+    return True
+
+
+def _history_summary_message(session):
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier viva conversation:\n{session.history_summary}",
+    }
+
+
+def build_chat_messages(session, assignment, compiled=None):
+    if compiled is None:
+        compiled = get_compiled_context(session)
+    messages = [{"role": "system", "content": compiled["system_prompt"]}]
+    if session.history_summary:
+        messages.append(_history_summary_message(session))
+
+    history = _recent_history(session)
     for msg in history:
         sender = (msg.sender or "").lower()
         role = "assistant" if sender == "ai" else "user"
         messages.append({"role": role, "content": msg.text})
+
+    # Passages go last so the system prompt and history stay a stable prefix.
+    query = "\n".join(msg.text for msg in history[-RETRIEVAL_QUERY_MESSAGES:])
+    passages = retrieve_passages(compiled, query)
+    if passages:
+        messages.append({"role": "system", "content": passages})
     return messages
 
 
-def generate_model_answer(client, question, submission_context):
-    if not question:
-        return ""
-    messages = [
-        {"role": "system", "content": MODEL_ANSWER_SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": f"Question:\n{question}\n\nSubmission materials:\n{submission_context}",
-        },
+def _prefix_task_messages(compiled, instructions, content):
+    """Messages for a non-question task that reuse the session's cached prompt prefix."""
+    return [
+        {"role": "system", "content": compiled["system_prompt"]},
+        {"role": "user", "content": f"{PREFIX_TASK_PREAMBLE}\n\n{instructions}\n\n{content}"},
+    ]
+
+
+def _with_passages(content, passages):
+    return f"{content}\n\n{passages}" if passages else content
+
+
+def _task_context(task, session, compiled, query):
+    """
+    Returns (policy, materials, passages) for a post-question task under its
+    route's context policy: materials is the "Submission materials" block of
+    the classic layout, passages the retrieved passages to append.
+    """
+    policy = llm.route(task, session.submission.assignment)["context"]
+    if policy == llm.CONTEXT_NONE:
+        return policy, "", ""
+    materials = f"Submission materials:\n{compiled['submission_context']}" if policy == llm.CONTEXT_FULL else ""
+    return policy, materials, retrieve_passages(compiled, query)
+
+
+def _joined(*parts):
+    return "\n\n".join(part for part in parts if part)
+
+
+def _model_answers_messages(session, questions, compiled):
+    numbered = "\n".join(f"{idx}. {question}" for idx, question in enumerate(questions, start=1))
+    policy, materials, passages = _task_context(llm.TASK_MODEL_ANSWER, session, compiled, "\n".join(questions))
+    if PROMPT_LAYOUT == PROMPT_LAYOUT_PREFIX and policy == llm.CONTEXT_FULL:
+        return _prefix_task_messages(
+            compiled,
+            MODEL_ANSWERS_SYSTEM_PROMPT,
+            _with_passages(f"Questions:\n{numbered}", passages),
+        )
+    return [
+        {"role": "system", "content": MODEL_ANSWERS_SYSTEM_PROMPT},
+        {"role": "user", "content": _joined(f"Questions:\n{numbered}", materials, passages)},
     ]
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=messages,
+
+
+def parse_model_answers(raw_text, count):
+    """Returns a list of count answers from the model's JSON, "" where one is missing."""
+    raw_text = (raw_text or "").strip()
+    try:
+        data = json.loads(raw_text)
+    except Exception:
+        match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except Exception:
+            data = {}
+    items = data.get("answers") if isinstance(data, dict) else data
+    answers = [""] * count
+    for position, item in enumerate(items if isinstance(items, list) else []):
+        if isinstance(item, dict):
+            try:
+                idx = int(item.get("id")) - 1
+            except (TypeError, ValueError):
+                idx = position
+            answer = str(item.get("model_answer") or "").strip()
+        else:
+            idx, answer = position, str(item or "").strip()
+        if 0 <= idx < count and answer:
+            answers[idx] = answer
+    return answers
+
+
+def fill_model_answers(session_id):
+    """
+    Writes model answers for every examiner question in the session that does
+    not have one yet, using a single completion for the whole batch.
+    """
+    session = VivaSession.objects.select_related("submission__assignment").filter(id=session_id).first()
+    if session is None:
+        return 0
+    pending = list(
+        VivaMessage.objects.filter(session=session, sender="ai", model_answer="")
+        .exclude(text=FALLBACK_AI_REPLY)
+        .order_by("timestamp", "id")
+    )
+    if not pending:
+        return 0
+    questions = [msg.text for msg in pending]
+    raw_text = llm.complete(
+        llm.TASK_MODEL_ANSWER,
+        _model_answers_messages(session, questions, get_compiled_context(session)),
         temperature=0.2,
+        session=session,
+        response_format={"type": "json_object"},
     )
-    return (response.choices[0].message.content or "").strip()
+    answers = parse_model_answers(raw_text, len(questions))
+    for msg, answer in zip(pending, answers):
+        # A message that got its answer elsewhere in the meantime keeps it.
+        VivaMessage.objects.filter(id=msg.id, model_answer="").update(
+            model_answer=answer or FALLBACK_MODEL_ANSWER
+        )
+    return len(pending)
 
 
-def generate_viva_reply(session):
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY")
+def _model_answers_job(session_id):
+    try:
+        fill_model_answers(session_id)
+    finally:
+        cache.delete(f"viva_model_answers:{session_id}")
+
+
+def queue_model_answers(session):
+    """Fills the session's missing model answers in the background unless a job is already running."""
+    if not cache.add(f"viva_model_answers:{session.id}", 1, 300):
+        return False
+    tasks.submit(_model_answers_job, session.id)
+    return True
+
+
+def _finish_session_job(lock_key, job, session_id, wait_seconds):
+    """
+    Waits up to wait_seconds for a running background job, then runs it once
+    more in-line. If the running job still holds the lock by then, it is left
+    to finish on its own. The job releases the lock, so it only runs here once
+    this call holds it.
+    """
+    deadline = time.monotonic() + wait_seconds
+    while not cache.add(lock_key, 1, 300):
+        if time.monotonic() >= deadline:
+            logger.warning("Gave up waiting for %s; the running job will finish it", lock_key)
+            return False
+        time.sleep(0.25)
+    try:
+        job(session_id)
+    except Exception:
+        logger.exception("Finishing %s failed", lock_key)
+    return True
+
+
+def complete_model_answers(session):
+    """
+    Used when a viva ends: waits up to MODEL_ANSWER_WAIT_SECONDS for a running
+    background job, then fills whatever answers are still missing.
+    """
+    _finish_session_job(f"viva_model_answers:{session.id}", _model_answers_job, session.id, MODEL_ANSWER_WAIT_SECONDS)
+
+
+def _answer_score_messages(items):
+    numbered = "\n\n".join(
+        f"{idx}. Question: {question.text}\n"
+        f"Reference answer: {question.model_answer or 'None given.'}\n"
+        f"Student answer: {answer.text}"
+        for idx, (answer, question) in enumerate(items, start=1)
+    )
+    return [
+        {"role": "system", "content": ANSWER_SCORE_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Answers:\n{numbered}"},
+    ]
+
+
+def parse_answer_scores(raw_text, count):
+    """Returns a list of count scores (0-3) from the model's JSON, None where one is missing."""
+    raw_text = (raw_text or "").strip()
+    try:
+        data = json.loads(raw_text)
+    except Exception:
+        match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except Exception:
+            data = {}
+    items = data.get("scores") if isinstance(data, dict) else data
+    scores = [None] * count
+    for position, item in enumerate(items if isinstance(items, list) else []):
+        try:
+            if isinstance(item, dict):
+                idx = int(item.get("id")) - 1 if item.get("id") is not None else position
+                score = int(item.get("score"))
+            else:
+                idx, score = position, int(item)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= idx < count and 0 <= score <= 3:
+            scores[idx] = score
+    return scores
+
+
+def score_answers(session_id, final=False):
+    """
+    Scores every unscored student answer in the session against the question
+    it answers, in one small completion for the batch. Non-answers score 0
+    without a call. When the assignment generates model answers, answers
+    whose question is still waiting for one are left for a later run until
+    final; otherwise they are scored against the question alone.
+    """
+    session = VivaSession.objects.select_related("submission__assignment").filter(id=session_id).first()
+    if session is None:
+        return 0
+    messages = list(VivaMessage.objects.filter(session=session).order_by("timestamp", "id"))
+    # Only worth waiting for a model answer if a fill job is going to write one.
+    await_model_answers = session.submission.assignment.enable_model_answers and not final
+    pending = []
+    question = None
+    for msg in messages:
+        if (msg.sender or "").lower() == "ai":
+            question = msg
+            continue
+        if msg.answer_score is not None:
+            continue
+        if question is None or _classify_student_response(msg.text) != "answer":
+            VivaMessage.objects.filter(id=msg.id, answer_score__isnull=True).update(answer_score=0)
+            continue
+        if not question.model_answer and question.text != FALLBACK_AI_REPLY and await_model_answers:
+            continue
+        pending.append((msg, question))
+    if not pending:
+        return 0
+    raw_text = llm.complete(
+        llm.TASK_ANSWER_SCORE,
+        _answer_score_messages(pending),
+        temperature=0,
+        session=session,
+        response_format={"type": "json_object"},
+    )
+    scores = parse_answer_scores(raw_text, len(pending))
+    for (msg, _), score in zip(pending, scores):
+        if score is not None:
+            VivaMessage.objects.filter(id=msg.id, answer_score__isnull=True).update(answer_score=score)
+    return len(pending)
 
-    assignment = session.submission.assignment
-    submission_context = build_submission_context(session)
-    client = OpenAI(api_key=api_key)
-    priority_questions = _extract_priority_questions(assignment.additional_prompts)
-    if priority_questions:
-        asked_ai = [
-            _normalize_question(m.text)
-            for m in VivaMessage.objects.filter(session=session, sender="ai")
-        ]
-        for question in priority_questions:
-            normalized = _normalize_question(question)
-            if any(normalized and normalized in asked for asked in asked_ai):
-                continue
-            try:
-                model_answer = generate_model_answer(client, question, submission_context)
-            except Exception:
-                model_answer = ""
-            if not model_answer:
-                model_answer = FALLBACK_MODEL_ANSWER
-            return question, model_answer
 
-    messages = build_chat_messages(session, assignment, submission_context=submission_context)
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=messages,
-        temperature=0.4,
+def _answer_scores_job(session_id, final=False):
+    try:
+        score_answers(session_id, final)
+    finally:
+        cache.delete(f"viva_answer_scores:{session_id}")
+
+
+def queue_answer_scores(session):
+    """Scores the session's new answers in the background unless a job is already running."""
+    if not cache.add(f"viva_answer_scores:{session.id}", 1, 300):
+        return False
+    tasks.submit(_answer_scores_job, session.id)
+    return True
+
+
+def complete_answer_scores(session):
+    """Used when a viva ends: waits for a running scoring job, then scores every answer left."""
+    _finish_session_job(
+        f"viva_answer_scores:{session.id}",
+        partial(_answer_scores_job, final=True),
+        session.id,
+        MODEL_ANSWER_WAIT_SECONDS,
     )
-    raw_text = (response.choices[0].message.content or "").strip()
+
+
+def _next_priority_question(session, assignment):
+    asked = set(session.asked_priority or [])
+    for idx, question in enumerate(_extract_priority_questions(assignment.additional_prompts)):
+        if idx not in asked:
+            return question
+    return ""
+
+
+def advance_session_state(session, ai_text):
+    """
+    Records a newly written examiner message on the session: the turn count,
+    any priority question it asks and the plan aspect it covers.
+    """
+    normalized = _normalize_question(ai_text)
+    asked = list(session.asked_priority or [])
+    for idx, question in enumerate(_extract_priority_questions(session.submission.assignment.additional_prompts)):
+        target = _normalize_question(question)
+        if idx not in asked and target and target in normalized:
+            asked.append(idx)
+    aspects = list(session.aspects_covered or [])
+    for item in question_plans.ready_question_plan(session.submission):
+        aspect = item.get("aspect")
+        if aspect and aspect not in aspects and _normalize_question(item["question"]) == normalized:
+            aspects.append(aspect)
+    session.turn_count = (session.turn_count or 0) + 1
+    session.asked_priority = asked
+    session.aspects_covered = aspects
+    session.save(update_fields=["turn_count", "asked_priority", "aspects_covered"])
+
+
+def _turn_timeout(session, assignment):
+    """Seconds the live turn may spend on the model, bounded by the viva time left."""
+    budget = llm.route(llm.TASK_QUESTION, assignment)["timeout"]
+    if session.started_at and assignment.viva_duration_seconds:
+        remaining = assignment.viva_duration_seconds - (now() - session.started_at).total_seconds()
+        budget = min(budget, remaining * TURN_TIME_SHARE)
+    return max(budget, MIN_TURN_TIMEOUT_SECONDS)
+
+
+def _fallback_question(session, plan):
+    """
+    (question, model_answer) to send when the model misses the turn's deadline:
+    the next planned question on an aspect not yet covered, else a stock follow-up.
+    """
+    covered = set(session.aspects_covered or [])
+    for item in plan[1:] if session.turn_count else plan:
+        if item.get("aspect") and item["aspect"] not in covered:
+            return item["question"], item.get("model_answer", "")
+    return FALLBACK_AI_REPLY, ""
+
+
+def _prepare_viva_turn(session):
+    """
+    Collects everything a viva turn needs from the database. When the next
+    priority question is due, or the opening question can be taken from the
+    question plan, "question" is set and no completion is needed; a planned
+    question also comes with its "model_answer". Otherwise "llm_options" bound
+    the completion by the time left and "fallback" is sent if it runs out.
+    """
+    assignment = session.submission.assignment
+    compiled = get_compiled_context(session)
+    question = _next_priority_question(session, assignment)
+    model_answer = ""
+    plan = compiled.get("question_plan") or []
+    if not question and plan and not session.turn_count:
+        question = plan[0]["question"]
+        model_answer = plan[0].get("model_answer", "")
+    messages = None
+    llm_options = {}
+    fallback = None
+    if not question:
+        messages = build_chat_messages(session, assignment, compiled=compiled)
+        timeout = _turn_timeout(session, assignment)
+        llm_options = {
+            "timeout": timeout,
+            "hedge_after": HEDGE_AFTER_SECONDS if 0 < HEDGE_AFTER_SECONDS < timeout else None,
+        }
+        fallback = _fallback_question(session, plan)
+    return {
+        "compiled": compiled,
+        "question": question,
+        "model_answer": model_answer,
+        "messages": messages,
+        "llm_options": llm_options,
+        "fallback": fallback,
+    }
+
+
+def generate_viva_reply(session):
+    turn = _prepare_viva_turn(session)
+    if turn["question"]:
+        return turn["question"], turn["model_answer"]
+
+    try:
+        raw_text = llm.complete(
+            llm.TASK_QUESTION, turn["messages"], temperature=0.4, session=session, **turn["llm_options"]
+        )
+    except llm.FALLBACK_ERRORS:
+        return turn["fallback"]
     question, model_answer = parse_viva_payload(raw_text)
     if not question:
         question = FALLBACK_AI_REPLY
-    if not model_answer:
-        try:
-            model_answer = generate_model_answer(client, question, submission_context)
-        except Exception:
-            model_answer = ""
-    if not model_answer:
-        model_answer = FALLBACK_MODEL_ANSWER
     return question, model_answer
 
 
-def generate_viva_feedback(session):
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY")
+async def agenerate_viva_reply(session):
+    turn = await sync_to_async(_prepare_viva_turn)(session)
+    if turn["question"]:
+        return turn["question"], turn["model_answer"]
 
+    try:
+        raw_text = await llm.acomplete(
+            llm.TASK_QUESTION, turn["messages"], temperature=0.4, session=session, **turn["llm_options"]
+        )
+    except llm.FALLBACK_ERRORS:
+        return turn["fallback"]
+    question, model_answer = parse_viva_payload(raw_text)
+    if not question:
+        question = FALLBACK_AI_REPLY
+    return question, model_answer
+
+
+def stream_viva_reply(session):
+    """
+    Streaming counterpart of generate_viva_reply. Yields ("delta", text) events
+    as question text arrives, then a single ("done", question, model_answer).
+    """
+    turn = _prepare_viva_turn(session)
+    if turn["question"]:
+        yield "delta", turn["question"]
+        yield "done", turn["question"], turn["model_answer"]
+        return
+
+    parser = QuestionStreamParser()
+    raw_parts = []
+    try:
+        for content in llm.stream(
+            llm.TASK_QUESTION, turn["messages"], temperature=0.4, session=session, **turn["llm_options"]
+        ):
+            raw_parts.append(content)
+            delta = parser.feed(content)
+            if delta:
+                yield "delta", delta
+    except llm.FALLBACK_ERRORS:
+        if raw_parts:
+            raise
+        yield "delta", turn["fallback"][0]
+        yield "done", *turn["fallback"]
+        return
+    question, model_answer = parse_viva_payload("".join(raw_parts).strip())
+    if not question:
+        question = FALLBACK_AI_REPLY
+    yield "done", question, model_answer
+
+
+async def astream_viva_reply(session):
+    turn = await sync_to_async(_prepare_viva_turn)(session)
+    if turn["question"]:
+        yield "delta", turn["question"]
+        yield "done", turn["question"], turn["model_answer"]
+        return
+
+    parser = QuestionStreamParser()
+    raw_parts = []
+    try:
+        async for content in llm.astream(
+            llm.TASK_QUESTION, turn["messages"], temperature=0.4, session=session, **turn["llm_options"]
+        ):
+            raw_parts.append(content)
+            delta = parser.feed(content)
+            if delta:
+                yield "delta", delta
+    except llm.FALLBACK_ERRORS:
+        if raw_parts:
+            raise
+        yield "delta", turn["fallback"][0]
+        yield "done", *turn["fallback"]
+        return
+    question, model_answer = parse_viva_payload("".join(raw_parts).strip())
+    if not question:
+        question = FALLBACK_AI_REPLY
+    yield "done", question, model_answer
+
+
+def _prepare_feedback_messages(session, task=llm.TASK_FEEDBACK, instructions=FEEDBACK_SYSTEM_PROMPT, extra=""):
+    """
+    Returns the feedback prompt, or None when the fallback feedback applies.
+    The evaluation call reuses it with its own instructions and extra content.
+    """
     assignment = session.submission.assignment
-    submission_context = build_submission_context(session)
-    history = list(VivaMessage.objects.filter(session=session).order_by("timestamp"))
-    if MAX_HISTORY_MESSAGES and len(history) > MAX_HISTORY_MESSAGES:
-        history = history[-MAX_HISTORY_MESSAGES:]
-    if _use_feedback_fallback(history):
-        return FALLBACK_FEEDBACK
-    transcript_lines = []
-    for msg in history:
-        speaker = "AI" if (msg.sender or "").lower() == "ai" else "Student"
-        transcript_lines.append(f"{speaker}: {msg.text}")
-    transcript = "\n".join(transcript_lines) if transcript_lines else "No transcript available."
+    if _use_feedback_fallback(VivaMessage.objects.filter(session=session).only("sender", "text")):
+        return None
+    compiled = get_compiled_context(session)
+    transcript = _transcript(_recent_history(session)) or "No transcript available."
+    if session.history_summary:
+        transcript = f"Summary of earlier exchanges:\n{session.history_summary}\n\nLater exchanges:\n{transcript}"
     assignment_title = assignment.title or "Untitled assignment"
     assignment_desc = assignment.description or ""
     viva_instructions = (assignment.viva_instructions or "").strip()
     additional_prompts = (assignment.additional_prompts or "").strip()
 
-    messages = [
-        {"role": "system", "content": FEEDBACK_SYSTEM_PROMPT},
+    policy, materials, passages = _task_context(task, session, compiled, transcript)
+    if PROMPT_LAYOUT == PROMPT_LAYOUT_PREFIX and policy == llm.CONTEXT_FULL:
+        return _prefix_task_messages(
+            compiled,
+            instructions,
+            _with_passages(_joined(f"Viva transcript:\n{transcript}", extra), passages),
+        )
+    return [
+        {"role": "system", "content": instructions},
         {
             "role": "user",
-            "content": (
+            "content": _joined(
                 f"Assignment: {assignment_title}\n"
-                f"Description: {assignment_desc}\n\n"
+                f"Description: {assignment_desc}",
                 f"Viva instructions: {viva_instructions or 'None'}\n"
-                f"Priority questions: {additional_prompts or 'None'}\n\n"
-                f"Submission materials:\n{submission_context}\n\n"
-                f"Viva transcript:\n{transcript}"
+                f"Priority questions: {additional_prompts or 'None'}",
+                materials,
+                f"Viva transcript:\n{transcript}",
+                extra,
+                passages,
             ),
         },
     ]
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=messages,
-        temperature=0.3,
-    )
-    return (response.choices[0].message.content or "").strip()
+
+
+def generate_viva_feedback(session):
+    messages = _prepare_feedback_messages(session)
+    if messages is None:
+        return FALLBACK_FEEDBACK
+    return llm.complete(llm.TASK_FEEDBACK, messages, temperature=0.3, session=session)
+
+
+async def agenerate_viva_feedback(session):
+    messages = await sync_to_async(_prepare_feedback_messages)(session)
+    if messages is None:
+        return FALLBACK_FEEDBACK
+    return await llm.acomplete(llm.TASK_FEEDBACK, messages, temperature=0.3, session=session)
 
 
 def _build_knowledge_flag_context(session):
@@ -509,11 +1423,13 @@ def _build_knowledge_flag_context(session):
                 "question": (msg.text or "").strip(),
                 "model_answer": (msg.model_answer or "").strip(),
                 "responses": [],
+                "scores": [],
             }
         elif current:
             text = (msg.text or "").strip()
             if text:
                 current["responses"].append(text)
+                current["scores"].append(msg.answer_score)
     if current:
         qa_blocks.append(current)
 
@@ -531,19 +1447,53 @@ def _build_knowledge_flag_context(session):
     return {"context": "\n".join(lines).strip(), "blocks": qa_blocks}
 
 
-def generate_knowledge_flag(session):
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY")
+def _aggregate_answer_scores(blocks):
+    """The flag implied by the per-answer scores, or "" while any answer is unscored."""
+    if not blocks:
+        return ""
+    block_scores = []
+    for block in blocks:
+        scores = block.get("scores") or []
+        if any(score is None for score in scores):
+            return ""
+        block_scores.append(max(scores, default=0))
+    mean = sum(block_scores) / len(block_scores)
+    return next(label for threshold, label in ANSWER_SCORE_LABELS if mean >= threshold)
+
+
+def scored_knowledge_flag(session):
+    """
+    The knowledge flag aggregated from per-answer scores, scoring whatever is
+    left first; "" when scoring is off or some answer could not be scored.
+    """
+    if not ANSWER_SCORING:
+        return ""
+    complete_answer_scores(session)
+    blocks = _build_knowledge_flag_context(session).get("blocks", [])
+    label = _aggregate_answer_scores(blocks)
+    if not label:
+        return ""
+    return _apply_knowledge_flag_guardrails(label, _analyze_knowledge_flag_blocks(blocks))
+
 
+def _prepare_knowledge_flag(session):
+    """Returns (messages, analysis); messages is None when the flag is Unclear outright."""
     assignment = session.submission.assignment
-    submission_context = build_submission_context(session)
     qa_payload = _build_knowledge_flag_context(session)
     qa_context = qa_payload.get("context", "")
     blocks = qa_payload.get("blocks", [])
     if not qa_context:
-        return "Unclear"
+        return None, None
     analysis = _analyze_knowledge_flag_blocks(blocks)
+    compiled = get_compiled_context(session)
+    policy, materials, passages = _task_context(llm.TASK_KNOWLEDGE_FLAG, session, compiled, qa_context)
+    if PROMPT_LAYOUT == PROMPT_LAYOUT_PREFIX and policy == llm.CONTEXT_FULL:
+        messages = _prefix_task_messages(
+            compiled,
+            KNOWLEDGE_FLAG_SYSTEM_PROMPT,
+            _with_passages(f"Viva exchanges with reference answers:\n{qa_context}", passages),
+        )
+        return messages, analysis
 
     assignment_title = assignment.title or "Untitled assignment"
     assignment_desc = assignment.description or ""
@@ -552,25 +1502,121 @@ def generate_knowledge_flag(session):
         {"role": "system", "content": KNOWLEDGE_FLAG_SYSTEM_PROMPT},
         {
             "role": "user",
-            "content": (
+            "content": _joined(
                 f"Assignment: {assignment_title}\n"
-                f"Description: {assignment_desc}\n\n"
-                f"Submission materials:\n{submission_context}\n\n"
-                f"Viva exchanges with reference answers:\n{qa_context}"
+                f"Description: {assignment_desc}",
+                materials,
+                f"Viva exchanges with reference answers:\n{qa_context}",
+                passages,
             ),
         },
     ]
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=messages,
-        temperature=0.2,
-    )
-    raw = (response.choices[0].message.content or "").strip()
+    return messages, analysis
+
+
+def generate_knowledge_flag(session):
+    scored = scored_knowledge_flag(session)
+    if scored:
+        return scored
+    messages, analysis = _prepare_knowledge_flag(session)
+    if messages is None:
+        return "Unclear"
+    raw = llm.complete(llm.TASK_KNOWLEDGE_FLAG, messages, temperature=0.2, session=session)
     model_label = _normalize_knowledge_flag(raw) or "Unclear"
     return _apply_knowledge_flag_guardrails(model_label, analysis)
 
 
+async def agenerate_knowledge_flag(session):
+    scored = await sync_to_async(scored_knowledge_flag)(session)
+    if scored:
+        return scored
+    messages, analysis = await sync_to_async(_prepare_knowledge_flag)(session)
+    if messages is None:
+        return "Unclear"
+    raw = await llm.acomplete(llm.TASK_KNOWLEDGE_FLAG, messages, temperature=0.2, session=session)
+    model_label = _normalize_knowledge_flag(raw) or "Unclear"
+    return _apply_knowledge_flag_guardrails(model_label, analysis)
+
+
+def _prepare_evaluation(session):
+    """
+    Returns (messages, analysis) for the combined feedback and flag call, or
+    (None, None) when it does not apply: the fallback feedback is due, or
+    there are no exchanges to flag.
+    """
+    qa_payload = _build_knowledge_flag_context(session)
+    qa_context = qa_payload.get("context", "")
+    if not qa_context:
+        return None, None
+    messages = _prepare_feedback_messages(
+        session,
+        llm.TASK_EVALUATION,
+        EVALUATION_SYSTEM_PROMPT,
+        f"Viva exchanges with reference answers:\n{qa_context}",
+    )
+    if messages is None:
+        return None, None
+    return messages, _analyze_knowledge_flag_blocks(qa_payload.get("blocks", []))
+
+
+def parse_evaluation(raw_text, analysis):
+    """Returns (feedback, knowledge_flag) from the evaluation JSON, "" for a part that is missing."""
+    raw_text = (raw_text or "").strip()
+    try:
+        data = json.loads(raw_text)
+    except Exception:
+        match = re.search(r"\{.*\}", raw_text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except Exception:
+            data = {}
+    if not isinstance(data, dict):
+        data = {}
+    feedback_text = str(data.get("feedback") or "").strip()
+    model_label = _normalize_knowledge_flag(data.get("knowledge_flag"))
+    knowledge_flag = _apply_knowledge_flag_guardrails(model_label, analysis) if model_label else ""
+    return feedback_text, knowledge_flag
+
+
+def generate_viva_evaluation(session):
+    """
+    Returns (feedback, knowledge_flag) for a finished viva from one call. A
+    part that is "" was not produced and is left to its own generator; when
+    the flag comes from answer scores, only the feedback is left.
+    """
+    scored = scored_knowledge_flag(session)
+    if scored:
+        return "", scored
+    messages, analysis = _prepare_evaluation(session)
+    if messages is None:
+        return "", ""
+    raw_text = llm.complete(
+        llm.TASK_EVALUATION,
+        messages,
+        temperature=0.2,
+        session=session,
+        response_format={"type": "json_object"},
+    )
+    return parse_evaluation(raw_text, analysis)
+
+
+async def agenerate_viva_evaluation(session):
+    scored = await sync_to_async(scored_knowledge_flag)(session)
+    if scored:
+        return "", scored
+    messages, analysis = await sync_to_async(_prepare_evaluation)(session)
+    if messages is None:
+        return "", ""
+    raw_text = await llm.acomplete(
+        llm.TASK_EVALUATION,
+        messages,
+        temperature=0.2,
+        session=session,
+        response_format={"type": "json_object"},
+    )
+    return parse_evaluation(raw_text, analysis)
+
+
 # ---------------------------------------------------------
 # Start a viva session
 # ---------------------------------------------------------
@@ -636,6 +1682,21 @@ def viva_start(request, submission_id):
     if active:
         session = active
     else:
+        # Uploads are read in the background (tool.extraction); wait until every selected file has text.
+        pending_subs = extraction.not_ready(user_subs)
+        if included_set is not None:
+            pending_subs = pending_subs.filter(id__in=included_set)
+        pending_resources = extraction.not_ready(AssignmentResource.objects.filter(assignment=assignment))
+        if resource_set is not None:
+            pending_resources = pending_resources.filter(id__in=resource_set)
+        else:
+            pending_resources = pending_resources.filter(included=True)
+        if pending_subs.exists() or pending_resources.exists():
+            return JsonResponse({
+                "status": "processing",
+                "message": "Your files are still being processed. Try again in a moment.",
+            }, status=409)
+
         # Enforce attempt limit unless unlimited (max_attempts <= 0 or None)
         existing_attempts = VivaSession.objects.filter(
             submission__assignment=sub.assignment,
@@ -654,6 +1715,9 @@ def viva_start(request, submission_id):
     if not session.heartbeat_nonce:
         session.heartbeat_nonce = _new_heartbeat_nonce()
         session.save(update_fields=["heartbeat_nonce"])
+    # Resource-only vivas (and submissions uploaded before plans existed) get
+    # their plan here, while the student reads the opening guidance.
+    question_plans.queue_question_plan(sub)
 
     # Ensure submission links exist and apply inclusion choices
     bulk_links = []
@@ -736,45 +1800,133 @@ def viva_session(request, session_id):
 # ---------------------------------------------------------
 # Disabled endpoints (placeholder)
 # ---------------------------------------------------------
-@csrf_exempt
-def viva_send_message(request):
-    if request.method != "POST":
-        return HttpResponseBadRequest("POST required")
-
+def _load_send_payload(request):
     try:
-        payload = json.loads(request.body.decode("utf-8"))
+        return json.loads(request.body.decode("utf-8"))
     except Exception:
-        payload = request.POST
+        return request.POST
 
-    session_id = payload.get("session_id")
+
+def _load_send_session(request, payload):
+    """
+    Validates a /viva/send/ request. Returns (session, early_response); when
+    early_response is set the request is rejected.
+    """
     sender = payload.get("sender", "student")
     text = (payload.get("text") or "").strip()
-    ended = payload.get("ended")
-    duration_seconds = payload.get("duration_seconds")
-    rating = payload.get("rating")
 
     try:
-        session = VivaSession.objects.select_related("submission__assignment").get(id=session_id)
+        session = VivaSession.objects.select_related("submission__assignment").get(id=payload.get("session_id"))
     except VivaSession.DoesNotExist:
-        return HttpResponseBadRequest("Invalid viva session ID")
+        return None, HttpResponseBadRequest("Invalid viva session ID")
 
     if request.session.get("lti_user_id") and str(request.session.get("lti_user_id")) != str(session.submission.user_id):
-        return HttpResponseBadRequest("Forbidden")
+        return session, HttpResponseBadRequest("Forbidden")
 
-    if text and (sender or "").lower() == "student" and not ended:
+    if text and (sender or "").lower() == "student" and not payload.get("ended"):
         if len(text) > MAX_VIVA_MESSAGE_CHARS:
-            return JsonResponse({
+            return session, JsonResponse({
                 "status": "error",
                 "message": f"Message too long (max {MAX_VIVA_MESSAGE_CHARS} characters). Please shorten your response.",
             }, status=400)
+    return session, None
+
+
+def _claim_turn_lock(session_id, holder):
+    expires_at = now() + timedelta(seconds=TURN_LOCK_LEASE_SECONDS)
+    return VivaSession.objects.filter(
+        Q(turn_lock_holder="") | Q(turn_lock_expires_at__lt=now()),
+        id=session_id,
+    ).update(turn_lock_holder=holder, turn_lock_expires_at=expires_at) > 0
+
+
+def release_turn_lock(session_id, holder):
+    VivaSession.objects.filter(id=session_id, turn_lock_holder=holder).update(
+        turn_lock_holder="",
+        turn_lock_expires_at=None,
+    )
+
+
+def acquire_turn_lock(session_id):
+    """Waits for the session's turn lock; returns its holder token, or None if it stayed busy."""
+    holder = secrets.token_hex(16)
+    deadline = time.monotonic() + TURN_LOCK_WAIT_SECONDS
+    while not _claim_turn_lock(session_id, holder):
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(TURN_LOCK_POLL_SECONDS)
+    return holder
+
+
+async def aacquire_turn_lock(session_id):
+    holder = secrets.token_hex(16)
+    deadline = time.monotonic() + TURN_LOCK_WAIT_SECONDS
+    while not await sync_to_async(_claim_turn_lock)(session_id, holder):
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(TURN_LOCK_POLL_SECONDS)
+    return holder
+
+
+def _busy_response():
+    return JsonResponse({
+        "status": "busy",
+        "message": "Your previous message is still being answered. Please try again in a moment.",
+    }, status=409)
+
+
+def _client_message_id(payload):
+    return str(payload.get("client_message_id") or "").strip()[:MAX_CLIENT_MESSAGE_ID_CHARS]
+
+
+def _replayed_response(session, msg, ended):
+    """
+    Response payload for a request whose client_message_id was already stored,
+    or None when the turn still needs its reply (the first attempt died before
+    saving one) or is an end-of-viva request, which is safe to run again.
+    """
+    if ended:
+        return None
+    if msg.sender.lower() != "student":
+        return {"status": "ok", "message_id": msg.id}
+    ai_msg = VivaMessage.objects.filter(session=session, sender="ai", id__gt=msg.id).order_by("id").first()
+    if ai_msg is None:
+        return None
+    return _reply_payload(msg, ai_msg, "ok", ai_msg.text, ai_msg.model_answer)
+
+
+def _record_viva_message(session, payload):
+    """
+    Persists the incoming message and any session updates for a validated
+    /viva/send/ request, holding the session's turn lock. Returns
+    (msg, ended, early_response); when early_response is set no AI work is
+    needed. A client_message_id seen before reuses the stored message.
+    """
+    sender = payload.get("sender", "student")
+    text = (payload.get("text") or "").strip()
+    ended = payload.get("ended")
+    duration_seconds = payload.get("duration_seconds")
+    rating = payload.get("rating")
+    client_message_id = _client_message_id(payload)
+
+    if client_message_id:
+        msg = VivaMessage.objects.filter(session=session, client_message_id=client_message_id).first()
+        if msg is not None:
+            replayed = _replayed_response(session, msg, ended)
+            return msg, ended, JsonResponse(replayed) if replayed is not None else None
 
     msg = None
     if text:
         msg = VivaMessage.objects.create(
             session=session,
             sender=sender[:20],
-            text=text
+            text=text,
+            client_message_id=client_message_id,
         )
+        if msg.sender.lower() == "ai":
+            advance_session_state(session, text)
+        elif msg.sender.lower() == "student" and ANSWER_SCORING and not ended:
+            queue_answer_scores(session)
 
     update_fields = []
     if rating is not None:
@@ -795,64 +1947,301 @@ def viva_send_message(request):
             session.duration_seconds = int((session.ended_at - session.started_at).total_seconds())
         update_fields.extend(["ended_at", "duration_seconds"])
         session.save(update_fields=update_fields)
+        return msg, ended, None
     elif update_fields:
         session.save(update_fields=update_fields)
 
-    if ended:
-        feedback_text = session.feedback_text or ""
-        if not feedback_text:
-            try:
-                feedback_text = generate_viva_feedback(session)
-            except Exception:
-                feedback_text = ""
-            if feedback_text:
-                session.feedback_text = feedback_text
-                session.save(update_fields=["feedback_text"])
-
-        if not (session.knowledge_flag or "").strip():
-            try:
-                knowledge_flag = generate_knowledge_flag(session)
-            except Exception:
-                knowledge_flag = ""
-            if knowledge_flag:
-                session.knowledge_flag = knowledge_flag
-                session.save(update_fields=["knowledge_flag"])
-
-        assignment = session.submission.assignment
-        feedback_visible = bool(assignment.ai_feedback_visible)
-
-        return JsonResponse({
-            "status": "ok",
-            "message_id": msg.id if msg else None,
-            "feedback_text": feedback_text if feedback_visible else "",
-            "feedback_visible": feedback_visible,
-        })
-
     if rating is not None or sender.lower() != "student" or not text:
-        return JsonResponse({
+        return msg, ended, JsonResponse({
             "status": "ok",
             "message_id": msg.id if msg else None,
         })
+    return msg, ended, None
+
+
+def _ended_payload(session, msg, feedback_text):
+    assignment = session.submission.assignment
+    feedback_visible = bool(assignment.ai_feedback_visible)
+    payload = {
+        "status": "ok",
+        "message_id": msg.id if msg else None,
+        "feedback_text": feedback_text if feedback_visible else "",
+        "feedback_visible": feedback_visible,
+        "evaluation_status": session.evaluation_status,
+    }
+    if assignment.enable_model_answers:
+        # Answers were filled after the questions were sent, so hand them to the page now.
+        payload["model_answers"] = [
+            {"id": msg_id, "text": text, "model_answer": model_answer}
+            for msg_id, text, model_answer in VivaMessage.objects.filter(session=session, sender="ai")
+            .exclude(model_answer="")
+            .order_by("timestamp", "id")
+            .values_list("id", "text", "model_answer")
+        ]
+    return payload
+
+
+def _save_evaluation(session, feedback_text, knowledge_flag):
+    """Stores whichever parts of a combined evaluation were produced and not already set."""
+    update_fields = []
+    if feedback_text and not session.feedback_text:
+        session.feedback_text = feedback_text
+        update_fields.append("feedback_text")
+    if knowledge_flag and not (session.knowledge_flag or "").strip():
+        session.knowledge_flag = knowledge_flag
+        update_fields.append("knowledge_flag")
+    if update_fields:
+        session.save(update_fields=update_fields)
+
+
+def _finish_evaluation(session):
+    """
+    Marks the evaluation ready and seals the session once it has feedback and
+    a knowledge flag. Otherwise (e.g. the provider was down) marks it failed
+    and leaves it unsealed, for sweep_viva_sessions --retry-failed.
+    """
+    if session.feedback_text and (session.knowledge_flag or "").strip():
+        session.evaluation_status = STATUS_READY
+        session.save(update_fields=["evaluation_status"])
+        archives.seal_quietly(session)
+        return
+    logger.warning("Evaluation of viva session %s is incomplete; marking it failed", session.id)
+    session.evaluation_status = STATUS_FAILED
+    session.save(update_fields=["evaluation_status"])
+
+
+def evaluate_session(session):
+    """
+    Writes whatever an ended viva still lacks: model answers, feedback and
+    the knowledge flag. Returns the feedback text.
+    """
+    complete_model_answers(session)
+    if EVALUATION_MODE == EVALUATION_COMBINED and not session.feedback_text and not (session.knowledge_flag or "").strip():
+        try:
+            _save_evaluation(session, *generate_viva_evaluation(session))
+        except Exception:
+            logger.exception("Combined evaluation of viva session %s failed", session.id)
+    feedback_text = session.feedback_text or ""
+    if not feedback_text:
+        try:
+            feedback_text = generate_viva_feedback(session)
+        except Exception:
+            logger.exception("Feedback for viva session %s failed", session.id)
+            feedback_text = ""
+        if feedback_text:
+            session.feedback_text = feedback_text
+            session.save(update_fields=["feedback_text"])
+
+    if not (session.knowledge_flag or "").strip():
+        try:
+            knowledge_flag = generate_knowledge_flag(session)
+        except Exception:
+            logger.exception("Knowledge flag for viva session %s failed", session.id)
+            knowledge_flag = ""
+        if knowledge_flag:
+            session.knowledge_flag = knowledge_flag
+            session.save(update_fields=["knowledge_flag"])
+
+    _finish_evaluation(session)
+    return feedback_text
+
+
+async def aevaluate_session(session):
+    await sync_to_async(complete_model_answers)(session)
+    if EVALUATION_MODE == EVALUATION_COMBINED and not session.feedback_text and not (session.knowledge_flag or "").strip():
+        try:
+            evaluation = await agenerate_viva_evaluation(session)
+            await sync_to_async(_save_evaluation)(session, *evaluation)
+        except Exception:
+            logger.exception("Combined evaluation of viva session %s failed", session.id)
+    feedback_text = session.feedback_text or ""
+    if not feedback_text:
+        try:
+            feedback_text = await agenerate_viva_feedback(session)
+        except Exception:
+            logger.exception("Feedback for viva session %s failed", session.id)
+            feedback_text = ""
+        if feedback_text:
+            session.feedback_text = feedback_text
+            await session.asave(update_fields=["feedback_text"])
+
+    if not (session.knowledge_flag or "").strip():
+        try:
+            knowledge_flag = await agenerate_knowledge_flag(session)
+        except Exception:
+            logger.exception("Knowledge flag for viva session %s failed", session.id)
+            knowledge_flag = ""
+        if knowledge_flag:
+            session.knowledge_flag = knowledge_flag
+            await session.asave(update_fields=["knowledge_flag"])
 
-    status = "ok"
-    error_message = None
+    await sync_to_async(_finish_evaluation)(session)
+    return feedback_text
+
+
+def run_evaluation(session_id):
+    """
+    Evaluates one ended session; the background job behind queue_evaluation.
+    The caller must hold the session's claim_evaluation lock.
+    """
     try:
-        ai_text, model_answer = generate_viva_reply(session)
-    except Exception as exc:
-        status = "error"
-        error_message = str(exc)
-        ai_text = FALLBACK_AI_REPLY
-        model_answer = ""
+        session = VivaSession.objects.select_related("submission__assignment").filter(id=session_id).first()
+        if session is None:
+            return
+        try:
+            evaluate_session(session)
+        except Exception:
+            VivaSession.objects.filter(id=session_id).update(evaluation_status=STATUS_FAILED)
+            raise
+    finally:
+        cache.delete(f"viva_evaluation:{session_id}")
 
-    ai_msg = None
-    if ai_text:
-        ai_msg = VivaMessage.objects.create(
-            session=session,
-            sender="ai",
-            text=ai_text,
-            model_answer=model_answer or "",
-        )
 
+def claim_evaluation(session_id):
+    """
+    Takes the lock that run_evaluation releases when it finishes. False if
+    the session's evaluation is already running somewhere.
+    """
+    return cache.add(f"viva_evaluation:{session_id}", 1, 600)
+
+
+def queue_evaluation(session):
+    """Marks the session's evaluation pending and runs it in the background unless it is already running."""
+    session.evaluation_status = STATUS_PENDING
+    VivaSession.objects.filter(id=session.id).update(evaluation_status=STATUS_PENDING)
+    if not claim_evaluation(session.id):
+        return False
+    tasks.submit(run_evaluation, session.id)
+    return True
+
+
+def _end_viva(session, msg):
+    if not BACKGROUND_EVALUATION:
+        return _ended_payload(session, msg, evaluate_session(session))
+    # A repeated end request must not queue a second evaluation.
+    if session.evaluation_status not in (STATUS_PENDING, STATUS_READY):
+        queue_evaluation(session)
+    return _ended_payload(session, msg, session.feedback_text or "")
+
+
+async def _aend_viva(session, msg):
+    if not BACKGROUND_EVALUATION:
+        feedback_text = await aevaluate_session(session)
+        return await sync_to_async(_ended_payload)(session, msg, feedback_text)
+    return await sync_to_async(_end_viva)(session, msg)
+
+
+def viva_evaluation(request, session_id):
+    """Polled by the student page after a viva ends until its evaluation is no longer pending."""
+    try:
+        session = VivaSession.objects.select_related("submission__assignment").get(id=session_id)
+    except VivaSession.DoesNotExist:
+        return HttpResponseBadRequest("Invalid viva session ID")
+    if request.session.get("lti_user_id") and str(request.session.get("lti_user_id")) != str(session.submission.user_id):
+        return HttpResponseBadRequest("Forbidden")
+    return JsonResponse(_ended_payload(session, None, session.feedback_text or ""))
+
+
+@csrf_exempt
+def viva_send_message(request):
+    if request.method != "POST":
+        return HttpResponseBadRequest("POST required")
+
+    payload = _load_send_payload(request)
+    session, early_response = _load_send_session(request, payload)
+    if early_response is not None:
+        return early_response
+
+    holder = acquire_turn_lock(session.id)
+    if holder is None:
+        return _busy_response()
+    streaming = False
+    try:
+        msg, ended, early_response = _record_viva_message(session, payload)
+        if early_response is not None:
+            return early_response
+
+        if ended:
+            return JsonResponse(_end_viva(session, msg))
+
+        if _wants_stream(request, payload):
+            # The stream releases the lock once the reply has been saved.
+            streaming = True
+            return _stream_viva_reply_response(session, msg, holder)
+
+        status = "ok"
+        error_message = None
+        try:
+            ai_text, model_answer = generate_viva_reply(session)
+        except Exception as exc:
+            status, error_message, ai_text, model_answer = _failed_reply(exc)
+
+        response_payload = _save_ai_reply(session, msg, status, ai_text, model_answer, error_message)
+        return JsonResponse(response_payload, status=500 if status == "error" else 200)
+    finally:
+        if not streaming:
+            release_turn_lock(session.id, holder)
+
+
+@csrf_exempt
+async def viva_send_message_async(request):
+    """
+    Async twin of viva_send_message used by the ASGI entry point, so a pending
+    completion no longer pins a worker thread for the length of the call.
+    """
+    if request.method != "POST":
+        return HttpResponseBadRequest("POST required")
+
+    payload = _load_send_payload(request)
+    session, early_response = await sync_to_async(_load_send_session)(request, payload)
+    if early_response is not None:
+        return early_response
+
+    holder = await aacquire_turn_lock(session.id)
+    if holder is None:
+        return _busy_response()
+    streaming = False
+    try:
+        msg, ended, early_response = await sync_to_async(_record_viva_message)(session, payload)
+        if early_response is not None:
+            return early_response
+
+        if ended:
+            return JsonResponse(await _aend_viva(session, msg))
+
+        if _wants_stream(request, payload):
+            streaming = True
+            return _astream_viva_reply_response(session, msg, holder)
+
+        status = "ok"
+        error_message = None
+        try:
+            ai_text, model_answer = await agenerate_viva_reply(session)
+        except Exception as exc:
+            status, error_message, ai_text, model_answer = _failed_reply(exc)
+
+        response_payload = await _asave_ai_reply(session, msg, status, ai_text, model_answer, error_message)
+        return JsonResponse(response_payload, status=500 if status == "error" else 200)
+    finally:
+        if not streaming:
+            await sync_to_async(release_turn_lock)(session.id, holder)
+
+
+def _failed_reply(exc):
+    """Returns (status, error, ai_text, model_answer) for a turn whose generation raised."""
+    if isinstance(exc, llm.LLMUnavailable):
+        # Provider is degraded: keep the viva moving with the stock follow-up.
+        return "ok", None, FALLBACK_AI_REPLY, ""
+    return "error", str(exc), FALLBACK_AI_REPLY, ""
+
+
+def _wants_stream(request, payload):
+    if "text/event-stream" in (request.headers.get("accept") or ""):
+        return True
+    return str(payload.get("stream") or "").lower() in ["1", "true", "yes", "on"]
+
+
+def _reply_payload(msg, ai_msg, status, ai_text, model_answer, error_message=None):
     response_payload = {
         "status": status,
         "message_id": msg.id if msg else None,
@@ -862,8 +2251,125 @@ def viva_send_message(request):
     }
     if error_message:
         response_payload["error"] = error_message
+    return response_payload
+
 
-    return JsonResponse(response_payload, status=500 if status == "error" else 200)
+def _after_ai_reply(session, ai_msg):
+    advance_session_state(session, ai_msg.text)
+    queue_history_summary(session)
+    if not ai_msg.model_answer and session.submission.assignment.enable_model_answers:
+        queue_model_answers(session)
+
+
+def _save_ai_reply(session, msg, status, ai_text, model_answer, error_message=None):
+    ai_msg = None
+    if ai_text:
+        ai_msg = VivaMessage.objects.create(
+            session=session,
+            sender="ai",
+            text=ai_text,
+            model_answer=model_answer or "",
+        )
+        _after_ai_reply(session, ai_msg)
+    return _reply_payload(msg, ai_msg, status, ai_text, model_answer, error_message)
+
+
+async def _asave_ai_reply(session, msg, status, ai_text, model_answer, error_message=None):
+    ai_msg = None
+    if ai_text:
+        ai_msg = await VivaMessage.objects.acreate(
+            session=session,
+            sender="ai",
+            text=ai_text,
+            model_answer=model_answer or "",
+        )
+        await sync_to_async(_after_ai_reply)(session, ai_msg)
+    return _reply_payload(msg, ai_msg, status, ai_text, model_answer, error_message)
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class _TurnStreamingResponse(StreamingHttpResponse):
+    """
+    A streamed viva reply that also frees the session's turn lock when the
+    server closes the response, in case the stream never started (e.g. the
+    client went away first) and so never reached its own finally.
+    """
+
+    def __init__(self, streaming_content, *, session_id, holder, **kwargs):
+        super().__init__(streaming_content, **kwargs)
+        self.turn_lock = (session_id, holder)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            release_turn_lock(*self.turn_lock)
+
+
+def _stream_viva_reply_response(session, msg, holder):
+    def event_stream():
+        status = "ok"
+        error_message = None
+        ai_text = ""
+        model_answer = ""
+        try:
+            try:
+                for event in stream_viva_reply(session):
+                    if event[0] == "delta":
+                        yield _sse_event("delta", {"text": event[1]})
+                    else:
+                        _, ai_text, model_answer = event
+            except Exception as exc:
+                status, error_message, ai_text, model_answer = _failed_reply(exc)
+            # The reply is only persisted once the stream has finished.
+            response_payload = _save_ai_reply(session, msg, status, ai_text, model_answer, error_message)
+            yield _sse_event("done", response_payload)
+        finally:
+            release_turn_lock(session.id, holder)
+
+    response = _TurnStreamingResponse(
+        event_stream(),
+        session_id=session.id,
+        holder=holder,
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _astream_viva_reply_response(session, msg, holder):
+    async def event_stream():
+        status = "ok"
+        error_message = None
+        ai_text = ""
+        model_answer = ""
+        try:
+            try:
+                async for event in astream_viva_reply(session):
+                    if event[0] == "delta":
+                        yield _sse_event("delta", {"text": event[1]})
+                    else:
+                        _, ai_text, model_answer = event
+            except Exception as exc:
+                status, error_message, ai_text, model_answer = _failed_reply(exc)
+            response_payload = await _asave_ai_reply(session, msg, status, ai_text, model_answer, error_message)
+            yield _sse_event("done", response_payload)
+        finally:
+            await sync_to_async(release_turn_lock)(session.id, holder)
+
+    response = _TurnStreamingResponse(
+        event_stream(),
+        session_id=session.id,
+        holder=holder,
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 def viva_feedback_update(request, session_id):
@@ -987,6 +2493,7 @@ def viva_toggle_submission(request):
     if not created and link.included != included:
         link.included = included
         link.save(update_fields=["included"])
+    invalidate_session_context(session.id)
 
     return JsonResponse({"status": "ok", "included": link.included})
 
@@ -1040,6 +2547,7 @@ def viva_toggle_resource(request):
     if not created and link.included != included:
         link.included = included
         link.save(update_fields=["included"])
+    invalidate_session_context(session.id)
 
     AssignmentResourcePreference.objects.update_or_create(
         resource=resource,
@@ -1206,18 +2714,23 @@ def viva_logs(request, session_id):
 # ---------------------------------------------------------
 # Integrity Flags (kept for dashboard summaries)
 # ---------------------------------------------------------
-def compute_integrity_flags(session):
+def session_logs(session):
+    """The session's interaction logs: those tagged with it, else those logged while it ran."""
     logs = InteractionLog.objects.filter(
         submission=session.submission
     ).order_by("timestamp")
 
     logs_by_session = logs.filter(event_data__session_id=session.id)
     if logs_by_session.exists():
-        logs = logs_by_session
-    else:
-        logs = logs.filter(timestamp__gte=session.started_at)
-        if session.ended_at:
-            logs = logs.filter(timestamp__lte=session.ended_at)
+        return logs_by_session
+    logs = logs.filter(timestamp__gte=session.started_at)
+    if session.ended_at:
+        logs = logs.filter(timestamp__lte=session.ended_at)
+    return logs
+
+
+def compute_integrity_flags(session):
+    logs = session_logs(session)
 
     assignment = session.submission.assignment
     flags = []